@@ -0,0 +1,347 @@
+"""
+Archive of the raw opensensemap responses (record and replay).
+
+collect_data --archive: every response of the opensensemap api is stored as it came from the api, compressed
+(zstd, gzip when the package 'zstandard' is missing) and content addressed: objects/ab/abcdef....json.zst, the name
+is the sha256 of the body, the same answer is stored once. manifest.jsonl maps the requests to the objects.
+
+collect_data --replay: the same pipeline (get_sensebox_data, bulk, influx writer) runs against the archive instead
+of the api. No network, same input on every run -> deterministic benchmarks, re-ingest after a change of the
+transformation.
+
+The archive is plugged into the shared httpx clients (core/clients.py) as transport. Every request is kept with its
+full url (from-date and to-date included), each run adds its own entries. A replay asks for other dates than the
+recorded runs: it gets the values of all entries of the same request that fall into the requested range, merged.
+
+The box snapshot of every location is archived with each run, a replay takes its boxes from there (all boxes of all
+recorded runs). A replay doesn't need the live snapshot, the catalog or postgres.
+"""
+
+import gzip
+import hashlib
+import json
+import os
+from datetime import datetime, timezone
+from urllib.parse import parse_qsl, urlencode, urlparse
+
+import httpx
+from django.conf import settings
+
+from core import clients
+
+try:
+    import zstandard
+
+    zstd_available = True
+except ImportError:
+    zstd_available = False
+
+# query parameters depending on the time of the run
+volatile_params = {"from-date", "to-date"}
+wire_headers = {"content-encoding", "content-length", "transfer-encoding"}
+
+# set by use_archive(), get_boxes_for_ingest() archives the box snapshots or replays them
+current: "Archive | None" = None
+
+
+def request_key(method: str, url: str) -> str:
+    """the full request, dates included"""
+    parsed = urlparse(url)
+    params = sorted(parse_qsl(parsed.query, keep_blank_values=True))
+    return f"{method.upper()} {parsed.path}?{urlencode(params)}"
+
+
+def series_key(method: str, url: str) -> str:
+    """same request at another time (other from-date and to-date) = same series"""
+    parsed = urlparse(url)
+    params = sorted((k, v) for k, v in parse_qsl(parsed.query, keep_blank_values=True) if k not in volatile_params)
+    return f"{method.upper()} {parsed.path}?{urlencode(params)}"
+
+
+def parse_time(value: str | None) -> datetime | None:
+    if not value:
+        return None
+    try:
+        parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+
+def request_range(url: str) -> tuple[datetime | None, datetime | None]:
+    """from-date and to-date of the request, None: open"""
+    params = dict(parse_qsl(urlparse(url).query, keep_blank_values=True))
+    return parse_time(params.get("from-date")), parse_time(params.get("to-date"))
+
+
+def entry_range(entry: dict) -> tuple[datetime | None, datetime | None]:
+    """the values an entry can hold: from-date until to-date, without to-date until it was recorded"""
+    start, end = request_range(entry["url"])
+    return start, end or parse_time(entry["recorded_at"])
+
+
+def in_range(created_at: str | None, start: datetime | None, end: datetime | None) -> bool:
+    timestamp = parse_time(created_at)
+    if timestamp is None:
+        return True
+    return (start is None or timestamp >= start) and (end is None or timestamp <= end)
+
+
+def merge_json(bodies: list[bytes], start: datetime | None, end: datetime | None) -> bytes | None:
+    """measurements of several runs -> one list, each value once, newest first (like the api). None: no list"""
+    values = {}
+    for body in bodies:
+        data = json.loads(body)
+        if not isinstance(data, list):
+            return None
+        for item in data:
+            if isinstance(item, dict) and "createdAt" in item:
+                if in_range(item["createdAt"], start, end):
+                    values[item["createdAt"]] = item
+    return json.dumps([values[key] for key in sorted(values, reverse=True)]).encode()
+
+
+def merge_csv(bodies: list[bytes], start: datetime | None, end: datetime | None) -> bytes:
+    """csv downloads of several runs -> one csv, each line once"""
+    header = None
+    lines = {}
+    for body in bodies:
+        body_lines = body.decode().splitlines()
+        if not body_lines:
+            continue
+        header = header or body_lines[0]
+        columns = body_lines[0].split(",")
+        position = columns.index("createdAt") if "createdAt" in columns else None
+        for line in body_lines[1:]:
+            if not line.strip():
+                continue
+            fields = line.split(",")
+            created_at = fields[position] if position is not None and position < len(fields) else None
+            if in_range(created_at, start, end):
+                lines[line] = None
+    if header is None:
+        return b""
+    return "\n".join([header, *lines]).encode() + b"\n"
+
+
+def compress(data: bytes) -> tuple[bytes, str]:
+    if zstd_available:
+        return zstandard.ZstdCompressor(level=10).compress(data), "zst"
+    return gzip.compress(data), "gz"
+
+
+def decompress(data: bytes, suffix: str) -> bytes:
+    if suffix == "zst":
+        if not zstd_available:
+            raise RuntimeError("Archive object is zstd compressed, install the package 'zstandard'")
+        return zstandard.ZstdDecompressor().decompress(data)
+    return gzip.decompress(data)
+
+
+def content_suffix(content_type: str) -> str:
+    if "csv" in content_type:
+        return "csv"
+    if "json" in content_type:
+        return "json"
+    return "bin"
+
+
+class Archive:
+    def __init__(self, path: str | None = None):
+        self.path = path or settings.INGEST_ARCHIVE_DIR
+        self.manifest_path = os.path.join(self.path, "manifest.jsonl")
+        self.replay = False
+        self.recorded = 0
+        self.replayed = 0
+        self.missing = 0
+
+    def store_object(self, body: bytes, suffix: str) -> str:
+        """-> path of the object, relative to the archive"""
+        digest = hashlib.sha256(body).hexdigest()
+        data, compression = compress(body)
+        name = f"{digest}.{suffix}.{compression}"
+        object_path = os.path.join(self.path, "objects", digest[:2], name)
+
+        if not os.path.exists(object_path):
+            os.makedirs(os.path.dirname(object_path), exist_ok=True)
+            # written under another name first, a replay never sees half an object
+            tmp_path = f"{object_path}.{os.getpid()}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, object_path)
+        return os.path.relpath(object_path, self.path)
+
+    def append(self, entry: dict) -> None:
+        # one line per write, appends of several processes (collect_data --processes) do not mix
+        with open(self.manifest_path, "a") as f:
+            f.write(json.dumps(entry) + "\n")
+
+    def store(self, request: httpx.Request, status_code: int, content_type: str, body: bytes) -> None:
+        self.append(
+            {
+                "key": request_key(request.method, str(request.url)),
+                "series": series_key(request.method, str(request.url)),
+                "url": str(request.url),
+                "status": status_code,
+                "content_type": content_type,
+                "object": self.store_object(body, content_suffix(content_type)),
+                "size": len(body),
+                "recorded_at": datetime.now(timezone.utc).isoformat(),
+            }
+        )
+        self.recorded += 1
+
+    def store_snapshot(self, location_name: str, boxes: list[dict]) -> None:
+        """box snapshot of a location (records of build_box_snapshot()), once per run"""
+        body = json.dumps(boxes, default=str).encode()
+        self.append(
+            {
+                "snapshot": location_name,
+                "object": self.store_object(body, "json"),
+                "size": len(body),
+                "recorded_at": datetime.now(timezone.utc).isoformat(),
+            }
+        )
+
+    def load_snapshot(self, location_name: str) -> list[dict]:
+        """all boxes of all archived snapshots of the location, the newest version of every box"""
+        boxes = {}
+        for entry in self.load_entries():
+            if entry.get("snapshot") == location_name:
+                for box in json.loads(self.read(entry)):
+                    boxes[box["_id"]] = box
+        return list(boxes.values())
+
+    def load_entries(self) -> list[dict]:
+        """all entries, oldest first"""
+        if not os.path.exists(self.manifest_path):
+            raise FileNotFoundError(f"No archive found in {self.path} (manifest.jsonl is missing)")
+
+        with open(self.manifest_path) as f:
+            return [json.loads(line) for line in f if line.strip()]
+
+    def load_manifest(self) -> dict[str, list[dict]]:
+        """series -> all recorded responses of the request, oldest first"""
+        series = {}
+        for entry in self.load_entries():
+            if "snapshot" in entry:
+                continue
+            # entries of older archives have no series, their key was the series
+            series.setdefault(entry.get("series", entry["key"]), []).append(entry)
+        return series
+
+    def oldest_recording(self) -> datetime | None:
+        times = [datetime.fromisoformat(entry["recorded_at"]) for entry in self.load_entries()]
+        return min(times, default=None)
+
+    def read(self, entry: dict) -> bytes:
+        with open(os.path.join(self.path, entry["object"]), "rb") as f:
+            return decompress(f.read(), entry["object"].rsplit(".", 1)[-1])
+
+    def summary(self) -> str:
+        return f"Archive {self.path}: {self.recorded} recorded, {self.replayed} replayed, {self.missing} not in archive"
+
+
+class RecordingTransport(httpx.AsyncBaseTransport):
+    """network as usual, every answer is written to the archive"""
+
+    def __init__(self, archive: Archive, transport: httpx.AsyncBaseTransport):
+        self.archive = archive
+        self.transport = transport
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        response = await self.transport.handle_async_request(request)
+
+        # read completely (also for client.stream), the caller gets the same body from memory
+        body = await response.aread()
+        await response.aclose()
+
+        content_type = response.headers.get("content-type", "")
+        if response.status_code == 200:
+            self.archive.store(request, response.status_code, content_type, body)
+
+        # the body is decoded already, length and encoding of the wire do not fit anymore
+        headers = [(k, v) for k, v in response.headers.items() if k.lower() not in wire_headers]
+        return httpx.Response(
+            response.status_code,
+            headers=headers,
+            content=body,
+            request=request,
+            extensions={"http_version": response.extensions.get("http_version", b"HTTP/1.1")},
+        )
+
+    async def aclose(self) -> None:
+        await self.transport.aclose()
+
+
+class ReplayTransport(httpx.AsyncBaseTransport):
+    """
+    answers from the archive, no network. The values of all recorded runs of the request that fall into the
+    requested range, merged. Requests not in the archive get a 404
+    """
+
+    def __init__(self, archive: Archive):
+        self.archive = archive
+        self.series = archive.load_manifest()
+
+    def body(self, url: str, entries: list[dict]) -> tuple[dict, bytes]:
+        """-> (entry for status and content type, body)"""
+        start, end = request_range(url)
+        if start is None and end is None:
+            # no range (catalog, ...): the newest answer
+            return entries[-1], self.archive.read(entries[-1])
+
+        matching = []
+        for entry in entries:
+            entry_start, entry_end = entry_range(entry)
+            if (end is None or entry_start is None or entry_start <= end) and (
+                start is None or entry_end is None or entry_end >= start
+            ):
+                matching.append(entry)
+        if not matching:
+            # known request, but nothing recorded in this range: an empty answer, like the api
+            matching = entries[-1:]
+
+        newest = matching[-1]
+        bodies = [self.archive.read(entry) for entry in matching]
+        if "csv" in newest["content_type"]:
+            return newest, merge_csv(bodies, start, end)
+        merged = merge_json(bodies, start, end)
+        return newest, bodies[-1] if merged is None else merged
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        url = str(request.url)
+        entries = self.series.get(series_key(request.method, url))
+        answer = self.body(url, entries) if entries else None
+        if answer is None:
+            self.archive.missing += 1
+            return httpx.Response(404, text="not in archive", request=request)
+
+        entry, body = answer
+        self.archive.replayed += 1
+        return httpx.Response(
+            entry["status"],
+            headers={"content-type": entry["content_type"]},
+            content=body,
+            request=request,
+        )
+
+
+def use_archive(archive: Archive, replay: bool = False) -> None:
+    """route the opensensemap requests of this process through the archive (management commands only)"""
+    global current
+
+    api_host = urlparse(settings.OPENSENSEMAP_API_URL).netloc
+    os.makedirs(archive.path, exist_ok=True)
+    archive.replay = replay
+    current = archive
+
+    def transport_factory(host: str, client_kwargs: dict) -> httpx.AsyncBaseTransport | None:
+        if host != api_host:
+            return None  # tiles, geocoding, ... as usual
+        if replay:
+            return ReplayTransport(archive)
+        network = httpx.AsyncHTTPTransport(http2=client_kwargs["http2"], limits=client_kwargs["limits"])
+        return RecordingTransport(archive, network)
+
+    clients.transport_factory = transport_factory
@@ -0,0 +1,250 @@
+"""
+Historical backfill (manage.py backfill).
+
+The date range is split into windows (aligned to multiples of the window size, so two runs with different ranges
+share their windows). One job = one title of one box (its sensors, averaged) in one window. The jobs run through
+the ingest scheduler (rate limit, concurrency cap, retries) and are written by the batched InfluxWriter. A window is
+checkpointed (BackfillWindow) after its values are in influx -> a restarted backfill continues with the missing windows.
+
+opensensemap returns at most 10000 values per request, a full window is split in halves until it fits.
+"""
+
+import asyncio
+import time
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+import pandas as pd
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+from core.influx import InfluxWriter
+from core.parse import minute_means, parse_sensor_response
+from core.scheduler import IngestScheduler
+from core.sensor_names import load_sensor_aliases, normalize_sensor
+from core.tools import (
+    filter_sensors,
+    get_box_snapshots,
+    load_phenomenon_allowlists,
+)
+from home.models import BackfillWindow
+
+api_value_limit = 10000  # values per request of /boxes/{box}/data/{sensor}
+min_window = timedelta(minutes=10)  # a window with more values than the limit is not split any further
+
+
+def backfill_windows(start: datetime, end: datetime, window: timedelta) -> list[tuple[datetime, datetime]]:
+    """[start, end) in windows aligned to the epoch. The first and the last window are cut to the range"""
+    epoch = datetime(1970, 1, 1, tzinfo=timezone.utc)
+    window_start = epoch + ((start - epoch) // window) * window
+
+    windows = []
+    while window_start < end:
+        window_end = window_start + window
+        windows.append((max(start, window_start), min(end, window_end)))
+        window_start = window_end
+    return windows
+
+
+def api_time(value: datetime) -> str:
+    return value.astimezone(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+class BackfillReport:
+    def __init__(self, jobs: int, skipped: int):
+        self.started = time.monotonic()
+        self.jobs = jobs
+        self.skipped = skipped  # completed by an earlier run
+        self.done = 0
+        self.empty = 0
+        self.failed = 0
+        self.values = 0
+
+    def __str__(self):
+        elapsed = time.monotonic() - self.started
+        return (
+            f"Backfill: {self.done}/{self.jobs} windows done ({self.empty} empty), {self.failed} failed, "
+            f"{self.skipped} completed before, {self.values} values in {elapsed:.1f} s"
+        )
+
+
+async def load_completed_windows(box_ids: list[str], start: datetime, end: datetime) -> set[tuple]:
+    windows = BackfillWindow.objects.filter(
+        sensebox_id__in=box_ids, window_start__gte=start - timedelta(days=1), window_end__lte=end + timedelta(days=1)
+    ).values_list("sensebox_id", "sensor_id", "window_start", "window_end")
+    return {window async for window in windows}
+
+
+def save_checkpoints(windows: list[BackfillWindow]) -> None:
+    BackfillWindow.objects.bulk_create(
+        windows,
+        update_conflicts=True,
+        unique_fields=["sensebox_id", "sensor_id", "window_start", "window_end"],
+        update_fields=["points", "completed_at"],
+    )
+
+
+async def fetch_window(
+    box_id: str, sensor_id: str, start: datetime, end: datetime, scheduler: IngestScheduler
+) -> tuple[np.ndarray, np.ndarray]:
+    """all values of the sensor in [start, end): timestamps (int64 ns UTC) and values"""
+    url = (
+        f"{settings.OPENSENSEMAP_API_URL}/boxes/{box_id}/data/{sensor_id}"
+        f"?format=json&from-date={api_time(start)}&to-date={api_time(end)}"
+    )
+    response = await scheduler.get(url)
+    response.raise_for_status()
+    timestamps, values = parse_sensor_response(response.content)
+
+    if len(timestamps) >= api_value_limit and end - start > min_window:
+        # cut off by the api: the two halves on their own
+        middle = start + (end - start) / 2
+        halves = await asyncio.gather(
+            fetch_window(box_id, sensor_id, start, middle, scheduler),
+            fetch_window(box_id, sensor_id, middle, end, scheduler),
+        )
+        return np.concatenate([half[0] for half in halves]), np.concatenate([half[1] for half in halves])
+
+    return timestamps, values
+
+
+def window_frame(sensor_values: list[tuple[np.ndarray, np.ndarray]], title: str) -> pd.DataFrame:
+    """
+    same layout as get_sensebox_data(): index createdAt (minutes, UTC), one column, mean per minute.
+    sensor_values: (timestamps, values) of every sensor of the box with this title -> mean of the sensors
+    """
+    means = [minute_means(timestamps, values) for timestamps, values in sensor_values if len(timestamps)]
+    if not means:
+        return pd.DataFrame()
+
+    column = means[0] if len(means) == 1 else pd.concat(means, axis=1, sort=True).mean(axis=1)
+    frame = column.to_frame(title)
+    frame.index.name = "createdAt"
+    return frame
+
+
+async def run_backfill(
+    boxes: pd.DataFrame,
+    start: datetime,
+    end: datetime,
+    window: timedelta,
+    scheduler: IngestScheduler | None = None,
+    workers: int | None = None,
+) -> BackfillReport:
+    """boxes: layout of the box snapshot (_id, name, sensors)"""
+    scheduler = scheduler or IngestScheduler()
+    workers = workers or scheduler.max_concurrency
+
+    await load_sensor_aliases()
+    windows = backfill_windows(start, end, window)
+    completed = await load_completed_windows(boxes["_id"].tolist(), start, end)
+
+    # one influx field per title: sensors of a box with the same title are fetched together and averaged,
+    # one sensor alone would overwrite the values of the other
+    titles = []  # (box id, title, [sensor ids])
+    for index, box in boxes.iterrows():
+        sensors_by_title = {}
+        for sensor in box["sensors"]:
+            title, unit = normalize_sensor(sensor["title"], sensor["unit"])
+            sensors_by_title.setdefault(title, []).append(sensor["_id"])
+        titles.extend((box["_id"], title, sensor_ids) for title, sensor_ids in sensors_by_title.items())
+
+    # oldest windows first, all boxes side by side: the history fills up from the start of the range
+    jobs = []
+    skipped = 0
+    for window_start, window_end in windows:
+        for box_id, title, sensor_ids in titles:
+            if all((box_id, sensor_id, window_start, window_end) in completed for sensor_id in sensor_ids):
+                skipped += 1
+                continue
+            jobs.append((box_id, sensor_ids, title, window_start, window_end))
+
+    report = BackfillReport(len(jobs), skipped)
+    print(
+        f"Backfill {api_time(start)} - {api_time(end)}: {len(windows)} windows, {len(jobs)} jobs, "
+        f"{skipped} done before"
+    )
+    if not jobs:
+        return report
+
+    queue = asyncio.Queue()
+    for job in jobs:
+        queue.put_nowait(job)
+
+    influx_writer = InfluxWriter()
+    await influx_writer.start()
+
+    async def worker():
+        while True:
+            try:
+                box_id, sensor_ids, title, window_start, window_end = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+
+            try:
+                sensor_values = await asyncio.gather(
+                    *[fetch_window(box_id, sensor_id, window_start, window_end, scheduler) for sensor_id in sensor_ids]
+                )
+                df = window_frame(sensor_values, title)
+            except Exception as e:  # not checkpointed, the next run tries again
+                print(f">>>>>>>> Backfill {box_id}/{title} {api_time(window_start)} failed: {e!r}")
+                report.failed += 1
+                continue
+
+            checkpoints = [
+                BackfillWindow(
+                    sensebox_id=box_id,
+                    sensor_id=sensor_id,
+                    window_start=window_start,
+                    window_end=window_end,
+                    points=len(df),
+                )
+                for sensor_id in sensor_ids
+            ]
+
+            async def on_success(checkpoints=checkpoints):
+                await sync_to_async(save_checkpoints)(checkpoints)
+                report.done += 1
+
+            if df.empty:
+                report.empty += 1
+                await on_success()
+            else:
+                report.values += len(df)
+                await influx_writer.add(box_id, df, on_success=on_success)
+
+    monitor = asyncio.create_task(scheduler.monitor())
+    try:
+        await asyncio.gather(*[worker() for _ in range(workers)])
+    finally:
+        monitor.cancel()
+        await influx_writer.close()
+
+    print(scheduler.report())
+    print(report)
+    return report
+
+
+async def backfill(
+    region: str,
+    start: datetime,
+    end: datetime,
+    window: timedelta,
+    box_ids: list[str] | None = None,
+    max_concurrency: int | None = None,
+    rate: float | None = None,
+) -> BackfillReport | None:
+    """the boxes of the box snapshot (sync_metadata), only the sensors shown on the site"""
+    boxes = await get_box_snapshots(region)
+    if boxes.empty:
+        print("No boxes found, run sync_metadata first")
+        return None
+
+    if box_ids:
+        boxes = boxes[boxes["_id"].isin(box_ids)]
+    boxes, skipped_sensors = filter_sensors(boxes, await load_phenomenon_allowlists())
+    print(f"Backfill of {len(boxes)} boxes, {skipped_sensors} sensors not in the allowlist")
+
+    # own scheduler, the budget can be set lower than for the regular ingest running at the same time
+    scheduler = IngestScheduler(max_concurrency=max_concurrency, rate=rate)
+    return await run_backfill(boxes, start, end, window, scheduler)
@@ -0,0 +1,282 @@
+"""
+Bulk ingest: one streamed CSV request per location and phenomenon, instead of one request per sensor.
+
+/boxes/data?bbox=...&phenomenon=... returns the measurements of all boxes inside the bounding box.
+The bbox is derived from the SenseBoxLocation (center + maxDistance), so it covers a bit more than the circle
+of the catalog. Only the sensors of the boxes to collect are kept.
+
+The CSV is read line by line and parsed in chunks. Every chunk is reduced to sum and count per sensor and minute,
+so memory holds the aggregates, not the raw values. The result is one frame per box, same layout as
+get_sensebox_data() (index "createdAt", one column per sensor title, attrs box_id, box_name, watermarks).
+"""
+
+import asyncio
+import io
+import math
+import urllib.parse
+from datetime import datetime, timezone
+
+import pandas as pd
+from django.conf import settings
+
+from core.clients import get_client
+from core.scheduler import IngestScheduler
+from core.sensor_names import load_sensor_aliases, normalize_sensor
+from core.tools import watermark_to_timeframe
+from home.models import SenseBoxLocation
+
+bulk_columns = ["boxId", "sensorId", "createdAt", "value"]
+
+# meters per degree latitude
+meters_per_degree = 111320
+
+
+def location_bbox(location: SenseBoxLocation) -> str:
+    """bounding box around the location: lngSW,latSW,lngNE,latNE"""
+    lat = float(location.location_latitude)
+    lon = float(location.location_longitude)
+
+    distance = int(location.maxDistance)
+
+    d_lat = distance / meters_per_degree
+    d_lon = distance / (meters_per_degree * max(0.01, math.cos(math.radians(lat))))
+
+    return f"{lon - d_lon:.6f},{max(-90.0, lat - d_lat):.6f},{lon + d_lon:.6f},{min(90.0, lat + d_lat):.6f}"
+
+
+def bulk_url(location: SenseBoxLocation, phenomenon: str, from_date: str, to_date: str) -> str:
+    params = {
+        "bbox": location_bbox(location),
+        "phenomenon": phenomenon,
+        "exposure": location.exposure,
+        "from-date": from_date,
+        "to-date": to_date,
+        "format": "csv",
+        "columns": ",".join(bulk_columns),
+    }
+    return f"{settings.OPENSENSEMAP_API_URL}/boxes/data?{urllib.parse.urlencode(params)}"
+
+
+def build_sensor_index(boxes: pd.DataFrame) -> pd.DataFrame:
+    """
+    one row per sensor of the boxes to collect:
+    sensorId -> boxId, box name, phenomenon (raw title), title (uniform spelling)
+    boxes: df from get_boxes_for_ingest(), after filter_sensors()
+    """
+    rows = [
+        {
+            "sensorId": p["_id"],
+            "boxId": box["_id"],
+            "box_name": box["name"],
+            "phenomenon": p["title"],
+            "title": normalize_sensor(p["title"], p["unit"])[0],
+        }
+        for index, box in boxes.iterrows()
+        for p in box["sensors"]
+    ]
+    return pd.DataFrame(rows, columns=["sensorId", "boxId", "box_name", "phenomenon", "title"]).drop_duplicates(
+        subset="sensorId"
+    )
+
+
+def aggregate_chunk(header: str, lines: list[str], from_dates: pd.Series) -> tuple[pd.DataFrame, pd.Series]:
+    """
+    parse a chunk of csv lines -> (sum and count per sensor and minute, newest createdAt per sensor)
+    from_dates: sensorId -> first minute to keep (watermark or timeframe). Other sensors of the bbox are dropped
+    """
+    # ids as strings: all-digit ids would become int64 and never match the ids of the boxes
+    chunk = pd.read_csv(
+        io.StringIO("\n".join([header, *lines])),
+        usecols=bulk_columns,
+        dtype={"boxId": str, "sensorId": str, "value": "object"},
+    )
+    # a single garbage value must not cost the whole chunk, it becomes NaN and is dropped below
+    chunk["value"] = pd.to_numeric(chunk["value"], errors="coerce")
+
+    chunk = chunk[chunk["sensorId"].isin(from_dates.index)]
+    if chunk.empty:
+        return pd.DataFrame(columns=["sum", "count"]), pd.Series(dtype="datetime64[ns]")
+
+    # UTC without timezone, like the per sensor mode
+    created_at = pd.to_datetime(chunk["createdAt"], utc=True, format="ISO8601").dt.tz_localize(None)
+    chunk = chunk.assign(createdAt=created_at, minute=created_at.dt.floor("Min"))
+
+    # same start as the per sensor request: from the watermark minute on, this minute is aggregated again
+    chunk = chunk[chunk["minute"].to_numpy() >= chunk["sensorId"].map(from_dates).to_numpy()]
+    chunk = chunk.dropna(subset=["value"])
+
+    sums = chunk.groupby(["sensorId", "minute"])["value"].agg(["sum", "count"])
+    newest = chunk.groupby("sensorId")["createdAt"].max()
+    return sums, newest
+
+
+async def stream_phenomenon(
+    url: str,
+    from_dates: pd.Series,
+    scheduler: IngestScheduler,
+    chunk_lines: int,
+    timeout: float | None = None,
+) -> tuple[pd.DataFrame, pd.Series]:
+    """download one bulk csv and aggregate it chunk by chunk, while it is still streaming"""
+    client = get_client(url)
+    sums = []
+    newest = []
+
+    async def add_chunk(header, lines):
+        chunk_sums, chunk_newest = await asyncio.to_thread(aggregate_chunk, header, lines, from_dates)
+        if chunk_sums.empty:
+            return  # none of the wanted sensors, no (sensorId, minute) index to combine
+        sums.append(chunk_sums)
+        newest.append(chunk_newest)
+
+    async with scheduler.slot(url):
+        # the timeout starts with the download, not while the request waits for a slot
+        async with asyncio.timeout(timeout):
+            async with client.stream("GET", url, headers={"Accept": "text/csv"}) as response:
+                response.raise_for_status()
+
+                header = None
+                lines = []
+                async for line in response.aiter_lines():
+                    if not line.strip():
+                        continue
+                    if header is None:
+                        header = line
+                        continue
+
+                    lines.append(line)
+                    if len(lines) >= chunk_lines:
+                        await add_chunk(header, lines)
+                        lines = []
+
+                if lines:
+                    await add_chunk(header, lines)
+
+    if not sums:
+        return pd.DataFrame(columns=["sum", "count"]), pd.Series(dtype="datetime64[ns]")
+
+    # a sensor minute can be split over two chunks
+    combined = pd.concat(sums).groupby(level=[0, 1]).sum()
+    return combined, pd.concat(newest).groupby(level=0).max()
+
+
+def build_box_frames(
+    sensor_index: pd.DataFrame,
+    sums: pd.DataFrame,
+    newest: pd.Series,
+) -> list[pd.DataFrame]:
+    """aggregates of all phenomena -> one frame per box, boxes without values get an empty frame"""
+    boxes = sensor_index.drop_duplicates(subset="boxId")[["boxId", "box_name"]]
+    frames = []
+
+    if not sums.empty:
+        means = (sums["sum"] / sums["count"]).rename("value").reset_index()
+        means = means.merge(sensor_index[["sensorId", "boxId", "title"]], on="sensorId")
+        # more than one sensor of a box can have the same title -> mean of the sensors
+        values = means.groupby(["boxId", "minute", "title"])["value"].mean()
+    else:
+        values = pd.Series(dtype="float64")
+
+    box_of_sensor = sensor_index.set_index("sensorId")["boxId"]
+    box_watermarks = {}
+    for sensor_id, created_at in newest.items():
+        watermark = created_at.tz_localize("UTC").to_pydatetime()
+        box_watermarks.setdefault(box_of_sensor[sensor_id], {})[sensor_id] = watermark
+
+    present = set(values.index.get_level_values(0)) if not values.empty else set()
+
+    for box in boxes.itertuples():
+        if box.boxId in present:
+            box_df = values.loc[box.boxId].unstack("title").sort_index()
+            box_df.columns.name = None
+            box_df.index.name = "createdAt"
+        else:
+            box_df = pd.DataFrame()
+
+        box_df.attrs["box_id"] = box.boxId
+        box_df.attrs["box_name"] = box.box_name
+        box_df.attrs["watermarks"] = box_watermarks.get(box.boxId, {}) if not box_df.empty else {}
+        frames.append(box_df)
+
+    return frames
+
+
+async def get_location_data(
+    location: SenseBoxLocation,
+    boxes: pd.DataFrame,
+    timeframe: str,
+    scheduler: IngestScheduler | None = None,
+    watermarks: dict[str, dict[str, datetime]] | None = None,
+) -> list[pd.DataFrame]:
+    """
+    all boxes of one location with one request per phenomenon
+    boxes: the boxes of this location to collect (get_boxes_for_ingest(), filter_sensors())
+    """
+    if scheduler is None:
+        scheduler = IngestScheduler()
+    if watermarks is None:
+        watermarks = {}
+
+    await load_sensor_aliases()
+    sensor_index = build_sensor_index(boxes)
+    if sensor_index.empty:
+        return []
+
+    # every sensor starts at its own watermark, the request at the oldest of them
+    sensor_index["from_date"] = [
+        watermark_to_timeframe(watermarks[row.boxId][row.sensorId])
+        if row.sensorId in watermarks.get(row.boxId, {})
+        else timeframe
+        for row in sensor_index.itertuples()
+    ]
+    to_date = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+    chunk_lines = getattr(settings, "INGEST_BULK_CHUNK_LINES", 50000)
+    timeout = getattr(settings, "INGEST_BULK_TIMEOUT", 900.0)
+
+    async def fetch_phenomenon(phenomenon: str, sensors: pd.DataFrame):
+        from_dates = pd.Series(
+            # naive UTC, same as the minutes of aggregate_chunk
+            pd.to_datetime(sensors["from_date"], utc=True).dt.tz_localize(None).to_numpy(),
+            index=sensors["sensorId"].to_numpy(),
+        )
+        url = bulk_url(location, phenomenon, sensors["from_date"].min(), to_date)
+        return await stream_phenomenon(url, from_dates, scheduler, chunk_lines, timeout)
+
+    groups = list(sensor_index.groupby("phenomenon"))
+    results = await asyncio.gather(
+        *[fetch_phenomenon(phenomenon, sensors) for phenomenon, sensors in groups], return_exceptions=True
+    )
+
+    sums = []
+    newest = []
+    errors = {}  # box id -> error of a failed phenomenon of the box
+    failed_sensors = {}  # box id -> sensors of failed phenomena
+    for (phenomenon, sensors), result in zip(groups, results):
+        if isinstance(result, BaseException):
+            # the other phenomena are kept, the watermarks of these sensors are not advanced
+            print(f">>>>>>>> Bulk download {phenomenon} for {location.name} failed: {result!r}")
+            for box_id in sensors["boxId"].unique():
+                errors.setdefault(box_id, f"bulk {phenomenon}: {result!r}")
+            for box_id, count in sensors["boxId"].value_counts().items():
+                failed_sensors[box_id] = failed_sensors.get(box_id, 0) + int(count)
+            continue
+        sums.append(result[0])
+        newest.append(result[1])
+
+    if len(sums) == 0 and groups:
+        raise RuntimeError(f"All bulk downloads failed for {location.name}")
+
+    non_empty = [s for s in sums if not s.empty]
+    sums = pd.concat(non_empty) if non_empty else pd.DataFrame(columns=["sum", "count"])
+    non_empty = [n for n in newest if not n.empty]
+    newest = pd.concat(non_empty) if non_empty else pd.Series(dtype="datetime64[ns]")
+
+    print(f"Bulk: {location.name}, {len(groups)} phenomena, {len(sensor_index)} sensors")
+    frames = await asyncio.to_thread(build_box_frames, sensor_index, sums, newest)
+
+    # no values because the download failed, not because the box is silent -> failure in the health ledger
+    for frame in frames:
+        frame.attrs["failed_sensors"] = failed_sensors.get(frame.attrs["box_id"], 0)
+        if frame.empty and frame.attrs["box_id"] in errors:
+            frame.attrs["error"] = errors[frame.attrs["box_id"]]
+    return frames
@@ -0,0 +1,122 @@
+"""
+Polling cadence per box.
+
+Some boxes send a value every minute, others a few times a day. Instead of polling all of them every hour,
+every box gets its own next_due_at (BoxIngestState):
+
+- the median interval between the measurements of a box is learned from the values of each run
+- fast boxes are polled on every tick (INGEST_CADENCE_MIN), slow boxes after their own interval
+- boxes that stopped reporting are backed off: the longer the silence, the longer the pause (up to INGEST_CADENCE_MAX)
+- a bit of jitter, so the boxes spread over the ticks instead of being due at the same time
+
+collect_data runs every few minutes and fetches only the boxes that are due.
+"""
+
+import random
+from datetime import datetime, timedelta, timezone
+
+import pandas as pd
+from django.conf import settings
+
+from home.models import BoxIngestState
+
+
+def next_poll_interval(median_interval: float | None, last_seen: datetime | None, now: datetime) -> float:
+    """seconds until the box is due again"""
+    minimum = getattr(settings, "INGEST_CADENCE_MIN", 600.0)
+    maximum = getattr(settings, "INGEST_CADENCE_MAX", 6 * 3600.0)
+
+    interval = median_interval or getattr(settings, "INGEST_CADENCE_DEFAULT", 3600.0)
+
+    if last_seen is not None:
+        silence = (now - last_seen).total_seconds()
+        if silence > 3 * interval:
+            # stalled box: wait half of the silence, the pause grows with every empty run
+            interval = silence / 2
+
+    interval = min(maximum, max(minimum, interval))
+    return interval * random.uniform(0.9, 1.1)
+
+
+class BoxCadence:
+    def __init__(self, states: dict[str, BoxIngestState] | None = None, read_only: bool = False):
+        self.states = states if states is not None else {}
+        self.changed: dict[str, BoxIngestState] = {}
+        # read_only: runs besides the sweep (fast lane) don't move next_due_at, the cadence belongs to the sweep
+        self.read_only = read_only
+
+    def observe(self, box_id: str, timestamps, last_seen: datetime | None = None, now: datetime | None = None):
+        """
+        timestamps: times of the values of this run (index of the box frame, UTC), empty if the box sent nothing
+        last_seen: exact time of the newest value (watermarks), the timestamps are floored to minutes
+        """
+        if self.read_only:
+            return
+
+        now = now or datetime.now(timezone.utc)
+        state = self.states.get(box_id) or BoxIngestState(sensebox_id=box_id)
+
+        times = pd.DatetimeIndex(timestamps)
+        if len(times) and times.tz is None:
+            times = times.tz_localize("UTC")
+
+        if len(times):
+            if state.last_seen is not None:
+                # the gap to the last value of the previous run counts as well (slow boxes have one value per run)
+                times = times.append(pd.DatetimeIndex([state.last_seen]).tz_convert("UTC"))
+            intervals = times.sort_values().to_series().diff().dt.total_seconds()
+            intervals = intervals[intervals > 0]
+
+            if len(intervals):
+                run_median = float(intervals.median())
+                if state.median_interval:
+                    # smoothed over the runs, a single odd run does not change the cadence
+                    state.median_interval = 0.5 * state.median_interval + 0.5 * run_median
+                else:
+                    state.median_interval = run_median
+
+            newest = last_seen or times.max().to_pydatetime()
+            if state.last_seen is None or newest > state.last_seen:
+                state.last_seen = newest
+
+        state.next_due_at = now + timedelta(seconds=next_poll_interval(state.median_interval, state.last_seen, now))
+
+        self.states[box_id] = state
+        self.changed[box_id] = state
+
+    def save(self) -> None:
+        if not self.changed:
+            return
+
+        BoxIngestState.objects.bulk_create(
+            list(self.changed.values()),
+            update_conflicts=True,
+            unique_fields=["sensebox_id"],
+            update_fields=["median_interval", "last_seen", "next_due_at"],
+        )
+        print(f"Cadence: {len(self.changed)} boxes rescheduled")
+        self.changed = {}
+
+
+async def load_box_states(box_ids: list[str] | None = None) -> dict[str, BoxIngestState]:
+    states = BoxIngestState.objects.all()
+    if box_ids is not None:
+        states = states.filter(sensebox_id__in=box_ids)
+    return {state.sensebox_id: state async for state in states}
+
+
+def filter_due_boxes(
+    df: pd.DataFrame, states: dict[str, BoxIngestState], now: datetime | None = None
+) -> tuple[pd.DataFrame, int]:
+    """remove all boxes that are not due yet. New boxes are always due. Returns the number of skipped boxes"""
+    if df.empty or not states:
+        return df, 0
+
+    now = now or datetime.now(timezone.utc)
+
+    def is_due(box_id):
+        state = states.get(box_id)
+        return state is None or state.next_due_at is None or state.next_due_at <= now
+
+    due = df["_id"].map(is_due).to_numpy(dtype=bool)
+    return df[due], int((~due).sum())
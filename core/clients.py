@@ -0,0 +1,143 @@
+"""
+Process-wide registry for httpx.AsyncClient instances.
+
+Every host (api.opensensemap.org, tile.openstreetmap.org, ...) gets its own long living client,
+so keep-alive connections (and HTTP/2 streams) are reused instead of doing a new TCP+TLS handshake per request.
+
+An AsyncClient is bound to the event loop it was created in. collect_data and async_to_sync() create
+new loops, daphne runs one loop for the whole process. That's why the clients are stored per loop.
+When a loop is garbage collected, its clients disappear with it.
+"""
+
+import asyncio
+import sys
+import weakref
+from urllib.parse import urlparse
+
+import httpx
+from django.conf import settings
+
+try:
+    import h2  # noqa: F401 -> only needed to check if HTTP/2 is available
+
+    http2_available = True
+except ImportError:
+    http2_available = False
+
+# (host, client kwargs) -> transport or None, set by collect_data --archive/--replay (core/archive.py)
+transport_factory = None
+
+# loop -> {host: client}
+_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, dict[str, httpx.AsyncClient]]" = (
+    weakref.WeakKeyDictionary()
+)
+
+
+def _client_kwargs() -> dict:
+    http2 = getattr(settings, "HTTPX_HTTP2", True)
+
+    if http2 and not http2_available:
+        print("HTTP/2 requested, but package 'h2' is missing. Using HTTP/1.1 (install httpx[http2])")
+        http2 = False
+
+    return {
+        "http2": http2,
+        "limits": httpx.Limits(
+            max_connections=getattr(settings, "HTTPX_MAX_CONNECTIONS", 100),
+            max_keepalive_connections=getattr(settings, "HTTPX_MAX_KEEPALIVE_CONNECTIONS", 20),
+            keepalive_expiry=getattr(settings, "HTTPX_KEEPALIVE_EXPIRY", 30.0),
+        ),
+        "timeout": httpx.Timeout(
+            getattr(settings, "HTTPX_TIMEOUT", 10.0),
+            connect=getattr(settings, "HTTPX_CONNECT_TIMEOUT", 5.0),
+            pool=getattr(settings, "HTTPX_POOL_TIMEOUT", 30.0),
+        ),
+        "follow_redirects": True,
+    }
+
+
+def get_client(url: str) -> httpx.AsyncClient:
+    """return the shared client for the host of this url (must be called inside a running event loop)"""
+    loop = asyncio.get_running_loop()
+    host = urlparse(url).netloc
+
+    loop_clients = _clients.setdefault(loop, {})
+
+    client = loop_clients.get(host)
+    if client is None or client.is_closed:
+        kwargs = _client_kwargs()
+        transport = transport_factory(host, kwargs) if transport_factory else None
+        if transport is not None:
+            kwargs["transport"] = transport
+        client = httpx.AsyncClient(**kwargs)
+        loop_clients[host] = client
+
+    return client
+
+
+async def close_clients() -> None:
+    """close all clients of the running loop. Call this before the loop ends (management commands, ASGI shutdown)"""
+    loop = asyncio.get_running_loop()
+    loop_clients = _clients.pop(loop, {})
+
+    for host, client in loop_clients.items():
+        if not client.is_closed:
+            await client.aclose()
+
+    if loop_clients:
+        print(f"Closed HTTP clients for: {', '.join(loop_clients.keys())}")
+
+
+def run_with_clients(coro):
+    """asyncio.run() for management commands: closes the shared clients, before the loop is gone"""
+
+    async def main():
+        try:
+            return await coro
+        finally:
+            await close_clients()
+
+    return asyncio.run(main())
+
+
+async def shutdown() -> None:
+    """ASGI shutdown: the accepted push batches are written first (they may need the clients), then the clients close"""
+    from core.push import close_push_buffer  # core.push imports the ingest modules, which import this module
+
+    try:
+        await close_push_buffer()
+    finally:
+        await close_clients()
+
+
+def install_daphne_shutdown_hook() -> None:
+    """daphne does not speak the ASGI lifespan protocol, so we hook into twisted's shutdown instead"""
+    if "twisted.internet.reactor" not in sys.modules:
+        return  # not running inside daphne (importing the reactor here would install one)
+
+    from twisted.internet import reactor
+    from twisted.internet.defer import Deferred
+
+    def on_shutdown():
+        return Deferred.fromFuture(asyncio.ensure_future(shutdown()))
+
+    reactor.addSystemEventTrigger("before", "shutdown", on_shutdown)
+
+
+def lifespan_wrapper(application):
+    """push buffer and clients are closed on 'lifespan.shutdown' for ASGI servers supporting it (uvicorn, hypercorn)"""
+
+    async def app(scope, receive, send):
+        if scope["type"] != "lifespan":
+            return await application(scope, receive, send)
+
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await shutdown()
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    return app
@@ -0,0 +1,189 @@
+"""
+Fast lane for the live dashboards (show_by_tag).
+
+A grouptag is in the fast lane, when it is featured (admin: Group Tags) or when its dashboard was viewed
+in the last INGEST_FAST_LANE_VIEW_TTL seconds. collect_fast_lane (cron, every minute) collects the boxes
+of these tags with a small scheduler of its own, separate from the collect_data sweep.
+
+show_by_tag reads the data of a fresh fast lane tag from influx, instead of asking opensensemap on every page view.
+"""
+
+import time
+
+import pandas as pd
+from django.conf import settings
+from django.core.cache import cache
+from influxdb_client import InfluxDBClient
+
+from core.cadence import BoxCadence, load_box_states
+from core.health import BoxHealth, filter_open_circuits
+from core.ingest import IngestReport, location_lock, run_pipeline
+from core.scheduler import IngestScheduler
+from core.tools import (
+    box_snapshot_key,
+    filter_sensors,
+    get_locations,
+    get_timeframe,
+    load_phenomenon_allowlists,
+    load_watermarks,
+)
+from home.models import GroupTag
+
+viewed_tags_key = "fast_lane_viewed_tags"  # {tag: last view}
+fresh_tags_key = "fast_lane_fresh_tags"  # {tag: end of the last fast lane run}
+
+
+async def record_tag_view(tag: str) -> None:
+    """called by show_by_tag: the tag stays in the fast lane for INGEST_FAST_LANE_VIEW_TTL seconds"""
+    ttl = getattr(settings, "INGEST_FAST_LANE_VIEW_TTL", 600)
+    now = time.time()
+
+    viewed = await cache.aget(viewed_tags_key) or {}
+    if now - viewed.get(tag, 0) < 60:
+        return  # recorded a moment ago, no need to write the cache on every page view
+
+    viewed = {t: seen for t, seen in viewed.items() if now - seen < ttl}
+    viewed[tag] = now
+    await cache.aset(viewed_tags_key, viewed, timeout=ttl)
+
+
+async def get_fast_lane_tags() -> set[str]:
+    ttl = getattr(settings, "INGEST_FAST_LANE_VIEW_TTL", 600)
+    now = time.time()
+
+    tags = {tag async for tag in GroupTag.objects.filter(featured=True).values_list("tag", flat=True)}
+
+    viewed = await cache.aget(viewed_tags_key) or {}
+    tags.update(t for t, seen in viewed.items() if now - seen < ttl)
+    return tags
+
+
+async def mark_tags_fresh(tags: set[str]) -> None:
+    now = time.time()
+    fresh = await cache.aget(fresh_tags_key) or {}
+    fresh.update({tag: now for tag in tags})
+    await cache.aset(fresh_tags_key, fresh, timeout=getattr(settings, "INGEST_FAST_LANE_VIEW_TTL", 600))
+
+
+async def is_tag_fresh(tag: str) -> bool:
+    """True, when the fast lane collected this tag a moment ago -> influx is up to date for its boxes"""
+    fresh = await cache.aget(fresh_tags_key) or {}
+    return time.time() - fresh.get(tag, 0) < getattr(settings, "INGEST_FAST_LANE_MAX_AGE", 180)
+
+
+async def get_fast_lane_boxes(tags: set[str], region: str = "all") -> pd.DataFrame:
+    """the boxes of these tags from the box snapshot (sync_metadata), no catalog request"""
+    frames = []
+    async for location in get_locations(region):
+        snapshot = await cache.aget(box_snapshot_key(location.name))
+        if snapshot is None or snapshot.empty or "grouptag" not in snapshot:
+            continue
+
+        has_tag = snapshot["grouptag"].map(
+            lambda box_tags: isinstance(box_tags, list) and bool(tags & set(box_tags))
+        )
+        frames.append(snapshot[has_tag.to_numpy(dtype=bool)])
+
+    if len(frames) == 0:
+        return pd.DataFrame()
+
+    return pd.concat(frames, ignore_index=True).drop_duplicates(subset="_id")
+
+
+async def collect_fast_lane(region: str = "all") -> IngestReport | None:
+    # started every minute (cron or celery beat), a run that takes longer must not overlap with the next one
+    async with location_lock("fast_lane", timeout=10 * 60) as acquired:
+        if not acquired:
+            print("Fast lane: previous run still active, skipped")
+            return None
+        return await _collect_fast_lane(region)
+
+
+async def _collect_fast_lane(region: str) -> IngestReport | None:
+    tags = await get_fast_lane_tags()
+    if not tags:
+        print("Fast lane: no featured or viewed grouptags")
+        return None
+
+    df = await get_fast_lane_boxes(tags, region)
+    print(f"Fast lane: {len(tags)} grouptags, {len(df)} boxes")
+    if df.empty:
+        return None
+
+    states = await load_box_states()
+    df, skipped_open = filter_open_circuits(df, states)
+    if skipped_open:
+        print(f"Fast lane: skipped {skipped_open} boxes with open circuit")
+
+    watermarks = await load_watermarks(df["_id"].tolist())
+    df, skipped_sensors = filter_sensors(df, await load_phenomenon_allowlists())
+
+    # sensors without watermark: enough data for the dashboard (1 day + 1 hour)
+    timeframe = await get_timeframe(getattr(settings, "INGEST_FAST_LANE_LOOKBACK", 1.0 + 1 / 24))
+
+    # a budget of its own, the sweep of collect_data is not slowed down
+    scheduler = IngestScheduler(
+        max_concurrency=getattr(settings, "INGEST_FAST_LANE_CONCURRENCY", 4),
+        rate=getattr(settings, "INGEST_FAST_LANE_RATE", 2.0),
+    )
+
+    report = await run_pipeline(
+        df,
+        timeframe,
+        scheduler=scheduler,
+        watermarks=watermarks,
+        cadence=BoxCadence(states, read_only=True),
+        health=BoxHealth(states),
+    )
+
+    # a tag with a box that failed is not up to date in influx, show_by_tag asks opensensemap for it
+    fresh = set(tags)
+    for box_id, box_tags in zip(df["_id"], df["grouptag"]):
+        if box_id not in report.up_to_date and isinstance(box_tags, list):
+            fresh -= set(box_tags)
+    if fresh != tags:
+        print(f"Fast lane: {len(tags - fresh)} grouptags not fresh, boxes failed")
+    await mark_tags_fresh(fresh)
+    return report
+
+
+def read_boxes_from_influx(df: pd.DataFrame, hours: int = 25) -> list[pd.DataFrame]:
+    """
+    the data of these boxes from influx, same layout as run_multithreaded():
+    one frame per box, index "createdAt" (UTC), one column per sensor title, attrs box_id and box_name
+    """
+    if df.empty:
+        return []
+
+    box_ids = ", ".join(f'"{box_id}"' for box_id in df["_id"])
+    query = f"""from(bucket: "{settings.INFLUX_BUCKET}")
+    |> range(start: -{hours}h, stop: now())
+    |> filter(fn: (r) => contains(value: r._measurement, set: [{box_ids}]))
+    |> pivot(rowKey: ["_time"], columnKey: ["_field"], valueColumn: "_value")
+    """
+
+    with InfluxDBClient(url=settings.INFLUX_URL, token=settings.INFLUX_TOKEN, org=settings.INFLUX_ORG) as client:
+        tables = client.query_api().query_data_frame(org=settings.INFLUX_ORG, query=query)
+
+    # boxes with different sensors come back as a list of frames
+    if isinstance(tables, list):
+        tables = pd.concat(tables, ignore_index=True) if tables else pd.DataFrame()
+    if tables.empty:
+        return []
+
+    tables = tables.drop(columns=["result", "table", "_start", "_stop"], errors="ignore")
+    names = dict(zip(df["_id"], df["name"]))
+
+    results = []
+    for box_id, box_df in tables.groupby("_measurement"):
+        # only the measured values (old points can have string fields)
+        box_df = box_df.set_index("_time").select_dtypes("number").dropna(axis=1, how="all")
+        box_df.index = pd.DatetimeIndex(box_df.index).tz_convert("UTC").tz_localize(None)
+        box_df.index.name = "createdAt"
+        box_df = box_df.sort_index()
+
+        box_df.attrs["box_id"] = box_id
+        box_df.attrs["box_name"] = names.get(box_id, box_id)
+        results.append(box_df)
+
+    return results
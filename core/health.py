@@ -0,0 +1,133 @@
+"""
+Health ledger and circuit breaker per box.
+
+Every fetched box gets a result in its BoxIngestState: consecutive failures, last success, last error and the
+average latency of its requests. A box that fails INGEST_BREAKER_THRESHOLD times in a row (time out, garbage,
+no data for more than INGEST_BREAKER_NO_DATA_AFTER seconds) is left out of the hot path: the circuit is open
+until open_until. After that one probe is made. On failure the circuit opens again for twice as long
+(up to INGEST_BREAKER_MAX seconds), on success it's closed.
+
+Boxes with an open circuit get an error_message in SenseBoxTable -> grey marker on the home map.
+"""
+
+from datetime import datetime, timedelta, timezone
+
+import pandas as pd
+from django.conf import settings
+from django.db import transaction
+
+from home.models import BoxIngestState, SenseBoxTable
+
+health_fields = ["consecutive_failures", "last_success_at", "last_error", "avg_latency", "open_until"]
+
+
+class BoxHealth:
+    def __init__(self, states: dict[str, BoxIngestState] | None = None):
+        # shared with BoxCadence, both work on the same BoxIngestState objects
+        self.states = states if states is not None else {}
+        self.changed: dict[str, BoxIngestState] = {}
+        self.succeeded: set[str] = set()
+
+    def _state(self, box_id: str) -> BoxIngestState:
+        if box_id not in self.states:
+            self.states[box_id] = BoxIngestState(sensebox_id=box_id)
+        return self.states[box_id]
+
+    def _record_latency(self, state: BoxIngestState, latency: float | None):
+        if latency is None:
+            return
+        # moving average, recent requests count more
+        state.avg_latency = latency if state.avg_latency is None else 0.8 * state.avg_latency + 0.2 * latency
+
+    def success(self, box_id: str, latency: float | None = None, now: datetime | None = None):
+        state = self._state(box_id)
+        state.consecutive_failures = 0
+        state.last_success_at = now or datetime.now(timezone.utc)
+        state.last_error = ""
+        state.open_until = None
+        self._record_latency(state, latency)
+        self.changed[box_id] = state
+        self.succeeded.add(box_id)
+
+    def failure(self, box_id: str, error: str, latency: float | None = None, now: datetime | None = None):
+        now = now or datetime.now(timezone.utc)
+        state = self._state(box_id)
+        state.consecutive_failures += 1
+        state.last_error = error[:255]
+        self._record_latency(state, latency)
+
+        threshold = getattr(settings, "INGEST_BREAKER_THRESHOLD", 5)
+        if state.consecutive_failures >= threshold:
+            # exponential backoff: every failed probe doubles the pause
+            pause = getattr(settings, "INGEST_BREAKER_BASE", 1800.0) * 2 ** (state.consecutive_failures - threshold)
+            pause = min(pause, getattr(settings, "INGEST_BREAKER_MAX", 2 * 86400.0))
+            state.open_until = now + timedelta(seconds=pause)
+            print(
+                f"Circuit open for {box_id} until {state.open_until:%Y-%m-%d %H:%M} "
+                f"({state.consecutive_failures} failures): {state.last_error}"
+            )
+
+        self.changed[box_id] = state
+
+    def no_data(self, box_id: str, latency: float | None = None, now: datetime | None = None):
+        """
+        empty answer: normal for a box polled more often than it reports, a failure when the box went silent.
+        A box never seen with values (new, slow reporter) is not counted as failure, it may just not have sent yet
+        """
+        now = now or datetime.now(timezone.utc)
+        state = self._state(box_id)
+        silent_after = timedelta(seconds=getattr(settings, "INGEST_BREAKER_NO_DATA_AFTER", 86400.0))
+
+        if state.last_seen is not None and now - state.last_seen > silent_after:
+            self.failure(box_id, "no data", latency=latency, now=now)
+        else:
+            self._record_latency(state, latency)
+            self.changed[box_id] = state
+
+    def save(self) -> None:
+        if not self.changed:
+            return
+
+        states = list(self.changed.values())
+        broken = [state for state in states if state.open_until is not None]
+        healthy = [state.sensebox_id for state in states if state.open_until is None]
+
+        with transaction.atomic():
+            BoxIngestState.objects.bulk_create(
+                states,
+                update_conflicts=True,
+                unique_fields=["sensebox_id"],
+                update_fields=health_fields,
+            )
+
+            # grey marker on the home map
+            SenseBoxTable.objects.filter(sensebox_id__in=healthy).exclude(error_message=None).update(
+                error_message=None
+            )
+            # boxes with new values are active, clear_table keeps them
+            SenseBoxTable.objects.filter(sensebox_id__in=self.succeeded).update(last_seen=datetime.now(timezone.utc))
+            for state in broken:
+                SenseBoxTable.objects.filter(sensebox_id=state.sensebox_id).update(
+                    error_message=f"Keine Daten seit {state.consecutive_failures} Abrufen: {state.last_error}"[:255]
+                )
+
+        print(f"Health: {len(healthy)} boxes ok, {len(broken)} boxes with open circuit")
+        self.changed = {}
+        self.succeeded = set()
+
+
+def filter_open_circuits(
+    df: pd.DataFrame, states: dict[str, BoxIngestState], now: datetime | None = None
+) -> tuple[pd.DataFrame, int]:
+    """remove the boxes with an open circuit. When open_until is over, the box is let through once (probe)"""
+    if df.empty or not states:
+        return df, 0
+
+    now = now or datetime.now(timezone.utc)
+
+    def is_open(box_id):
+        state = states.get(box_id)
+        return state is not None and state.open_until is not None and state.open_until > now
+
+    blocked = df["_id"].map(is_open).to_numpy(dtype=bool)
+    return df[~blocked], int(blocked.sum())
@@ -0,0 +1,257 @@
+"""
+Batched writer for InfluxDB.
+
+One InfluxDBClient for the whole run (gzip on the wire). The frames of many boxes are encoded to line protocol
+and collected until INFLUX_BATCH_SIZE lines are reached or INFLUX_FLUSH_INTERVAL seconds are over.
+A failed batch is retried with exponential backoff and jitter, so not all writers hit influx at the same moment again.
+
+With INFLUX_SPOOL the batches go to the write-ahead spool on disk first (core/spool.py) and are drained to influx
+in the background: an influx outage doesn't stop the ingest, the data is written when influx is back.
+"""
+
+import asyncio
+import random
+import time
+from typing import Awaitable, Callable
+
+import influxdb_client
+import numpy as np
+import pandas as pd
+from django.conf import settings
+from influxdb_client.client.write_api import SYNCHRONOUS, WritePrecision
+
+from core.spool import Spool, SpoolFull
+
+
+def escape_measurement(name: str) -> str:
+    return name.replace("\\", "\\\\").replace(",", "\\,").replace(" ", "\\ ")
+
+
+def escape_key(name: str) -> str:
+    return name.replace("\\", "\\\\").replace(",", "\\,").replace("=", "\\=").replace(" ", "\\ ")
+
+
+def encode_line_protocol(measurement: str, df: pd.DataFrame) -> list[str]:
+    """
+    df: index = time (UTC), columns = float fields (one box)
+    returns one line per row: "<measurement> field1=1.0,field2=2.0 <timestamp ns>"
+
+    Sensors of a box don't report at the same minute: missing values (NaN) are left out of the line,
+    only rows without any value are dropped. The whole frame is encoded column by column, not row by row.
+    """
+    if df.empty:
+        return []
+
+    values = df.replace([np.inf, -np.inf], np.nan)
+    present = values.notna()
+    has_fields = present.any(axis=1)
+    if not has_fields.any():
+        return []
+
+    values = values[has_fields]
+    present = present[has_fields]
+
+    index = pd.DatetimeIndex(values.index)
+    if index.tz is not None:
+        index = index.tz_convert("UTC").tz_localize(None)
+    timestamps = pd.Series(index.as_unit("ns").asi8, index=values.index).astype(str)
+
+    fields = pd.Series("", index=values.index)
+    for column in values.columns:
+        field = escape_key(str(column)) + "=" + values[column].astype(float).astype(str)
+        # add the field only where the sensor has a value, with a comma if there is a field before
+        separator = np.where(fields != "", ",", "")
+        fields = fields.where(~present[column], fields + separator + field)
+
+    lines = escape_measurement(measurement) + " " + fields + " " + timestamps
+    return lines.tolist()
+
+
+class InfluxWriter:
+    def __init__(
+        self,
+        batch_size: int | None = None,
+        flush_interval: float | None = None,
+        max_retries: int | None = None,
+        use_spool: bool | None = None,
+    ):
+        self.batch_size = batch_size or getattr(settings, "INFLUX_BATCH_SIZE", 5000)
+        self.flush_interval = flush_interval or getattr(settings, "INFLUX_FLUSH_INTERVAL", 5.0)
+        self.max_retries = max_retries if max_retries is not None else getattr(settings, "INFLUX_MAX_RETRIES", 5)
+
+        self.client = influxdb_client.InfluxDBClient(
+            url=settings.INFLUX_URL,
+            token=settings.INFLUX_TOKEN,
+            org=settings.INFLUX_ORG,
+            enable_gzip=getattr(settings, "INFLUX_GZIP", True),
+        )
+        self.write_api = self.client.write_api(write_options=SYNCHRONOUS)
+
+        if use_spool is None:
+            use_spool = getattr(settings, "INFLUX_SPOOL", True)
+        self.spool = Spool() if use_spool else None
+        self.drain_task = None
+        self.drain_failed_at = 0.0
+
+        self.lines: list[str] = []
+        self.callbacks: list[Callable[[], Awaitable]] = []  # called after the batch is written
+        self.lock = asyncio.Lock()
+        self.timer = None
+
+        self.started = time.monotonic()
+        self.points = 0
+        self.batches = 0
+        self.failed_batches = 0
+        self.spooled_batches = 0
+        self.drained_points = 0
+
+    async def start(self):
+        if self.timer is None:
+            self.timer = asyncio.create_task(self._flush_periodically())
+
+    async def _flush_periodically(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+                if self.spool is not None:
+                    self._start_drain()  # segments left after a failed drain
+            except Exception as e:  # keep the timer alive
+                print(f">>>>>>>> Influx flush failed: {e!r}")
+
+    async def add(self, measurement: str, df: pd.DataFrame, on_success: Callable[[], Awaitable] | None = None):
+        """encode the frame and add it to the batch. on_success is awaited, when the batch is in influx (or spool)"""
+        lines = await asyncio.to_thread(encode_line_protocol, measurement, df)
+
+        async with self.lock:
+            self.lines.extend(lines)
+            if on_success:
+                self.callbacks.append(on_success)
+            full = len(self.lines) >= self.batch_size
+
+        if full:
+            await self.flush()
+
+    async def flush(self) -> bool:
+        async with self.lock:
+            lines, self.lines = self.lines, []
+            callbacks, self.callbacks = self.callbacks, []
+
+            if not lines and not callbacks:
+                return True
+
+            if lines and not await self._store(lines):
+                self.failed_batches += 1
+                print(f">>>>>>>>>>>>>>>> Influx batch with {len(lines)} lines lost")
+                return False
+
+            self.batches += 1
+            self.points += len(lines)
+
+        for callback in callbacks:
+            await callback()
+
+        if self.spool is not None and lines:
+            self._start_drain()
+        return True
+
+    async def _store(self, lines: list[str]) -> bool:
+        """spool (durable on disk, influx later) or, without spool or when the spool is full, directly to influx"""
+        if self.spool is not None:
+            try:
+                await asyncio.to_thread(self.spool.append, lines)
+                self.spooled_batches += 1
+                return True
+            except SpoolFull as e:
+                print(f">>>>>>>> {e}, writing directly to influx")
+            except OSError as e:
+                print(f">>>>>>>> Spool write failed ({e!r}), writing directly to influx")
+
+        return await self._write(lines)
+
+    def _write_once(self, lines: list[str]) -> bool:
+        """one attempt (drain of the spool, runs in a thread). A failed segment stays in the spool for the next drain"""
+        try:
+            self.write_api.write(
+                bucket=settings.INFLUX_BUCKET,
+                org=settings.INFLUX_ORG,
+                record="\n".join(lines),
+                write_precision=WritePrecision.NS,
+            )
+            return True
+        except Exception as e:
+            print(f">>>>>>>> Influx write of spool segment failed: {e!r}")
+            return False
+
+    def _start_drain(self):
+        if self.drain_task is not None and not self.drain_task.done():
+            return  # the running drain takes the new segment as well
+        if time.monotonic() - self.drain_failed_at < self.flush_interval:
+            return  # influx failed a moment ago, the timer tries again
+        self.drain_task = asyncio.create_task(self.drain())
+
+    async def drain(self) -> int:
+        """segments of the spool -> influx, also the ones left by earlier runs. Returns the number of points written"""
+        if self.spool is None:
+            return 0
+
+        segments, points = await asyncio.to_thread(self.spool.drain, self._write_once)
+        self.drained_points += points
+        if self.spool.segments():
+            self.drain_failed_at = time.monotonic()
+        return points
+
+    async def _write(self, lines: list[str]) -> bool:
+        for attempt in range(self.max_retries + 1):
+            try:
+                await asyncio.to_thread(
+                    self.write_api.write,
+                    bucket=settings.INFLUX_BUCKET,
+                    org=settings.INFLUX_ORG,
+                    record="\n".join(lines),
+                    write_precision=WritePrecision.NS,
+                )
+                return True
+            except Exception as e:
+                if attempt == self.max_retries:
+                    print(f">>>>>>>> Influx write failed after {attempt + 1} attempts: {e!r}")
+                    return False
+                # exponential backoff with jitter
+                delay = min(60.0, 0.5 * 2**attempt) * random.uniform(0.5, 1.5)
+                print(f">>>>>>>> Influx write failed ({e!r}), retry in {delay:.1f} s")
+                await asyncio.sleep(delay)
+
+    async def close(self):
+        """flush the rest and close the client"""
+        if self.timer:
+            self.timer.cancel()
+            self.timer = None
+        await self.flush()
+
+        if self.spool is not None:
+            if self.drain_task is not None:
+                await self.drain_task
+            # one more try for the rest, what is left is drained by the next run or drain_spool
+            await self.drain()
+            remaining = len(self.spool.segments())
+            if remaining:
+                print(f">>>>>>>> {remaining} segments left in the spool {self.spool.path}")
+
+        self.write_api.close()
+        self.client.close()
+        print(self.report())
+
+    def report(self) -> str:
+        elapsed = time.monotonic() - self.started
+        rate = self.points / elapsed if elapsed else 0.0
+        return (
+            f"InfluxWriter: {self.points} points in {self.batches} batches ({self.spooled_batches} spooled), "
+            f"{self.failed_batches} failed batches, {self.drained_points} points drained, {rate:.0f} points/s"
+        )
+
+
+async def drain_spool() -> int:
+    """write the segments left in the spool by earlier runs (influx was down). Returns the number of points"""
+    influx_writer = InfluxWriter(use_spool=True)
+    await influx_writer.close()  # nothing to flush, drains the spool
+    return influx_writer.drained_points
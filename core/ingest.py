@@ -0,0 +1,398 @@
+"""
+Streaming ingest: the boxes are fetched concurrently and every finished box is written to InfluxDB right away.
+
+fetch (one coroutine per box) -> bounded queue -> writer workers -> batched InfluxWriter -> watermarks
+
+mode "sensor": one request per sensor (get_sensebox_data)
+mode "bulk": one streamed csv per location and phenomenon (core/bulk.py), the boxes of a location are queued together
+
+The queue is bounded, so the fetching waits when the writers can't keep up (backpressure).
+Memory holds only the boxes in the queue, not the whole run.
+"""
+
+import asyncio
+import contextlib
+import time
+import uuid
+
+import pandas as pd
+import redis
+import redis.asyncio
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+from core.bulk import get_location_data
+from core.cadence import BoxCadence, filter_due_boxes, load_box_states
+from core.health import BoxHealth, filter_open_circuits
+from core.influx import InfluxWriter
+from core.scheduler import IngestScheduler
+from core.sensor_names import load_sensor_aliases
+from core.tools import (
+    filter_sensors,
+    filter_unchanged_boxes,
+    get_boxes_for_ingest,
+    get_locations,
+    get_sensebox_data,
+    get_timeframe,
+    load_phenomenon_allowlists,
+    load_watermarks,
+    save_watermarks,
+)
+from home.models import SenseBoxLocation
+
+ingest_modes = ("sensor", "bulk")
+
+
+class IngestReport:
+    def __init__(self, location: str = "all"):
+        self.location = location
+        self.started = time.monotonic()
+        self.boxes = 0
+        self.written = 0
+        self.empty = 0
+        self.failed = 0
+        self.failed_sensors = 0  # requests of single sensors that failed, the other sensors of the box are kept
+        self.points = 0
+        self.skipped = 0  # boxes left out before fetching (unchanged, not due, ...)
+        self.locked = 0  # locations left out, another run is collecting them
+        self.up_to_date: set[str] = set()  # boxes whose data is in influx after this run (written or nothing new)
+
+    @classmethod
+    def combine(cls, reports: list["IngestReport"], location: str = "all") -> "IngestReport":
+        """one report for many shards, elapsed is the time of the slowest shard"""
+        combined = cls(location)
+        combined.started = min((report.started for report in reports), default=combined.started)
+        for report in reports:
+            for key in ["boxes", "written", "empty", "failed", "failed_sensors", "points", "skipped", "locked"]:
+                setattr(combined, key, getattr(combined, key) + getattr(report, key))
+            combined.up_to_date |= report.up_to_date
+        return combined
+
+    def as_dict(self) -> dict:
+        return {
+            "location": self.location,
+            "boxes": self.boxes,
+            "written": self.written,
+            "empty": self.empty,
+            "failed": self.failed,
+            "failed_sensors": self.failed_sensors,
+            "skipped": self.skipped,
+            "locked": self.locked,
+            "points": self.points,
+            "elapsed": round(time.monotonic() - self.started, 1),
+        }
+
+    def __str__(self):
+        d = self.as_dict()
+        return (
+            f"Ingest {d['location']}: {d['boxes']} boxes, {d['written']} written, {d['empty']} empty, "
+            f"{d['failed']} failed, {d['failed_sensors']} sensors failed, {d['skipped']} skipped, "
+            f"{d['locked']} locations locked, {d['points']} points in {d['elapsed']} s"
+        )
+
+
+async def write_box(
+    influx_writer: InfluxWriter,
+    df: pd.DataFrame,
+    report: IngestReport,
+    cadence: BoxCadence,
+    health: BoxHealth,
+    save_state: bool = True,
+):
+    box_id = df.attrs["box_id"]
+    watermarks = df.attrs.get("watermarks", {})
+
+    async def on_success():
+        # next run starts where this one ended, but only when the batch with this box is in influx
+        if save_state:
+            await sync_to_async(save_watermarks)(box_id, watermarks)
+        cadence.observe(box_id, df.index, last_seen=max(watermarks.values()) if watermarks else None)
+        health.success(box_id, latency=df.attrs.get("latency"))
+        report.written += 1
+        report.up_to_date.add(box_id)
+        print(f"Import complete for {box_id} - {df.attrs['box_name']}")
+
+    await influx_writer.add(box_id, df, on_success=on_success)
+
+
+async def run_pipeline(
+    df: pd.DataFrame,
+    timeframe: str,
+    scheduler: IngestScheduler | None = None,
+    watermarks: dict | None = None,
+    report: IngestReport | None = None,
+    influx_writer: InfluxWriter | None = None,
+    mode: str = "sensor",
+    cadence: BoxCadence | None = None,
+    health: BoxHealth | None = None,
+    save_state: bool = True,
+) -> IngestReport:
+    """
+    fetch -> queue -> influx writer for the boxes of df.
+    save_state=False: watermarks, cadence and health are left as they are (replay of an archive)
+    """
+    if mode not in ingest_modes:
+        raise ValueError(f"Unknown ingest mode {mode!r}, use one of {ingest_modes}")
+
+    if scheduler is None:
+        scheduler = IngestScheduler()
+    if watermarks is None:
+        watermarks = {}
+    if report is None:
+        report = IngestReport()
+    await load_sensor_aliases()
+    if cadence is None or health is None:
+        states = cadence.states if cadence is not None else await load_box_states()
+        if cadence is None:
+            cadence = BoxCadence(states)
+        if health is None:
+            health = BoxHealth(states)
+
+    # a writer passed in is shared with the caller, the caller closes it
+    own_writer = influx_writer is None
+    if own_writer:
+        influx_writer = InfluxWriter()
+    await influx_writer.start()
+
+    writer_count = getattr(settings, "INGEST_WRITERS", 2)
+    queue = asyncio.Queue(maxsize=getattr(settings, "INGEST_QUEUE_SIZE", 20))
+
+    async def fetch(box: pd.Series):
+        report.boxes += 1
+        started = time.monotonic()
+        try:
+            # every request has its own timeout (INGEST_SENSOR_TIMEOUT), the wait for a slot is not limited
+            box_df = await get_sensebox_data(box, timeframe, scheduler, watermarks.get(box["_id"]))
+        except Exception as e:  # a single box must not stop the run
+            print(f">>>>>>>>>>>>>>>> Fetch failed for {box['_id']} - {box['name']}: {e!r}")
+            report.failed += 1
+            health.failure(box["_id"], repr(e) or type(e).__name__, latency=time.monotonic() - started)
+            return
+        box_df.attrs["latency"] = time.monotonic() - started
+        await queue.put(box_df)
+
+    async def fetch_location(location: SenseBoxLocation, boxes: pd.DataFrame):
+        report.boxes += len(boxes)
+        try:
+            box_frames = await get_location_data(location, boxes, timeframe, scheduler, watermarks)
+        except Exception as e:  # a single location must not stop the run
+            print(f">>>>>>>>>>>>>>>> Bulk fetch failed for {location.name}: {e!r}")
+            report.failed += len(boxes)
+            # same ledger as the per sensor mode, a location that keeps failing opens the circuits of its boxes
+            for box_id in boxes["_id"]:
+                health.failure(box_id, repr(e) or type(e).__name__)
+            return
+        for box_df in box_frames:
+            await queue.put(box_df)
+
+    async def fetch_all():
+        if mode == "sensor":
+            await asyncio.gather(*[fetch(box) for index, box in df.iterrows()])
+            return
+
+        if df.empty:
+            return
+        locations = {location.name: location async for location in SenseBoxLocation.objects.all()}
+        tasks = []
+        for name, boxes in df.groupby("location"):
+            if name not in locations:
+                print(f">>>>>>>>>>>>>>>> Location {name} not found, {len(boxes)} boxes not collected")
+                report.failed += len(boxes)
+                continue
+            tasks.append(fetch_location(locations[name], boxes))
+        await asyncio.gather(*tasks)
+
+    async def writer():
+        while True:
+            box_df = await queue.get()
+            try:
+                if box_df is None:  # no more boxes
+                    return
+
+                report.failed_sensors += box_df.attrs.get("failed_sensors", 0)
+
+                if box_df.empty:
+                    print(f"Empty df: {box_df.attrs['box_id']} - {box_df.attrs['box_name']}")
+                    report.empty += 1
+                    cadence.observe(box_df.attrs["box_id"], [])
+                    latency = box_df.attrs.get("latency")
+                    if "error" in box_df.attrs:
+                        health.failure(box_df.attrs["box_id"], box_df.attrs["error"], latency=latency)
+                    else:
+                        health.no_data(box_df.attrs["box_id"], latency=latency)
+                        report.up_to_date.add(box_df.attrs["box_id"])
+                else:
+                    await write_box(influx_writer, box_df, report, cadence, health, save_state)
+            except Exception as e:
+                print(f">>>>>>>>>>>>>>>> Import failed for {box_df.attrs['box_id']}: {e!r}")
+                report.failed += 1
+            finally:
+                queue.task_done()
+
+    writers = [asyncio.create_task(writer()) for _ in range(writer_count)]
+    monitor = asyncio.create_task(scheduler.monitor())
+
+    try:
+        await fetch_all()
+    finally:
+        monitor.cancel()
+        for _ in writers:
+            await queue.put(None)
+        await asyncio.gather(*writers)
+
+        # the rest of the data is written now, watermarks are saved for this last batch
+        if own_writer:
+            await influx_writer.close()
+        else:
+            await influx_writer.flush()
+
+        # next_due_at and health of every box that was fetched
+        if save_state:
+            await sync_to_async(cadence.save)()
+            await sync_to_async(health.save)()
+
+    report.points = influx_writer.points
+    print(scheduler.report())
+    print(report)
+    return report
+
+
+# delete the lock only when it still holds the token of this run, in one step on the redis server
+release_lock_script = """
+if redis.call("get", KEYS[1]) == ARGV[1] then
+    return redis.call("del", KEYS[1])
+end
+return 0
+"""
+
+# extend the lock only while it still holds the token of this run
+renew_lock_script = """
+if redis.call("get", KEYS[1]) == ARGV[1] then
+    return redis.call("pexpire", KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+
+async def renew_lock(client, key: str, token: str, timeout: float):
+    """heartbeat: a run longer than the timeout keeps its lock, a dead run loses it after the timeout"""
+    renew = client.register_script(renew_lock_script)
+    while True:
+        await asyncio.sleep(timeout / 3)
+        try:
+            renewed = await renew(keys=[key], args=[token, int(timeout * 1000)])
+        except redis.RedisError as e:  # try again on the next beat, the lock is valid for two more
+            print(f">>>>>>>> Renewal of {key} failed: {e!r}")
+            continue
+        if not renewed:
+            print(f">>>>>>>> Lock {key} lost, another run may collect the same location now")
+            return
+
+
+@contextlib.asynccontextmanager
+async def location_lock(location_name: str, timeout: float | None = None):
+    """
+    lock in redis, shared by collect_data, cron and the celery workers -> runs never overlap.
+    Yields False, when another run holds the lock. Renewed while the run is going, expires INGEST_LOCK_TIMEOUT after
+    the last renewal, if a run dies.
+    Every run has its own token: a run whose lock expired and was taken by the next run doesn't release that one.
+    """
+    key = f"ingest_lock_{location_name}"
+    token = uuid.uuid4().hex
+    timeout = timeout or getattr(settings, "INGEST_LOCK_TIMEOUT", 3600)
+
+    async with redis.asyncio.Redis.from_url(settings.INGEST_LOCK_REDIS_URL) as client:
+        acquired = bool(await client.set(key, token, nx=True, px=int(timeout * 1000)))
+        heartbeat = asyncio.create_task(renew_lock(client, key, token, timeout)) if acquired else None
+        try:
+            yield acquired
+        finally:
+            if acquired:
+                heartbeat.cancel()
+                await client.register_script(release_lock_script)(keys=[key], args=[token])
+
+
+async def collect_shard(
+    location: SenseBoxLocation,
+    time_delta: float | None = None,
+    mode: str | None = None,
+    use_watermarks: bool = True,
+    ignore_cadence: bool = False,
+    save_state: bool = True,
+) -> IngestReport:
+    """
+    one location = one shard: its own lock, scheduler (concurrency budget of the location), watermarks and report.
+    Shards run side by side (collect), in processes of their own (collect_data --processes) or on celery workers.
+    """
+    # lookback for new boxes/ sensors, all others continue at their watermark. 0 is valid: since midnight
+    if time_delta is None:
+        time_delta = settings.INGEST_BOOTSTRAP_LOOKBACK
+    mode = mode or settings.INGEST_MODE
+    report = IngestReport(location.name)
+
+    async with location_lock(location.name) as acquired:
+        if not acquired:
+            print(f"Location {location.name} is collected by another run, skipped")
+            report.locked = 1
+            return report
+
+        # the boxes come from the snapshot of sync_metadata, the full catalog is not parsed on every run
+        df = await get_boxes_for_ingest(location.name)
+        if df.empty:
+            print(f"{location.name}: no boxes to collect")
+            return report
+        box_ids = df["_id"].tolist()
+
+        timeframe = await get_timeframe(time_delta=time_delta)
+        print(f"{location.name}: time delta {time_delta}, timeframe {timeframe}, mode {mode}")
+
+        watermarks = await load_watermarks(box_ids) if use_watermarks else {}
+        print(f"{location.name}: watermarks found for {len(watermarks)} boxes")
+
+        # every box has its own cadence, only the boxes that are due are collected on this tick
+        box_states = await load_box_states(box_ids)
+        skipped_not_due = 0
+        if not ignore_cadence:
+            df, skipped_not_due = filter_due_boxes(df, box_states)
+
+        # chronically failing boxes are probed with backoff only (see Box Ingest States)
+        df, skipped_open = filter_open_circuits(df, box_states)
+
+        # boxes without new measurements since the last run: no need to ask for every sensor
+        df, skipped_boxes = filter_unchanged_boxes(df, watermarks)
+
+        # only sensors of the phenomena shown on the site (admin: Phenomena, SenseBox Locations)
+        df, skipped_sensors = filter_sensors(df, await load_phenomenon_allowlists())
+
+        print(
+            f"{location.name}: skipped {skipped_not_due} boxes not due, {skipped_open} with open circuit, "
+            f"{skipped_boxes} unchanged, {skipped_sensors} sensors not in the allowlist. {len(df)} boxes to collect"
+        )
+
+        # budget of this location, default: settings
+        scheduler = IngestScheduler(max_concurrency=location.ingest_max_concurrency, rate=location.ingest_rate_limit)
+
+        # every box is written as soon as it is complete
+        report.skipped = skipped_not_due + skipped_open + skipped_boxes
+        return await run_pipeline(
+            df,
+            timeframe,
+            scheduler=scheduler,
+            watermarks=watermarks,
+            report=report,
+            mode=mode,
+            cadence=BoxCadence(box_states),
+            health=BoxHealth(box_states),
+            save_state=save_state,
+        )
+
+
+async def collect(region: str = "all", **kwargs) -> IngestReport:
+    """all locations of the region, each as a shard of its own, side by side in this event loop"""
+    locations = [location async for location in get_locations(region)]
+    if not locations:
+        print("No locations found!")
+        return IngestReport(region)
+
+    reports = await asyncio.gather(*[collect_shard(location, **kwargs) for location in locations])
+    return IngestReport.combine(reports, region)
@@ -0,0 +1,68 @@
+from datetime import datetime, timedelta, timezone
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core.backfill import backfill
+from core.clients import run_with_clients
+from home.models import BackfillWindow
+
+
+def parse_date(value: str) -> datetime:
+    """ISO date or datetime, UTC when no timezone is given"""
+    try:
+        date = datetime.fromisoformat(value)
+    except ValueError:
+        raise CommandError(f"Invalid date {value!r}, use e.g. 2024-05-01 or 2024-05-01T12:00")
+    if date.tzinfo is None:
+        date = date.replace(tzinfo=timezone.utc)
+    return date
+
+
+class Command(BaseCommand):
+    help = (
+        "Load the history of the boxes in windows per box and sensor. Completed windows are checkpointed, "
+        "a restarted backfill continues where it stopped."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--start', type=parse_date, required=True, help="Start of the range (UTC)")
+        parser.add_argument('--end', type=parse_date, default=None, help="End of the range (UTC, default: now)")
+        parser.add_argument('--window', type=float, default=24.0, help="Window size in hours (default: 24)")
+        parser.add_argument('--location', type=str, default="all", help="Name of a SenseBoxLocation (default: all)")
+        parser.add_argument('--box', nargs="+", default=None, help="Only these box ids")
+        parser.add_argument(
+            '--concurrency', type=int, default=None, help="Requests in flight (default: INGEST_MAX_CONCURRENCY)"
+        )
+        parser.add_argument('--rate', type=float, default=None, help="Requests per second (default: INGEST_RATE_LIMIT)")
+        parser.add_argument(
+            '--reset',
+            action='store_true',
+            help="Forget the checkpoints of the range, all windows are fetched again",
+        )
+
+    def handle(self, *args, **options):
+        start = options["start"]
+        end = options["end"] or datetime.now(timezone.utc)
+        if start >= end:
+            raise CommandError("--start must be before --end")
+        if options["window"] <= 0:
+            raise CommandError("--window must be greater than 0")
+
+        if options["reset"]:
+            checkpoints = BackfillWindow.objects.filter(window_start__gte=start, window_end__lte=end)
+            if options["box"]:
+                checkpoints = checkpoints.filter(sensebox_id__in=options["box"])
+            count, _ = checkpoints.delete()
+            print(f"Deleted {count} checkpoints")
+
+        run_with_clients(
+            backfill(
+                options["location"],
+                start,
+                end,
+                timedelta(hours=options["window"]),
+                box_ids=options["box"],
+                max_concurrency=options["concurrency"],
+                rate=options["rate"],
+            )
+        )
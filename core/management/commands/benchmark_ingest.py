@@ -0,0 +1,211 @@
+import json
+import random
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+import pandas as pd
+from django.core.management.base import BaseCommand
+from django.test.utils import override_settings
+
+from core.bulk import get_location_data
+from core.clients import run_with_clients
+from core.parse import minute_means, parse_sensor_response
+from core.scheduler import IngestScheduler
+from core.tools import run_multithreaded
+from home.models import SenseBoxLocation
+
+phenomena = [
+    ("Temperatur", "°C"),
+    ("rel. Luftfeuchte", "%"),
+    ("Luftdruck", "hPa"),
+    ("PM10", "µg/m³"),
+    ("PM2.5", "µg/m³"),
+]
+
+
+def build_boxes(box_count: int) -> pd.DataFrame:
+    """synthetic boxes, same layout as get_boxes_for_ingest()"""
+    boxes = []
+    for b in range(box_count):
+        box_id = f"{b:024x}"
+        sensors = [
+            {"_id": f"{b:020x}{s:04x}", "title": title, "unit": unit} for s, (title, unit) in enumerate(phenomena)
+        ]
+        boxes.append({"_id": box_id, "name": f"Benchmark {b}", "sensors": sensors, "location": "benchmark"})
+    return pd.DataFrame(boxes)
+
+
+def build_measurements(boxes: pd.DataFrame, minutes: int) -> dict[str, list[tuple[str, str, str]]]:
+    """sensor id -> [(box id, createdAt, value)], one value per minute"""
+    start = datetime.now(timezone.utc).replace(second=0, microsecond=0) - timedelta(minutes=minutes)
+    timestamps = [(start + timedelta(minutes=m, seconds=random.randint(0, 59))) for m in range(minutes)]
+    timestamps = [t.strftime("%Y-%m-%dT%H:%M:%S.000Z") for t in timestamps]
+
+    measurements = {}
+    for index, box in boxes.iterrows():
+        for p in box["sensors"]:
+            measurements[p["_id"]] = [(box["_id"], t, f"{random.uniform(0, 100):.2f}") for t in timestamps]
+    return measurements
+
+
+def legacy_parse(content: bytes) -> pd.Series:
+    """the parsing of get_sensebox_data before core/parse.py, for comparison"""
+    sensor_df = pd.DataFrame.from_dict(json.loads(content))
+    created_at = pd.to_datetime(sensor_df["createdAt"], format="%Y-%m-%dT%H:%M:%S.%fZ").dt.floor("Min")
+    values = pd.Series(sensor_df["value"].astype(float).to_numpy(), index=created_at.to_numpy())
+    return values.groupby(level=0).mean()
+
+
+def fast_parse(content: bytes) -> pd.Series:
+    return minute_means(*parse_sensor_response(content))
+
+
+def benchmark_parse(measurements: dict, repeat: int) -> None:
+    """CPU time of the parsing alone: the sensor responses of the stand-in server, legacy vs. fast path"""
+    bodies = [
+        json.dumps([{"value": v, "createdAt": t} for box_id, t, v in values]).encode()
+        for values in measurements.values()
+    ]
+
+    # same result on both paths
+    for body in bodies[:10]:
+        legacy, fast = legacy_parse(body), fast_parse(body)
+        if not (np.allclose(legacy.to_numpy(), fast.to_numpy()) and (legacy.index == fast.index).all()):
+            raise AssertionError("fast parse path differs from the legacy path")
+
+    print()
+    print(f"{'parse':<8}{'seconds':>10}{'responses':>11}{'responses/s':>13}")
+    for name, parse in [("legacy", legacy_parse), ("fast", fast_parse)]:
+        start = time.process_time()
+        for _ in range(repeat):
+            for body in bodies:
+                parse(body)
+        elapsed = time.process_time() - start
+        count = repeat * len(bodies)
+        print(f"{name:<8}{elapsed:>10.2f}{count:>11}{count / elapsed:>13.0f}")
+
+
+def stand_in_server(boxes: pd.DataFrame, measurements: dict, latency: float) -> ThreadingHTTPServer:
+    """local stand-in for the two opensensemap endpoints used by the ingest"""
+    titles = {p["_id"]: p["title"] for sensors in boxes["sensors"] for p in sensors}
+
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            pass
+
+        def send(self, body: str, content_type: str):
+            time.sleep(latency)
+            data = body.encode()
+            self.send_response(200)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            parts = url.path.strip("/").split("/")
+
+            # /boxes/data?phenomenon=...
+            if parts == ["boxes", "data"]:
+                phenomenon = parse_qs(url.query).get("phenomenon", [""])[0]
+                lines = ["boxId,sensorId,createdAt,value"]
+                for sensor_id, values in measurements.items():
+                    if titles[sensor_id] == phenomenon:
+                        lines.extend(f"{box_id},{sensor_id},{t},{v}" for box_id, t, v in values)
+                return self.send("\n".join(lines) + "\n", "text/csv")
+
+            # /boxes/{box}/data/{sensor}
+            if len(parts) == 4 and parts[0] == "boxes" and parts[2] == "data":
+                values = measurements.get(parts[3], [])
+                body = json.dumps([{"value": v, "createdAt": t} for box_id, t, v in values])
+                return self.send(body, "application/json")
+
+            self.send_error(404)
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+class Command(BaseCommand):
+    help = "Compare the per sensor and the bulk ingest against a local stand-in server (nothing is written to influx)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--boxes', type=int, default=200, help="Number of synthetic boxes")
+        parser.add_argument('--minutes', type=int, default=60, help="Values per sensor (one per minute)")
+        parser.add_argument(
+            '--latency', type=float, default=0.05, help="Response delay of the stand-in server in seconds"
+        )
+        parser.add_argument('--rate', type=float, default=None, help="Requests per second (default: INGEST_RATE_LIMIT)")
+        parser.add_argument('--modes', nargs="+", default=["sensor", "bulk"], choices=["sensor", "bulk"])
+        parser.add_argument(
+            '--parse',
+            type=int,
+            default=0,
+            metavar="REPEAT",
+            help="Also compare the parsing of the sensor responses (legacy vs. fast path), REPEAT times each",
+        )
+
+    def handle(self, *args, **options):
+        boxes = build_boxes(options["boxes"])
+        measurements = build_measurements(boxes, options["minutes"])
+        server = stand_in_server(boxes, measurements, options["latency"])
+        url = f"http://127.0.0.1:{server.server_address[1]}"
+
+        print(
+            f"Stand-in server {url}: {len(boxes)} boxes, {len(measurements)} sensors, "
+            f"{options['minutes']} values per sensor, {options['latency']} s latency"
+        )
+
+        # not saved, only used for the bbox
+        location = SenseBoxLocation(name="benchmark")
+        timeframe = (datetime.now(timezone.utc) - timedelta(minutes=options["minutes"] + 1)).strftime(
+            "%Y-%m-%dT%H:%M:%SZ"
+        )
+
+        async def sensor_mode(scheduler):
+            return await run_multithreaded(boxes, timeframe, scheduler)
+
+        async def bulk_mode(scheduler):
+            return await get_location_data(location, boxes, timeframe, scheduler)
+
+        results = []
+        try:
+            with override_settings(OPENSENSEMAP_API_URL=url):
+                for mode in options["modes"]:
+                    scheduler = IngestScheduler(rate=options["rate"])
+                    run = sensor_mode if mode == "sensor" else bulk_mode
+
+                    start = time.perf_counter()
+                    frames = run_with_clients(run(scheduler))
+                    elapsed = time.perf_counter() - start
+
+                    # sensor mode changes the titles in place, next mode starts with the raw titles again
+                    boxes = build_boxes(options["boxes"])
+
+                    values = sum(int(frame.count().sum()) for frame in frames if not frame.empty)
+                    # sensors given up by get_sensebox_data/ bulk (time out, errors), not only failed requests
+                    failed_sensors = sum(frame.attrs.get("failed_sensors", 0) for frame in frames)
+                    results.append((mode, elapsed, scheduler.completed, scheduler.failed, failed_sensors, values))
+        finally:
+            server.shutdown()
+
+        print()
+        print(
+            f"{'mode':<8}{'seconds':>10}{'requests':>10}{'failed':>8}{'sensors failed':>16}{'values':>10}"
+            f"{'values/s':>12}"
+        )
+        for mode, elapsed, requests, failed, failed_sensors, values in results:
+            print(
+                f"{mode:<8}{elapsed:>10.2f}{requests:>10}{failed:>8}{failed_sensors:>16}{values:>10}"
+                f"{values / elapsed:>12.0f}"
+            )
+
+        if options["parse"]:
+            benchmark_parse(measurements, options["parse"])
@@ -1,24 +1,63 @@
-from django.core.management.base import BaseCommand
-
-from home.models import SenseBoxTable, SensorsInfoTable, GroupTag
+from datetime import datetime, timedelta, timezone
 
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
 
-# from core.tools import *
+from home.models import BackfillWindow, BoxIngestState, GroupTag, SenseBoxTable, SensorsInfoTable, SensorWatermark
 
 
 class Command(BaseCommand):
-    help = "Clear (delete) SenseBox table and SensorsInfoTable to get rid of inactive boxes."
+    help = (
+        "Remove inactive boxes: delete SenseBox, SensorsInfo and GroupTag rows not seen for some days "
+        "(last_seen is set by sync_metadata and collect_data)."
+    )
 
-    # def add_arguments(self, parser):
-    #     parser.add_argument('--csv', type=str)
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days',
+            type=float,
+            default=None,
+            help="Delete rows not seen for this many days (default: settings.METADATA_RETENTION_DAYS)",
+        )
+        parser.add_argument(
+            '--all',
+            action='store_true',
+            help="Delete all rows (except featured grouptags), like the old nightly wipe",
+        )
 
     def handle(self, *args, **options):
-        t = SenseBoxTable.objects.all()
-        t.delete()
-        print("Deleted SenseBox table.")
-        t = SensorsInfoTable.objects.all()
-        t.delete()
-        print("Deleted SensorsInfo table.")
-        t = GroupTag.objects.all()
-        t.delete()
-        print("Deleted GroupTag table.")
+        if options["all"]:
+            boxes = SenseBoxTable.objects.all()
+            sensors = SensorsInfoTable.objects.all()
+            tags = GroupTag.objects.all()
+        else:
+            days = options["days"] if options["days"] is not None else settings.METADATA_RETENTION_DAYS
+            cutoff = datetime.now(timezone.utc) - timedelta(days=days)
+            print(f"Sweep rows not seen since {cutoff:%Y-%m-%d %H:%M} ({days} days)")
+
+            boxes = SenseBoxTable.objects.filter(last_seen__lt=cutoff)
+            sensors = SensorsInfoTable.objects.filter(last_seen__lt=cutoff)
+            tags = GroupTag.objects.filter(last_seen__lt=cutoff)
+
+        # featured tags are set in the admin, keep them
+        tags = tags.filter(featured=False)
+
+        with transaction.atomic():
+            box_ids = list(boxes.values_list("sensebox_id", flat=True))
+
+            count, _ = boxes.delete()
+            print(f"Deleted {count} rows of SenseBox table (incl. grouptag relations).")
+            count, _ = sensors.delete()
+            print(f"Deleted {count} rows of SensorsInfo table.")
+            count, _ = tags.delete()
+            print(f"Deleted {count} rows of GroupTag table.")
+
+            # a removed box starts from scratch, when it comes back
+            if not options["all"]:
+                count, _ = SensorWatermark.objects.filter(sensebox_id__in=box_ids).delete()
+                print(f"Deleted {count} watermarks.")
+                count, _ = BoxIngestState.objects.filter(sensebox_id__in=box_ids).delete()
+                print(f"Deleted {count} box ingest states.")
+                count, _ = BackfillWindow.objects.filter(sensebox_id__in=box_ids).delete()
+                print(f"Deleted {count} backfill checkpoints.")
@@ -1,65 +1,127 @@
-import asyncio
+import multiprocessing
 import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import timezone
 
-from django.conf import settings
 from django.core.cache import caches
 from django.core.management.base import BaseCommand
+from django.db import connections
 
-from core.tools import (
-    datetime,
-    get_latest_boxes_with_distance_as_df,
-    get_timeframe,
-    get_url,
-    run_multithreaded,
-    write_to_influx,
-)
-from home.models import SenseBoxTable
+from core.archive import Archive, use_archive
+from core.clients import run_with_clients
+from core.ingest import IngestReport, collect, ingest_modes
+from core.tools import datetime, regenerate_cache
+from home.models import SenseBoxLocation, SenseBoxTable
+
+
+def collect_in_process(location_name: str, kwargs: dict) -> IngestReport:
+    """one shard in a process of its own (own event loop, own connections)"""
+    return run_with_clients(collect(location_name, **kwargs))
 
 
 class Command(BaseCommand):
-    help = "Collect new data from senseBoxes"
+    help = "Collect new data from senseBoxes (celery beat runs the same per location, see core/tasks.py)"
 
     def add_arguments(self, parser):
-        parser.add_argument('-t', type=float, help="Time delta to collect data")
+        parser.add_argument(
+            '-t',
+            type=float,
+            default=None,
+            help="Time delta in days to collect data (for sensors without watermark), 0: since midnight "
+            "(default: settings.INGEST_BOOTSTRAP_LOOKBACK)",
+        )
+        parser.add_argument(
+            '--no-watermarks',
+            action='store_true',
+            help="Ignore the stored watermarks and collect the whole time delta for every sensor",
+        )
+        parser.add_argument(
+            '--mode',
+            choices=ingest_modes,
+            default=None,
+            help="sensor: one request per sensor, bulk: one csv download per location and phenomenon "
+            "(default: settings.INGEST_MODE)",
+        )
+        parser.add_argument(
+            '--ignore-cadence',
+            action='store_true',
+            help="Collect all boxes, not only the boxes that are due (see Box Ingest States)",
+        )
+        parser.add_argument('--location', type=str, default="all", help="Name of a SenseBoxLocation (default: all)")
+        parser.add_argument(
+            '--processes',
+            type=int,
+            default=1,
+            help="Run the locations in this many processes (default: 1, all locations in one event loop)",
+        )
+        archive = parser.add_mutually_exclusive_group()
+        archive.add_argument(
+            '--archive',
+            nargs="?",
+            const="",
+            default=None,
+            metavar="DIR",
+            help="Store the raw api responses in DIR (default: settings.INGEST_ARCHIVE_DIR)",
+        )
+        archive.add_argument(
+            '--replay',
+            nargs="?",
+            const="",
+            default=None,
+            metavar="DIR",
+            help="Collect from the archive in DIR instead of the api (no watermarks, cadence and health changes)",
+        )
 
     def handle(self, *args, **options):
 
-        if options["t"]:
-            time_delta = options["t"]
-        else:
-            time_delta = 0.0
-
-        print(f"Time delta: {time_delta}")
-
         start_timer = time.time()
 
-        # this df contains only data fron "today" no further checks needed
-        df = asyncio.run(get_latest_boxes_with_distance_as_df())
-
-        print(f"get_latest_boxes_with_distance_as_df: {time.time() - start_timer}")
-
         # Any value between 0.1 and 3.0 (3 days) can be selected. Even higher numbers are possible, but are very ressource intensive for the senseBox API.
-        # Default should be 0.0. This means, data is collected until midnight. Selecting other values between 0 and 1 does not save anything, as it seems.
-        timeframe = asyncio.run(get_timeframe(time_delta=time_delta)) # 0.0 collects data for this day, until midnight.
-        print(f"timeframe: {timeframe}")
-
-        """
-        ToDo: split up this job for every location?
-        """
-        # return a list of df
-        results_list = asyncio.run(run_multithreaded(df, timeframe))
-
-        for df in results_list:
-
-            if df.empty:
-                print(f"Empty df: {df.attrs['box_id']} - {df.attrs['box_name']}")
+        # Default (no -t): settings.INGEST_BOOTSTRAP_LOOKBACK, only for sensors without watermark.
+        kwargs = {
+            "time_delta": options["t"],
+            "mode": options["mode"],
+            "use_watermarks": not options["no_watermarks"],
+            "ignore_cadence": options["ignore_cadence"],
+        }
+
+        archive = None
+        if options["archive"] is not None:
+            archive = Archive(options["archive"] or None)
+            use_archive(archive)
+            print(f"Archive responses in {archive.path}")
+        elif options["replay"] is not None:
+            archive = Archive(options["replay"] or None)
+            use_archive(archive, replay=True)
+
+            # all boxes, all recorded values: the archive is the same, no matter what happened since
+            if kwargs["time_delta"] is None:
+                oldest = archive.oldest_recording() or datetime.now(timezone.utc)
+                kwargs["time_delta"] = (datetime.now(timezone.utc) - oldest).total_seconds() / 86400 + 3.0
+            kwargs.update(use_watermarks=False, ignore_cadence=True, save_state=False)
+            print(f"Replay from {archive.path}, time delta {kwargs['time_delta']:.2f} days")
+
+        # every location is a shard: own lock, concurrency budget, watermarks and report
+        # locations collected by a celery worker at the same time are skipped (lock per location)
+        if options["processes"] > 1:
+            if options["location"] == "all":
+                names = list(SenseBoxLocation.objects.values_list("name", flat=True))
             else:
-                # print(f"dtype index: {df.index.dtype}")
-                if write_to_influx(sensebox_id=df.attrs["box_id"], df=df):
-                    print(f"Import complete for {df.attrs['box_id']} - {df.attrs['box_name']}")
-                else:
-                    print(f">>>>>>>>>>>>>>>> Import not succeed for {df.attrs['box_id']} - {df.attrs['box_name']}")
-
+                names = [options["location"]]
+
+            # the forked processes must not share the database connection of this one
+            connections.close_all()
+            with ProcessPoolExecutor(
+                max_workers=options["processes"], mp_context=multiprocessing.get_context("fork")
+            ) as pool:
+                reports = list(pool.map(collect_in_process, names, [kwargs] * len(names)))
+
+            for shard_report in reports:
+                print(shard_report)
+            report = IngestReport.combine(reports, options["location"])
+        else:
+            # all requests of this run share one connection pool per host, closed when the run is done
+            report = run_with_clients(collect(options["location"], **kwargs))
 
         # check SenseBox Table fpr errors and fix them
         all_boxes = SenseBoxTable.objects.all()
@@ -68,7 +130,9 @@ class Command(BaseCommand):
                 print(f"Missing location, delete box: {box.sensebox_id}")
                 box.delete()
 
-        print(results_list[60].shape)
+        print(report)
+        if archive is not None and options["processes"] == 1:
+            print(archive.summary())
         print(f"Time elapsed: {time.time() - start_timer}")
         print(datetime.now())
 
@@ -76,32 +140,11 @@ class Command(BaseCommand):
         Regenerate cache
         """
 
+        if options["replay"] is not None:
+            return  # the site shows the live boxes, not the archived ones
+
         print(f">>>>>>>>>> cache backend: {caches['default']}")
 
-        if settings.DEBUG:
-            print("Debug mode on: no regeneration of cache")
-        else:
-            domain = settings.WAGTAILADMIN_BASE_URL + "/"
-
-            print("regenerate cache ...")
-            cache_list = [
-                "hexmap?ressource_path=Temperatur",
-                "hexmap?ressource_path=PM10&colorscale=GnBu",
-            ]
-
-            # erfrischungskarte
-            for i in range(9, 22):
-                cache_list.append( f"erfrischungskarte/{i}Uhr/")
-
-            # add single page urls to cache_list
-            single_page_list = ['s/' + i for i in cache_list]
-            cache_list.extend(single_page_list)
-
-            for url in cache_list:
-                r = get_url(domain + url)
-                if r:
-                    print(f"+++ success: {domain + url}")
-                else:
-                    print(f"--- failed to get response from: {domain + url}")
-
-            print(f"Time elapsed: {time.time() - start_timer}")
+        regenerate_cache()
+
+        print(f"Time elapsed: {time.time() - start_timer}")
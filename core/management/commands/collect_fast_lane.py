@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from core.clients import run_with_clients
+from core.fast_lane import collect_fast_lane
+
+
+class Command(BaseCommand):
+    help = "Collect the boxes of featured and currently viewed grouptags (run every minute)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--location', type=str, default="all", help="Name of a SenseBoxLocation (default: all)")
+
+    def handle(self, *args, **options):
+        run_with_clients(collect_fast_lane(options["location"]))
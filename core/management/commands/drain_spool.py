@@ -0,0 +1,12 @@
+from asgiref.sync import async_to_sync
+from django.core.management.base import BaseCommand
+
+from core.influx import drain_spool
+
+
+class Command(BaseCommand):
+    help = "Write the batches left in the influx spool (INFLUX_SPOOL_DIR) to influx, e.g. after an influx outage"
+
+    def handle(self, *args, **options):
+        points = async_to_sync(drain_spool)()
+        print(f"Drained {points} points")
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from core.clients import run_with_clients
+from core.tools import sync_metadata
+
+
+class Command(BaseCommand):
+    help = "Sync box metadata (names, coordinates, grouptags, sensors) and refresh the box snapshot used by collect_data"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--location', type=str, default="all", help="Name of a SenseBoxLocation (default: all)")
+
+    def handle(self, *args, **options):
+        run_with_clients(sync_metadata(options["location"]))
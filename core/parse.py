@@ -0,0 +1,100 @@
+"""
+Fast parsing of the sensor responses of opensensemap (/boxes/{box}/data/{sensor}?format=json).
+
+The body is decoded with orjson (json without it) straight into two NumPy arrays: the timestamps as int64 ns since
+the epoch (UTC) and the values as float64. createdAt always has the same format "2024-05-01T12:00:00.000Z", so the
+timestamps are read from the fixed positions of the digits, for all values at once. Other formats fall back to pandas.
+
+No DataFrame per sensor: the mean per minute is calculated with NumPy as well (minute_means).
+"""
+
+import json
+
+import numpy as np
+import pandas as pd
+
+try:
+    import orjson
+
+    loads = orjson.loads
+except ImportError:
+    loads = json.loads
+
+iso_length = 24  # 2024-05-01T12:00:00.000Z
+iso_separators = {4: "-", 7: "-", 10: "T", 13: ":", 16: ":", 19: ".", 23: "Z"}
+ns_per_minute = 60 * 1_000_000_000
+
+
+def parse_iso_timestamps(created_at: list[str]) -> np.ndarray:
+    """["2024-05-01T12:00:00.000Z", ...] -> int64 ns since the epoch (UTC)"""
+    if not created_at:
+        return np.empty(0, dtype=np.int64)
+
+    try:
+        raw = np.frombuffer("".join(created_at).encode("ascii"), dtype=np.uint8)
+    except UnicodeEncodeError:
+        raw = None
+
+    if raw is None or raw.size != iso_length * len(created_at):
+        return fallback_timestamps(created_at)
+
+    chars = raw.reshape(-1, iso_length)
+    for position, separator in iso_separators.items():
+        if not (chars[:, position] == ord(separator)).all():
+            return fallback_timestamps(created_at)
+
+    digits = chars.astype(np.int64) - ord("0")
+
+    def number(start: int, length: int) -> np.ndarray:
+        result = np.zeros(len(digits), dtype=np.int64)
+        for position in range(start, start + length):
+            result = result * 10 + digits[:, position]
+        return result
+
+    year, month, day = number(0, 4), number(5, 2), number(8, 2)
+    hour, minute, second, millisecond = number(11, 2), number(14, 2), number(17, 2), number(20, 3)
+
+    # days since the epoch: first day of the month from numpy (leap years, month lengths), then the day
+    months = (year - 1970) * 12 + (month - 1)
+    days = months.astype("datetime64[M]").astype("datetime64[D]").astype(np.int64) + (day - 1)
+
+    seconds = ((days * 24 + hour) * 60 + minute) * 60 + second
+    return seconds * 1_000_000_000 + millisecond * 1_000_000
+
+
+def fallback_timestamps(created_at: list[str]) -> np.ndarray:
+    return pd.DatetimeIndex(pd.to_datetime(created_at, utc=True, format="ISO8601")).as_unit("ns").asi8
+
+
+def parse_values(values: list) -> np.ndarray:
+    """the values come as strings ("21.5"), garbage becomes NaN"""
+    try:
+        return np.array(values, dtype=np.float64)
+    except (TypeError, ValueError):
+        return pd.to_numeric(pd.Series(values), errors="coerce").to_numpy(dtype=np.float64)
+
+
+def parse_sensor_response(content: bytes) -> tuple[np.ndarray, np.ndarray]:
+    """body of a sensor response -> (timestamps int64 ns UTC, values float64). Anything but a list is empty"""
+    data = loads(content)
+    if not isinstance(data, list) or not data:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64)
+
+    measurements = [m for m in data if isinstance(m, dict) and "createdAt" in m and "value" in m]
+    timestamps = parse_iso_timestamps([m["createdAt"] for m in measurements])
+    values = parse_values([m["value"] for m in measurements])
+    return timestamps, values
+
+
+def minute_means(timestamps: np.ndarray, values: np.ndarray) -> pd.Series:
+    """mean per minute (NaN left out), index: the minutes as naive UTC DatetimeIndex, same as get_sensebox_data"""
+    keep = ~np.isnan(values)
+    minutes = timestamps[keep] - timestamps[keep] % ns_per_minute
+    values = values[keep]
+
+    unique_minutes, positions = np.unique(minutes, return_inverse=True)
+    sums = np.bincount(positions, weights=values, minlength=len(unique_minutes))
+    counts = np.bincount(positions, minlength=len(unique_minutes))
+
+    index = pd.DatetimeIndex(unique_minutes.astype("datetime64[ns]"))
+    return pd.Series(sums / counts, index=index)
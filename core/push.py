@@ -0,0 +1,310 @@
+"""
+Push ingest: boxes and partners send their measurements, instead of being polled.
+
+POST /push/<box id>  opensensemap formats (https://docs.opensensemap.org/#api-Measurements-postNewMeasurements):
+    application/json  [{"sensor": "<id>", "value": 21.5, "createdAt": "2024-05-01T12:00:00Z"}, ...]
+                      or {"<sensor id>": 21.5, "<sensor id>": [21.5, "2024-05-01T12:00:00Z"], ...}
+    text/csv          <sensor id>,<value>[,<createdAt>] one line per value
+POST /push           line protocol (text/plain): <box id> <sensor title>=21.5,... [timestamp], ?precision=ns|ms|s
+
+Authorization: Bearer <token>, the tokens are set in PUSH_TOKENS. The sensor ids are looked up in the box snapshot
+(sync_metadata), the titles get the same canonical names as the polled data (normalize_sensor).
+
+The values go into a bounded queue and are written by an InfluxWriter in the background (batches, spool).
+The answer comes at once: 202, or 503 with Retry-After when the queue is full. On shutdown of the server the queue
+is written before the loop ends (close_push_buffer), nothing answered with 202 is dropped.
+"""
+
+import asyncio
+import json
+import math
+import weakref
+from datetime import datetime, timedelta, timezone
+
+import pandas as pd
+from django.conf import settings
+from django.core.cache import cache
+
+from core.influx import InfluxWriter
+from core.sensor_names import load_sensor_aliases, normalize_sensor, version_key
+from core.tools import box_snapshot_key, get_locations
+
+sensor_index_key = "push_sensor_index"  # {box id: {sensor id: canonical title}}
+
+
+class PushError(Exception):
+    """the batch can't be read, answered with 400"""
+
+
+async def get_sensor_index() -> dict[str, dict[str, str]]:
+    # rebuilt after a change of the sensor aliases (new version)
+    key = f"{sensor_index_key}_{await cache.aget(version_key, 0)}"
+    index = await cache.aget(key)
+    if index is not None:
+        return index
+
+    index = {}
+    async for location in get_locations():
+        snapshot = await cache.aget(box_snapshot_key(location.name))
+        if snapshot is None or snapshot.empty:
+            continue
+        for box_id, sensors in zip(snapshot["_id"], snapshot["sensors"]):
+            index[box_id] = {p["_id"]: normalize_sensor(p["title"], p["unit"])[0] for p in sensors}
+
+    await cache.aset(key, index, timeout=10 * 60)
+    return index
+
+
+def parse_time(value, now: datetime) -> datetime:
+    if value is None or value == "":
+        return now
+    try:
+        timestamp = pd.Timestamp(value)
+    except (ValueError, TypeError):
+        raise PushError(f"Invalid createdAt: {value!r}")
+    if timestamp.tzinfo is None:
+        timestamp = timestamp.tz_localize("UTC")
+    return timestamp.tz_convert("UTC").to_pydatetime()
+
+
+def parse_json(text: str, now: datetime) -> list[tuple[str, object, datetime]]:
+    """-> [(sensor id, value, time)]"""
+    try:
+        data = json.loads(text)
+    except ValueError as e:
+        raise PushError(f"Invalid JSON: {e}")
+
+    records = []
+    if isinstance(data, list):
+        for item in data:
+            if not isinstance(item, dict) or "sensor" not in item or "value" not in item:
+                raise PushError('Every entry needs "sensor" and "value"')
+            records.append((str(item["sensor"]), item["value"], parse_time(item.get("createdAt"), now)))
+    elif isinstance(data, dict):
+        for sensor_id, item in data.items():
+            if isinstance(item, list):
+                if not item:
+                    raise PushError(f"No value for sensor {sensor_id}")
+                records.append((sensor_id, item[0], parse_time(item[1] if len(item) > 1 else None, now)))
+            else:
+                records.append((sensor_id, item, now))
+    else:
+        raise PushError("Expected a list or an object")
+    return records
+
+
+def parse_csv(text: str, now: datetime) -> list[tuple[str, object, datetime]]:
+    records = []
+    for line in text.splitlines():
+        line = line.strip()
+        if not line:
+            continue
+        parts = [part.strip() for part in line.split(",")]
+        if len(parts) < 2:
+            raise PushError(f"Expected <sensor id>,<value>[,<createdAt>]: {line!r}")
+        records.append((parts[0], parts[1], parse_time(parts[2] if len(parts) > 2 else None, now)))
+    return records
+
+
+def split_unescaped(text: str, separator: str) -> list[str]:
+    """split at the separator, but not at an escaped one (backslash)"""
+    parts = []
+    current = []
+    escaped = False
+    for char in text:
+        if escaped:
+            current.append(char)
+            escaped = False
+        elif char == "\\":
+            escaped = True
+        elif char == separator:
+            parts.append("".join(current))
+            current = []
+        else:
+            current.append(char)
+    parts.append("".join(current))
+    return parts
+
+
+def parse_line_protocol(text: str, now: datetime, precision: str = "ns") -> list[tuple[str, str, object, datetime]]:
+    """-> [(box id, sensor title, value, time)]. Tags are ignored, string and boolean fields are skipped"""
+    ns_per_unit = {"ns": 1, "us": 1_000, "ms": 1_000_000, "s": 1_000_000_000}.get(precision)
+    if ns_per_unit is None:
+        raise PushError(f"Invalid precision: {precision!r}")
+
+    records = []
+    for line in text.splitlines():
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+
+        parts = [part for part in split_unescaped(line, " ") if part]
+        if len(parts) not in (2, 3):
+            raise PushError(f"Expected <box id> <field>=<value>[,...] [timestamp]: {line!r}")
+
+        box_id = split_unescaped(parts[0], ",")[0]
+        if len(parts) == 3:
+            try:
+                created_at = datetime.fromtimestamp(int(parts[2]) * ns_per_unit / 1e9, timezone.utc)
+            except (ValueError, OverflowError, OSError):
+                raise PushError(f"Invalid timestamp: {parts[2]!r}")
+        else:
+            created_at = now
+
+        for field in split_unescaped(parts[1], ","):
+            key, separator, value = field.partition("=")
+            if not separator:
+                raise PushError(f"Invalid field: {field!r}")
+            if value.startswith('"') or value.lower() in ("t", "f", "true", "false"):
+                continue
+            records.append((box_id, key, value.rstrip("iu"), created_at))
+    return records
+
+
+def to_number(value) -> float | None:
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        return None
+    return number if math.isfinite(number) else None
+
+
+def build_frames(records: list[tuple[str, str, object, datetime]], now: datetime) -> tuple[list[pd.DataFrame], int]:
+    """
+    [(box id, title, value, time)] -> one frame per box, same layout as get_sensebox_data() (index createdAt in
+    minutes, UTC, one column per canonical sensor title, mean per minute). Returns the frames and the rejected values
+    """
+    latest = now + timedelta(minutes=5)
+    rows = []
+    rejected = 0
+    for box_id, title, value, created_at in records:
+        number = to_number(value)
+        if number is None or created_at > latest:
+            rejected += 1
+            continue
+        rows.append((box_id, title, number, created_at))
+
+    if not rows:
+        return [], rejected
+
+    df = pd.DataFrame(rows, columns=["box_id", "title", "value", "createdAt"])
+    df["createdAt"] = pd.to_datetime(df["createdAt"], utc=True).dt.tz_localize(None).dt.floor("Min")
+
+    frames = []
+    for box_id, box_df in df.groupby("box_id"):
+        frame = box_df.pivot_table(index="createdAt", columns="title", values="value", aggfunc="mean")
+        frame.columns.name = None
+        frame.attrs["box_id"] = box_id
+        frames.append(frame)
+    return frames, rejected
+
+
+async def parse_push(
+    body: bytes, content_type: str, sensebox_id: str | None, precision: str = "ns"
+) -> tuple[list[pd.DataFrame], int]:
+    """validate and normalize a batch -> frames per box and the number of rejected values"""
+    now = datetime.now(timezone.utc)
+    await load_sensor_aliases()
+    index = await get_sensor_index()
+
+    try:
+        text = body.decode()
+    except UnicodeDecodeError:
+        raise PushError("The body must be UTF-8")
+
+    if content_type.startswith("text/plain"):
+        records = []
+        rejected = 0
+        for box_id, title, value, created_at in parse_line_protocol(text, now, precision):
+            if box_id not in index or (sensebox_id and box_id != sensebox_id):
+                rejected += 1
+                continue
+            records.append((box_id, normalize_sensor(title, "")[0], value, created_at))
+    else:
+        if sensebox_id is None:
+            raise PushError("JSON and CSV need the box id in the url: /push/<box id>")
+        if sensebox_id not in index:
+            raise PushError(f"Unknown box {sensebox_id}")
+
+        if content_type.startswith("application/json"):
+            sensor_records = parse_json(text, now)
+        elif content_type.startswith("text/csv"):
+            sensor_records = parse_csv(text, now)
+        else:
+            raise PushError(f"Unsupported content type {content_type!r}, use application/json, text/csv or text/plain")
+
+        titles = index[sensebox_id]
+        records = [
+            (sensebox_id, titles[sensor_id], value, created_at)
+            for sensor_id, value, created_at in sensor_records
+            if sensor_id in titles
+        ]
+        rejected = len(sensor_records) - len(records)
+
+    max_values = getattr(settings, "PUSH_MAX_VALUES", 10000)
+    if len(records) > max_values:
+        raise PushError(f"More than {max_values} values in one batch")
+
+    frames, invalid = build_frames(records, now)
+    return frames, rejected + invalid
+
+
+class PushBuffer:
+    """bounded queue -> InfluxWriter, one per event loop (daphne: one for the whole process)"""
+
+    def __init__(self):
+        self.queue = asyncio.Queue(maxsize=getattr(settings, "PUSH_QUEUE_SIZE", 1000))
+        self.influx_writer = InfluxWriter()
+        self.task = None
+        self.closed = False
+
+    async def start(self):
+        await self.influx_writer.start()
+        self.task = asyncio.create_task(self._write())
+
+    async def _write(self):
+        while True:
+            frame = await self.queue.get()
+            try:
+                await self.influx_writer.add(frame.attrs["box_id"], frame)
+            except Exception as e:  # keep the writer alive
+                print(f">>>>>>>> Push write failed for {frame.attrs['box_id']}: {e!r}")
+            finally:
+                self.queue.task_done()
+
+    def offer(self, frames: list[pd.DataFrame]) -> bool:
+        """all frames of the batch or none. False: the queue is full or the server shuts down"""
+        if self.closed or self.queue.maxsize - self.queue.qsize() < len(frames):
+            return False
+        for frame in frames:
+            self.queue.put_nowait(frame)
+        return True
+
+    async def close(self):
+        """write everything accepted with 202 (influx or spool), then stop"""
+        self.closed = True
+        await self.queue.join()
+        if self.task is not None:
+            self.task.cancel()
+        await self.influx_writer.close()
+
+
+_buffers: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, PushBuffer]" = weakref.WeakKeyDictionary()
+
+
+async def get_push_buffer() -> PushBuffer:
+    loop = asyncio.get_running_loop()
+    buffer = _buffers.get(loop)
+    if buffer is None:
+        buffer = PushBuffer()
+        _buffers[loop] = buffer
+        await buffer.start()
+    return buffer
+
+
+async def close_push_buffer() -> None:
+    """shutdown of the ASGI server (core/clients.py): the buffer of the running loop is written before it ends"""
+    buffer = _buffers.pop(asyncio.get_running_loop(), None)
+    if buffer is not None:
+        print(f"Push buffer: writing {buffer.queue.qsize()} queued frames before shutdown")
+        await buffer.close()
@@ -0,0 +1,252 @@
+"""
+Request scheduler for the ingest (collect_data, show_by_tag).
+
+- a global cap on concurrent requests (asyncio.Semaphore)
+- a token bucket per host, so api.opensensemap.org gets a steady stream of requests instead of a burst
+- 429/503 with "Retry-After" pause the whole host, not only the single request
+- the rate per host adapts (AIMD): it's halved, when the error rate rises, and grows slowly again on success
+- queue depth, in-flight requests etc. can be printed while the run is going on
+"""
+
+import asyncio
+import contextlib
+import time
+from collections import deque
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlparse
+
+import httpx
+from django.conf import settings
+
+from core.clients import get_client
+
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+
+
+def parse_retry_after(value: str | None) -> float | None:
+    """'Retry-After' is either a number of seconds or a http date"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate  # tokens per second
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.paused_until = 0.0  # set by Retry-After
+        self.lock = asyncio.Lock()  # waiting requests get their token in order
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self):
+        async with self.lock:
+            while True:
+                pause = self.paused_until - time.monotonic()
+                if pause > 0:
+                    await asyncio.sleep(pause)
+                    continue
+
+                self._refill()
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def pause(self, seconds: float):
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+
+class HostState:
+    def __init__(self, host: str, rate: float, burst: int, error_threshold: float, window: int = 50):
+        self.host = host
+        self.max_rate = rate
+        self.min_rate = max(0.1, rate / 20)
+        self.bucket = TokenBucket(rate, burst)
+        self.error_threshold = error_threshold
+        self.outcomes = deque(maxlen=window)  # True = success
+        self.last_decrease = 0.0
+
+    @property
+    def error_rate(self) -> float:
+        if not self.outcomes:
+            return 0.0
+        return 1 - sum(self.outcomes) / len(self.outcomes)
+
+    def record(self, success: bool):
+        self.outcomes.append(success)
+
+        if success:
+            # additive increase
+            self.bucket.rate = min(self.max_rate, self.bucket.rate + self.max_rate / 100)
+        elif len(self.outcomes) >= 10 and self.error_rate > self.error_threshold:
+            # multiplicative decrease, at most once per second (a burst of errors should not drop the rate to zero)
+            now = time.monotonic()
+            if now - self.last_decrease > 1.0:
+                self.bucket.rate = max(self.min_rate, self.bucket.rate / 2)
+                self.last_decrease = now
+                print(
+                    f"Scheduler: error rate {self.error_rate:.0%} for {self.host}, "
+                    f"backing off to {self.bucket.rate:.2f} req/s"
+                )
+
+
+class IngestScheduler:
+    def __init__(
+        self,
+        max_concurrency: int | None = None,
+        rate: float | None = None,
+        burst: int | None = None,
+        max_retries: int | None = None,
+        error_threshold: float | None = None,
+    ):
+        self.max_concurrency = max_concurrency or getattr(settings, "INGEST_MAX_CONCURRENCY", 16)
+        self.rate = rate or getattr(settings, "INGEST_RATE_LIMIT", 10.0)
+        self.burst = burst or getattr(settings, "INGEST_RATE_BURST", 20)
+        self.max_retries = max_retries if max_retries is not None else getattr(settings, "INGEST_MAX_RETRIES", 3)
+        self.error_threshold = error_threshold or getattr(settings, "INGEST_ERROR_RATE_THRESHOLD", 0.2)
+
+        self.semaphore = asyncio.Semaphore(self.max_concurrency)
+        self.hosts: dict[str, HostState] = {}
+
+        self.queued = 0
+        self.in_flight = 0
+        self.completed = 0
+        self.failed = 0
+        self.retried = 0
+        self.throttled = 0  # 429 responses
+        self.started = time.monotonic()
+
+    def _host(self, url: str) -> HostState:
+        host = urlparse(url).netloc
+        if host not in self.hosts:
+            self.hosts[host] = HostState(host, self.rate, self.burst, self.error_threshold)
+        return self.hosts[host]
+
+    async def _acquire(self, state: HostState):
+        self.queued += 1
+        try:
+            await state.bucket.acquire()
+            await self.semaphore.acquire()
+        finally:
+            self.queued -= 1
+
+    @contextlib.asynccontextmanager
+    async def slot(self, url: str):
+        """rate limit and concurrency cap for requests not made with get(), e.g. streamed downloads (no retries)"""
+        state = self._host(url)
+        await self._acquire(state)
+
+        self.in_flight += 1
+        try:
+            yield
+        except Exception:
+            state.record(False)
+            self.failed += 1
+            raise
+        else:
+            state.record(True)
+            self.completed += 1
+        finally:
+            self.in_flight -= 1
+            self.semaphore.release()
+
+    async def get(self, url: str, headers=None, timeout: float | None = None) -> httpx.Response:
+        """
+        GET with rate limit, concurrency cap and retries. Raises the last httpx.RequestError (or TimeoutError)
+        when all attempts fail. timeout: seconds per attempt, only the request, not the wait for a slot
+        """
+        if headers is None:
+            headers = {"Accept": "application/json"}
+
+        state = self._host(url)
+        client = get_client(url)
+
+        response = None
+        for attempt in range(self.max_retries + 1):
+            if attempt > 0:
+                self.retried += 1
+
+            await self._acquire(state)
+
+            self.in_flight += 1
+            try:
+                response = await asyncio.wait_for(client.get(url, headers=headers), timeout=timeout)
+            except (httpx.RequestError, TimeoutError) as exc:
+                print(f">>>>>>>> Request error for {url} (attempt {attempt + 1}): {exc!r}")
+                state.record(False)
+                if attempt == self.max_retries:
+                    self.failed += 1
+                    raise
+                response = None
+            finally:
+                self.in_flight -= 1
+                self.semaphore.release()
+
+            if response is None:
+                # wait without holding a slot
+                await asyncio.sleep(0.5 * 2**attempt)
+                continue
+
+            if response.status_code not in RETRY_STATUS_CODES:
+                state.record(True)
+                self.completed += 1
+                return response
+
+            state.record(False)
+
+            if response.status_code == 429:
+                self.throttled += 1
+
+            # pause the whole host, when the api tells us to do so. Otherwise: exponential backoff for this request
+            retry_after = parse_retry_after(response.headers.get("Retry-After"))
+            if retry_after is not None:
+                print(f"Scheduler: {state.host} asks to retry after {retry_after:.1f} s")
+                state.bucket.pause(retry_after)
+            elif attempt < self.max_retries:
+                await asyncio.sleep(0.5 * 2**attempt)
+
+        self.failed += 1
+        return response
+
+    def stats(self) -> dict:
+        return {
+            "queued": self.queued,
+            "in_flight": self.in_flight,
+            "completed": self.completed,
+            "failed": self.failed,
+            "retried": self.retried,
+            "throttled": self.throttled,
+            "elapsed": round(time.monotonic() - self.started, 1),
+            "rates": {host: round(state.bucket.rate, 2) for host, state in self.hosts.items()},
+        }
+
+    def report(self) -> str:
+        s = self.stats()
+        rate = s["completed"] / s["elapsed"] if s["elapsed"] else 0.0
+        return (
+            f"Scheduler: queued {s['queued']}, in flight {s['in_flight']}, completed {s['completed']}, "
+            f"failed {s['failed']}, retried {s['retried']}, throttled {s['throttled']}, "
+            f"{rate:.1f} req/s, host rates {s['rates']}"
+        )
+
+    async def monitor(self, interval: float | None = None):
+        """print the report every few seconds, run it as a task and cancel it at the end"""
+        interval = interval or getattr(settings, "INGEST_REPORT_INTERVAL", 10.0)
+        while True:
+            await asyncio.sleep(interval)
+            print(self.report())
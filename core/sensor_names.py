@@ -0,0 +1,162 @@
+"""
+Canonical sensor names (admin: Phenomena, Sensor Aliases).
+
+Boxes name the same sensor differently ("Temperature", "Lufttemperatur", "temperature"). SensorAlias maps a raw
+title, optionally only for one unit, to a Phenomenon: its name and unit are used for influx, the graphs and the
+dashboards. normalize_sensor() is the one place for this, used by the ingest, the push ingest and the views.
+
+The aliases are compiled into a dict per process, a lookup is two dict accesses. Saving or deleting an alias or a
+phenomenon drops the index of this process and bumps a version in the cache: the other processes (celery workers,
+collect_data) see the new version within SENSOR_ALIAS_CHECK_INTERVAL seconds and rebuild their index.
+Inside an event loop the rebuild runs in a thread and the old index is used until it's done; async entry points
+load the index with load_sensor_aliases() first.
+"""
+
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DatabaseError, connection
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from home.models import Phenomenon, SensorAlias
+
+version_key = "sensor_alias_version"
+
+_index: dict | None = None  # {"aliases": {(title, unit): (name, unit)}, "units": {name: unit}}
+_index_version = None
+_checked_at = 0.0
+_rebuild = None  # future of a rebuild started in an event loop
+
+# the ORM must not be used in the thread of an event loop, the index is built in a thread of its own
+_executor = ThreadPoolExecutor(max_workers=1)
+
+
+def build_index() -> dict:
+    units = {}
+    aliases = {}
+    for phenomenon in Phenomenon.objects.all():
+        units[phenomenon.name] = phenomenon.unit
+        # the canonical name is an alias of itself
+        aliases[(phenomenon.name, "")] = (phenomenon.name, phenomenon.unit)
+
+    for alias in SensorAlias.objects.select_related("phenomenon"):
+        aliases[(alias.title, alias.unit)] = (alias.phenomenon.name, alias.phenomenon.unit)
+
+    return {"aliases": aliases, "units": units}
+
+
+def build_index_in_thread() -> dict:
+    try:
+        return build_index()
+    finally:
+        connection.close()  # the connection of the executor thread, not needed until the next rebuild
+
+
+def set_index(index: dict, version) -> dict:
+    global _index, _index_version
+    _index, _index_version = index, version
+    print(f"Sensor aliases: {len(index['aliases'])} titles, {len(index['units'])} phenomena")
+    return _index
+
+
+def start_rebuild(loop: asyncio.AbstractEventLoop, version) -> None:
+    """rebuild in the executor thread, the event loop keeps running. Until it's done, the old index is used"""
+    global _rebuild
+    if _rebuild is not None and not _rebuild.done():
+        return
+
+    def done(future):
+        try:
+            set_index(future.result(), version)
+        except DatabaseError as e:
+            print(f">>>>>>>> Sensor aliases not loaded: {e!r}")
+
+    _rebuild = loop.run_in_executor(_executor, build_index_in_thread)
+    _rebuild.add_done_callback(done)
+
+
+def get_index() -> dict:
+    global _checked_at
+
+    now = time.monotonic()
+    if _index is not None and now - _checked_at < getattr(settings, "SENSOR_ALIAS_CHECK_INTERVAL", 60):
+        return _index
+
+    version = cache.get(version_key, 0)
+    _checked_at = now
+    if _index is not None and version == _index_version:
+        return _index
+
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        loop = None
+
+    if loop is not None and _index is not None:
+        start_rebuild(loop, version)
+        return _index
+
+    try:
+        if loop is not None:
+            # first use in an event loop without load_sensor_aliases() before: nothing to fall back to, wait
+            index = _executor.submit(build_index_in_thread).result()
+        else:
+            index = build_index()
+    except DatabaseError as e:
+        print(f">>>>>>>> Sensor aliases not loaded: {e!r}")
+        return _index or {"aliases": {}, "units": {}}
+
+    return set_index(index, version)
+
+
+async def load_sensor_aliases() -> None:
+    """async code calls this before normalize_sensor(): the index is built in a thread, the event loop keeps running"""
+    global _checked_at
+
+    version = await cache.aget(version_key, 0)
+    if _index is not None and version == _index_version:
+        return
+
+    try:
+        index = await asyncio.get_running_loop().run_in_executor(_executor, build_index_in_thread)
+    except DatabaseError as e:
+        print(f">>>>>>>> Sensor aliases not loaded: {e!r}")
+        return
+
+    set_index(index, version)
+    _checked_at = time.monotonic()
+
+
+def normalize_sensor(title: str, unit: str) -> tuple[str, str]:
+    """uniform spelling for sensor names: (canonical name, canonical unit), unknown titles are kept as they are"""
+    aliases = get_index()["aliases"]
+    match = aliases.get((title, unit)) or aliases.get((title, ""))
+    if match is None:
+        return title, unit
+
+    name, canonical_unit = match
+    return name, canonical_unit or unit
+
+
+def canonical_unit(name: str) -> str | None:
+    """unit of a canonical name (influx field), None when the phenomenon or its unit is unknown"""
+    return get_index()["units"].get(name) or None
+
+
+def invalidate_sensor_aliases() -> None:
+    global _index
+    _index = None
+    try:
+        cache.incr(version_key)
+    except ValueError:  # not in the cache yet
+        cache.set(version_key, 1, timeout=None)
+
+
+@receiver([post_save, post_delete], sender=SensorAlias)
+@receiver([post_save, post_delete], sender=Phenomenon)
+def sensor_alias_changed(sender, **kwargs):
+    invalidate_sensor_aliases()
@@ -0,0 +1,103 @@
+"""
+Write-ahead spool for InfluxDB.
+
+The InfluxWriter appends every batch to the spool as a gzip compressed line protocol segment (one file per batch,
+written under a temporary name and renamed -> a segment is complete or not there at all). As soon as the segment
+is on disk, the batch counts as written: watermarks and cadence move on, the ingest doesn't wait for influx.
+
+drain() sends the segments to influx, oldest first, and deletes a segment only after influx accepted it.
+It runs in the background of the writer, at the end of every run and on the celery beat schedule (drain_spool),
+so the data of an influx outage is written when influx is back.
+
+The spool is limited to INFLUX_SPOOL_MAX_MB. When it's full, append() refuses the batch and the writer falls back
+to the direct write: if that fails too, the watermarks stay where they are and the next run fetches the data again.
+"""
+
+import fcntl
+import gzip
+import itertools
+import os
+import time
+from typing import Callable
+
+from django.conf import settings
+
+_counter = itertools.count()
+
+
+class SpoolFull(Exception):
+    pass
+
+
+class Spool:
+    def __init__(self, path: str | None = None, max_bytes: int | None = None):
+        self.path = path or settings.INFLUX_SPOOL_DIR
+        self.max_bytes = max_bytes or int(getattr(settings, "INFLUX_SPOOL_MAX_MB", 1024) * 1024 * 1024)
+        os.makedirs(self.path, exist_ok=True)
+
+    def segments(self) -> list[str]:
+        """complete segments, oldest first (the name starts with the time in ns)"""
+        names = sorted(name for name in os.listdir(self.path) if name.endswith(".lp.gz"))
+        return [os.path.join(self.path, name) for name in names]
+
+    def size(self) -> int:
+        total = 0
+        for segment in self.segments():
+            try:
+                total += os.path.getsize(segment)
+            except FileNotFoundError:  # drained by another process in the meantime
+                pass
+        return total
+
+    def append(self, lines: list[str]) -> str:
+        data = gzip.compress("\n".join(lines).encode(), compresslevel=5)
+        if self.size() + len(data) > self.max_bytes:
+            raise SpoolFull(f"Spool {self.path} is full ({self.max_bytes / 1024 / 1024:.0f} MB)")
+
+        name = f"{time.time_ns():020d}-{os.getpid()}-{next(_counter):06d}.lp.gz"
+        segment = os.path.join(self.path, name)
+        tmp_path = f"{segment}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, segment)
+        return segment
+
+    def read(self, segment: str) -> list[str]:
+        with gzip.open(segment, "rt") as f:
+            return f.read().splitlines()
+
+    def drain(self, write: Callable[[list[str]], bool], max_segments: int | None = None) -> tuple[int, int]:
+        """
+        write the segments with write(lines) -> True when influx accepted them. Stops at the first failure,
+        the rest is tried on the next drain. Only one process drains at a time.
+        Returns (segments, lines) written.
+        """
+        with open(os.path.join(self.path, ".drain.lock"), "w") as lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return 0, 0  # another process is draining
+
+            drained = 0
+            points = 0
+            for segment in self.segments()[:max_segments]:
+                try:
+                    lines = self.read(segment)
+                except FileNotFoundError:
+                    continue
+                except (OSError, EOFError) as e:
+                    # can't be written ever, keep it for a look, but out of the way
+                    print(f">>>>>>>> Spool segment {segment} is broken: {e!r}")
+                    os.replace(segment, f"{segment}.broken")
+                    continue
+
+                if lines and not write(lines):
+                    break
+
+                os.remove(segment)  # acknowledged by influx
+                drained += 1
+                points += len(lines)
+
+            return drained, points
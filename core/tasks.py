@@ -1,9 +1,82 @@
-from asgiref.sync import async_to_sync
-from celery import shared_task
+from celery import chord, shared_task
+from django.core.management import call_command
 
-from core.tools import get_latest_boxes_with_distance_as_df
+from core.clients import run_with_clients
+from core.fast_lane import collect_fast_lane
+from core.influx import drain_spool
+from core.ingest import collect
+from core.tools import get_latest_boxes_with_distance_as_df, regenerate_cache, sync_metadata
+from home.models import SenseBoxLocation
 
 
 @shared_task()
 def latest_boxes_as_df(region: str = "all", cache_time=60):
-    return async_to_sync(get_latest_boxes_with_distance_as_df)(region, cache_time)
+    # the clients of the loop are closed when the task is done
+    return run_with_clients(get_latest_boxes_with_distance_as_df(region, cache_time))
+
+
+##########################################################
+# Ingest on the celery beat schedule (CELERY_BEAT_SCHEDULE in settings).
+# The worker processes stay alive: no Django/pandas/plotly startup per run.
+# Every location is a task of its own, a redis lock per location (core/ingest.py: location_lock) makes sure
+# two runs never collect the same location at the same time.
+##########################################################
+
+
+@shared_task()
+def collect_location(location_name: str, time_delta: float | None = None, mode: str | None = None) -> dict:
+    report = run_with_clients(collect(location_name, time_delta=time_delta, mode=mode))
+    print(report)
+    return report.as_dict()
+
+
+@shared_task()
+def ingest_report(results: list[dict]) -> dict:
+    """chord callback: all locations are done"""
+    total = {}
+    for result in results:
+        print(
+            f"{result['location']}: {result['boxes']} boxes, {result['written']} written, {result['empty']} empty, "
+            f"{result['failed']} failed, {result.get('failed_sensors', 0)} sensors failed, "
+            f"{result['skipped']} skipped, {result['points']} points "
+            f"in {result['elapsed']} s" + (" (locked)" if result["locked"] else "")
+        )
+        for key in ["boxes", "written", "empty", "failed", "failed_sensors", "skipped", "locked", "points"]:
+            total[key] = total.get(key, 0) + result.get(key, 0)
+
+    print(f"Ingest of {len(results)} locations: {total}")
+    regenerate_cache()
+    return total
+
+
+@shared_task()
+def collect_all(time_delta: float | None = None, mode: str | None = None):
+    """fan out: one collect_location task per location, ingest_report when all of them are finished"""
+    names = list(SenseBoxLocation.objects.values_list("name", flat=True))
+    if not names:
+        print("No locations found!")
+        return None
+
+    result = chord(collect_location.s(name, time_delta, mode) for name in names)(ingest_report.s())
+    return result.id
+
+
+@shared_task()
+def collect_fast_lane_task(region: str = "all"):
+    report = run_with_clients(collect_fast_lane(region))
+    return report.as_dict() if report else None
+
+
+@shared_task()
+def sync_metadata_task(region: str = "all"):
+    run_with_clients(sync_metadata(region))
+
+
+@shared_task()
+def clear_table_task():
+    call_command("clear_table")
+
+
+@shared_task()
+def drain_spool_task():
+    return run_with_clients(drain_spool())
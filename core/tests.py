@@ -1,4 +1,510 @@
-from django.test import TestCase
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+import types
+from datetime import datetime, timedelta, timezone
+from unittest import mock
 
-# Create your tests here.
+import httpx
+import numpy as np
+import pandas as pd
+from django.test import SimpleTestCase, TestCase, override_settings
 
+from core import clients
+from core.bulk import get_location_data
+from core.clients import run_with_clients
+from core.influx import encode_line_protocol, escape_key, escape_measurement
+from core.management.commands.benchmark_ingest import build_boxes, build_measurements, legacy_parse, stand_in_server
+from core.parse import minute_means, parse_sensor_response
+from core.scheduler import HostState, IngestScheduler
+from core.spool import Spool, SpoolFull
+from home.models import SenseBoxLocation
+
+
+class BulkIngestTests(TestCase):
+    """get_location_data against the stand-in server of benchmark_ingest"""
+
+    minutes = 30
+
+    def setUp(self):
+        self.boxes = build_boxes(3)
+        self.measurements = build_measurements(self.boxes, self.minutes)
+        self.server = stand_in_server(self.boxes, self.measurements, latency=0)
+        self.addCleanup(self.server.shutdown)
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        self.timeframe = (datetime.now(timezone.utc) - timedelta(minutes=self.minutes + 1)).strftime(
+            "%Y-%m-%dT%H:%M:%SZ"
+        )
+
+    def collect(self, watermarks=None):
+        location = SenseBoxLocation(name="test")
+        with override_settings(OPENSENSEMAP_API_URL=self.url):
+            return run_with_clients(
+                get_location_data(location, self.boxes, self.timeframe, IngestScheduler(), watermarks)
+            )
+
+    def test_one_frame_per_box(self):
+        frames = self.collect()
+
+        self.assertEqual([frame.attrs["box_id"] for frame in frames], self.boxes["_id"].tolist())
+        for frame in frames:
+            self.assertFalse(frame.empty)
+            self.assertEqual(len(frame.columns), 5)
+            self.assertEqual(len(frame), self.minutes)
+            self.assertIsNone(frame.index.tz)
+            self.assertEqual(len(frame.attrs["watermarks"]), 5)
+
+    def test_watermark_is_the_start(self):
+        box_id = self.boxes["_id"][0]
+        sensor_id = self.boxes["sensors"][0][0]["_id"]
+        newest = max(t for _, t, _ in self.measurements[sensor_id])
+        watermark = datetime.strptime(newest, "%Y-%m-%dT%H:%M:%S.000Z").replace(tzinfo=timezone.utc)
+
+        frames = self.collect(watermarks={box_id: {sensor_id: watermark}})
+
+        # only the minute of the watermark is aggregated again
+        frame = next(frame for frame in frames if frame.attrs["box_id"] == box_id)
+        self.assertEqual(int(frame.count().sum()), 4 * self.minutes + 1)
+
+    def test_garbage_value_is_dropped(self):
+        sensor_id = self.boxes["sensors"][0][0]["_id"]
+        box_id, created_at, _ = self.measurements[sensor_id][0]
+        self.measurements[sensor_id][0] = (box_id, created_at, "garbage")
+
+        frames = self.collect()
+
+        frame = next(frame for frame in frames if frame.attrs["box_id"] == box_id)
+        self.assertEqual(int(frame.count().sum()), 5 * self.minutes - 1)
+
+
+class DaphneShutdownHookTests(SimpleTestCase):
+    """install_daphne_shutdown_hook with a stand-in for the twisted reactor"""
+
+    def install_hook(self):
+        triggers = []
+        reactor = types.SimpleNamespace(
+            addSystemEventTrigger=lambda phase, event, callback: triggers.append((phase, event, callback))
+        )
+        internet = types.ModuleType("twisted.internet")
+        internet.reactor = reactor
+        defer = types.ModuleType("twisted.internet.defer")
+        defer.Deferred = types.SimpleNamespace(fromFuture=lambda future: future)
+
+        modules = {
+            "twisted": types.ModuleType("twisted"),
+            "twisted.internet": internet,
+            "twisted.internet.reactor": reactor,
+            "twisted.internet.defer": defer,
+        }
+        with mock.patch.dict(sys.modules, modules):
+            clients.install_daphne_shutdown_hook()
+        return triggers
+
+    def test_shutdown_writes_the_push_buffer_and_closes_the_clients(self):
+        triggers = self.install_hook()
+        self.assertEqual([(phase, event) for phase, event, _ in triggers], [("before", "shutdown")])
+
+        calls = []
+
+        async def close_push_buffer():
+            calls.append("push buffer")
+
+        async def close_clients():
+            calls.append("clients")
+
+        async def run_trigger():
+            return await triggers[0][2]()
+
+        with mock.patch("core.push.close_push_buffer", close_push_buffer), mock.patch.object(
+            clients, "close_clients", close_clients
+        ):
+            asyncio.run(run_trigger())
+
+        self.assertEqual(calls, ["push buffer", "clients"])
+
+
+class IngestSchedulerTests(SimpleTestCase):
+    """IngestScheduler against a mocked transport (clients.transport_factory), no network"""
+
+    url = "https://api.example.org/boxes/1/data/2"
+
+    def serve(self, handler):
+        """every client of the following runs answers with handler(request)"""
+        clients.transport_factory = lambda host, client_kwargs: httpx.MockTransport(handler)
+        self.addCleanup(setattr, clients, "transport_factory", None)
+
+    def record_sleeps(self):
+        """asyncio.sleep returns at once, the delays are collected"""
+        delays = []
+        real_sleep = asyncio.sleep
+
+        async def sleep(delay, *args, **kwargs):
+            delays.append(delay)
+            await real_sleep(0)
+
+        patcher = mock.patch("core.scheduler.asyncio.sleep", sleep)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        return delays
+
+    def test_rate_cap(self):
+        self.serve(lambda request: httpx.Response(200, json=[]))
+        scheduler = IngestScheduler(max_concurrency=10, rate=20.0, burst=1, max_retries=0)
+
+        async def run():
+            return await asyncio.gather(*[scheduler.get(self.url) for _ in range(11)])
+
+        started = time.monotonic()
+        responses = run_with_clients(run())
+
+        # one token at once, then 20 per second: 10 requests wait for 0.5 s
+        self.assertGreaterEqual(time.monotonic() - started, 0.45)
+        self.assertEqual([response.status_code for response in responses], [200] * 11)
+        self.assertEqual(scheduler.completed, 11)
+
+    def test_concurrency_cap(self):
+        in_flight = 0
+        most = 0
+
+        async def handler(request):
+            nonlocal in_flight, most
+            in_flight += 1
+            most = max(most, in_flight)
+            await asyncio.sleep(0.02)
+            in_flight -= 1
+            return httpx.Response(200, json=[])
+
+        self.serve(handler)
+        scheduler = IngestScheduler(max_concurrency=2, rate=1000.0, burst=100, max_retries=0)
+
+        async def run():
+            await asyncio.gather(*[scheduler.get(self.url) for _ in range(10)])
+
+        run_with_clients(run())
+        self.assertEqual(most, 2)
+
+    def test_backoff_on_5xx(self):
+        statuses = iter([503, 500, 200])
+        self.serve(lambda request: httpx.Response(next(statuses), json=[]))
+        delays = self.record_sleeps()
+        scheduler = IngestScheduler(max_concurrency=1, rate=1000.0, burst=100, max_retries=3)
+
+        response = run_with_clients(scheduler.get(self.url))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(scheduler.retried, 2)
+        self.assertEqual(scheduler.failed, 0)
+        self.assertEqual(delays, [0.5, 1.0])  # exponential backoff
+
+    def test_retry_after_pauses_the_host(self):
+        statuses = iter([429, 200])
+        self.serve(
+            lambda request: httpx.Response(next(statuses), headers={"Retry-After": "0.3"}, json=[])
+        )
+        scheduler = IngestScheduler(max_concurrency=1, rate=1000.0, burst=100, max_retries=3)
+
+        started = time.monotonic()
+        response = run_with_clients(scheduler.get(self.url))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(scheduler.throttled, 1)
+        self.assertGreaterEqual(time.monotonic() - started, 0.25)
+
+    def test_retries_run_out(self):
+        self.serve(lambda request: httpx.Response(500, json={"error": "down"}))
+        self.record_sleeps()
+        scheduler = IngestScheduler(max_concurrency=1, rate=1000.0, burst=100, max_retries=2)
+
+        response = run_with_clients(scheduler.get(self.url))
+
+        # the last answer is returned, the caller decides (raise_for_status)
+        self.assertEqual(response.status_code, 500)
+        self.assertEqual(scheduler.retried, 2)
+        self.assertEqual(scheduler.failed, 1)
+        self.assertEqual(scheduler.completed, 0)
+
+    def test_request_errors_run_out(self):
+        def handler(request):
+            raise httpx.ConnectError("refused", request=request)
+
+        self.serve(handler)
+        self.record_sleeps()
+        scheduler = IngestScheduler(max_concurrency=1, rate=1000.0, burst=100, max_retries=2)
+
+        with self.assertRaises(httpx.ConnectError):
+            run_with_clients(scheduler.get(self.url))
+        self.assertEqual(scheduler.failed, 1)
+        self.assertEqual(scheduler.retried, 2)
+
+    def test_timeout_does_not_count_the_wait_for_a_slot(self):
+        async def handler(request):
+            await asyncio.sleep(0.05)
+            return httpx.Response(200, json=[])
+
+        self.serve(handler)
+        scheduler = IngestScheduler(max_concurrency=10, rate=20.0, burst=1, max_retries=0)
+
+        async def run():
+            return await asyncio.gather(*[scheduler.get(self.url, timeout=0.2) for _ in range(10)])
+
+        # the last request waits about 0.45 s for its token, longer than the timeout
+        responses = run_with_clients(run())
+        self.assertEqual([response.status_code for response in responses], [200] * 10)
+
+    def test_aimd(self):
+        state = HostState("api.example.org", rate=10.0, burst=1, error_threshold=0.2)
+
+        for _ in range(10):
+            state.record(False)
+        # multiplicative decrease, once per second
+        self.assertEqual(state.bucket.rate, 5.0)
+
+        state.record(True)
+        # additive increase: 1 % of the maximum per success
+        self.assertAlmostEqual(state.bucket.rate, 5.1)
+
+        for _ in range(1000):
+            state.record(True)
+        self.assertEqual(state.bucket.rate, 10.0)
+
+    def test_rate_per_host(self):
+        self.serve(lambda request: httpx.Response(200, json=[]))
+        scheduler = IngestScheduler(max_concurrency=10, rate=5.0, burst=5, max_retries=0)
+
+        async def run():
+            await scheduler.get("https://api.example.org/a")
+            await scheduler.get("https://tiles.example.org/b")
+
+        run_with_clients(run())
+        self.assertEqual(set(scheduler.stats()["rates"]), {"api.example.org", "tiles.example.org"})
+
+
+class LineProtocolTests(SimpleTestCase):
+    """encode_line_protocol: all fields are floats, timestamps in ns"""
+
+    def frame(self, data, start="2024-05-01 12:00", tz=None):
+        index = pd.date_range(start, periods=len(next(iter(data.values()))), freq="min", tz=tz)
+        return pd.DataFrame(data, index=index)
+
+    def test_one_line_per_row(self):
+        df = self.frame({"Temperatur": [21.5, 22.0], "PM10": [3, 4]})
+
+        lines = encode_line_protocol("box", df)
+
+        self.assertEqual(
+            lines,
+            [
+                "box Temperatur=21.5,PM10=3.0 1714564800000000000",
+                "box Temperatur=22.0,PM10=4.0 1714564860000000000",
+            ],
+        )
+
+    def test_escaping(self):
+        df = self.frame({"rel. Luftfeuchte, innen": [50.0], "a=b": [1.0], "back\\slash": [2.0]})
+
+        lines = encode_line_protocol("Box 1,Berlin=Mitte", df)
+
+        self.assertEqual(
+            lines,
+            [
+                "Box\\ 1\\,Berlin=Mitte rel.\\ Luftfeuchte\\,\\ innen=50.0,a\\=b=1.0,back\\\\slash=2.0 "
+                "1714564800000000000"
+            ],
+        )
+
+    def test_escape_helpers(self):
+        # "=" needs no escape in a measurement, but in tag and field keys
+        self.assertEqual(escape_measurement("a b,c=d"), "a\\ b\\,c=d")
+        self.assertEqual(escape_key("a b,c=d"), "a\\ b\\,c\\=d")
+
+    def test_ints_and_numeric_strings_become_floats(self):
+        df = self.frame({"count": np.array([1, 2], dtype="int64"), "level": ["3", "4.5"]})
+
+        lines = encode_line_protocol("box", df)
+
+        self.assertEqual([line.split(" ")[1] for line in lines], ["count=1.0,level=3.0", "count=2.0,level=4.5"])
+
+    def test_missing_values_are_left_out(self):
+        df = self.frame({"a": [1.0, np.nan, np.nan], "b": [np.inf, 2.0, np.nan]})
+
+        lines = encode_line_protocol("box", df)
+
+        # inf is treated like NaN, the row without any value is dropped
+        self.assertEqual(lines, ["box a=1.0 1714564800000000000", "box b=2.0 1714564860000000000"])
+
+    def test_nothing_to_write(self):
+        self.assertEqual(encode_line_protocol("box", pd.DataFrame()), [])
+        self.assertEqual(encode_line_protocol("box", self.frame({"a": [np.nan, np.nan]})), [])
+
+    def test_timestamps_in_ns_utc(self):
+        df = self.frame({"a": [1.0]}, start="2024-05-01 14:00:00.123456789", tz="Europe/Berlin")
+
+        lines = encode_line_protocol("box", df)
+
+        # 14:00 in Berlin (CEST) is 12:00 UTC, the nanoseconds are kept
+        self.assertEqual(lines, ["box a=1.0 1714564800123456789"])
+
+
+class SensorResponseParseTests(SimpleTestCase):
+    """parse_sensor_response + minute_means against the pandas path they replaced (legacy_parse)"""
+
+    def body(self, measurements):
+        return json.dumps([{"value": value, "createdAt": created_at} for value, created_at in measurements]).encode()
+
+    def assertSameAsLegacy(self, content):
+        fast = minute_means(*parse_sensor_response(content))
+        legacy = legacy_parse(content)
+        self.assertEqual(fast.index.tolist(), legacy.index.tolist())
+        np.testing.assert_allclose(fast.to_numpy(), legacy.to_numpy())
+
+    def test_same_as_legacy(self):
+        content = self.body(
+            [
+                ("21.5", "2024-05-01T12:01:30.000Z"),
+                ("20.5", "2024-05-01T12:00:59.999Z"),
+                ("22", "2024-05-01T12:01:00.000Z"),
+                ("-3.25", "2024-02-29T23:59:00.000Z"),
+                ("1e3", "2024-12-31T00:00:00.001Z"),
+            ]
+        )
+
+        self.assertSameAsLegacy(content)
+
+    def test_numbers_and_numeric_strings(self):
+        content = self.body([("21.5", "2024-05-01T12:00:00.000Z"), (3, "2024-05-01T12:00:10.000Z")])
+
+        self.assertSameAsLegacy(content)
+        self.assertEqual(minute_means(*parse_sensor_response(content)).tolist(), [12.25])
+
+    def test_other_timestamp_format(self):
+        # not the fixed positions of "...00.000Z": parsed by pandas
+        content = self.body([("1", "2024-05-01T12:00:00.5Z"), ("2", "2024-05-01T12:01:00.25Z")])
+
+        timestamps, _ = parse_sensor_response(content)
+
+        self.assertSameAsLegacy(content)
+        self.assertEqual(timestamps.tolist(), [1714564800500000000, 1714564860250000000])
+
+    def test_garbage_value_is_nan(self):
+        content = self.body(
+            [
+                ("21.5", "2024-05-01T12:00:00.000Z"),
+                ("abc", "2024-05-01T12:00:10.000Z"),
+                (None, "2024-05-01T12:01:00.000Z"),
+            ]
+        )
+
+        timestamps, values = parse_sensor_response(content)
+
+        # the legacy path raised on the first value, that isn't a number
+        self.assertEqual(len(timestamps), 3)
+        self.assertEqual(values[0], 21.5)
+        self.assertTrue(np.isnan(values[1:]).all())
+        self.assertEqual(minute_means(timestamps, values).tolist(), [21.5])
+
+    def test_empty(self):
+        # the legacy path raised for all of them (no createdAt column, no list)
+        for content in (b"[]", b"{}", b'{"error": "not found"}', b"null"):
+            with self.subTest(content=content):
+                timestamps, values = parse_sensor_response(content)
+                self.assertEqual((timestamps.dtype, values.dtype), (np.int64, np.float64))
+                self.assertEqual((len(timestamps), len(values)), (0, 0))
+                self.assertTrue(minute_means(timestamps, values).empty)
+
+    def test_incomplete_measurements_are_skipped(self):
+        content = json.dumps(
+            [{"value": "1", "createdAt": "2024-05-01T12:00:00.000Z"}, {"value": "2"}, {"createdAt": "x"}, "garbage"]
+        ).encode()
+
+        timestamps, values = parse_sensor_response(content)
+
+        self.assertEqual(timestamps.tolist(), [1714564800000000000])
+        self.assertEqual(values.tolist(), [1.0])
+
+    def test_malformed_json(self):
+        with self.assertRaises(ValueError):
+            parse_sensor_response(b'[{"value": "1", "createdAt": ')
+
+
+class SpoolTests(SimpleTestCase):
+    """the write-ahead spool in a temporary directory, write() stands in for influx"""
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = directory.name
+        self.spool = Spool(self.path, max_bytes=1024 * 1024)
+        self.written = []
+
+    def write(self, lines):
+        self.written.append(lines)
+        return True
+
+    def files(self):
+        return sorted(name for name in os.listdir(self.path) if not name.startswith("."))
+
+    def test_drain_writes_the_points_in_order(self):
+        self.spool.append(["box a=1.0 1", "box a=2.0 2"])
+        self.spool.append(["box a=3.0 3"])
+
+        self.assertEqual(self.spool.drain(self.write), (2, 3))
+
+        self.assertEqual(self.written, [["box a=1.0 1", "box a=2.0 2"], ["box a=3.0 3"]])
+        self.assertEqual(self.files(), [])
+
+    def test_max_segments(self):
+        for i in range(3):
+            self.spool.append([f"box a={i}.0 {i}"])
+
+        self.assertEqual(self.spool.drain(self.write, max_segments=2), (2, 2))
+        self.assertEqual(len(self.spool.segments()), 1)
+
+    def test_failed_write_keeps_the_segments(self):
+        self.spool.append(["box a=1.0 1"])
+        self.spool.append(["box a=2.0 2"])
+
+        # stops at the first failure, nothing is deleted
+        self.assertEqual(self.spool.drain(lambda lines: False), (0, 0))
+        self.assertEqual(len(self.spool.segments()), 2)
+
+        def crash(lines):
+            raise ConnectionError("influx is gone")
+
+        with self.assertRaises(ConnectionError):
+            self.spool.drain(crash)
+        self.assertEqual(len(self.spool.segments()), 2)
+
+        self.assertEqual(self.spool.drain(self.write), (2, 2))
+
+    def test_partial_segment_after_a_crash_is_kept(self):
+        segment = self.spool.append(["box a=1.0 1"])
+        # a crash during append() leaves the temporary file, never a half written segment
+        partial = os.path.join(self.path, "00000000000000000000-1-000000.lp.gz.tmp")
+        with open(partial, "wb") as f:
+            f.write(b"\x1f\x8b")
+
+        self.assertEqual(self.spool.segments(), [segment])
+        self.assertEqual(self.spool.drain(self.write), (1, 1))
+        self.assertEqual(self.files(), [os.path.basename(partial)])
+
+    def test_broken_segment_is_moved_out_of_the_way(self):
+        broken = os.path.join(self.path, "00000000000000000000-1-000000.lp.gz")
+        with open(broken, "wb") as f:
+            f.write(b"not gzip")
+        self.spool.append(["box a=1.0 1"])
+
+        self.assertEqual(self.spool.drain(self.write), (1, 1))
+
+        self.assertEqual(self.written, [["box a=1.0 1"]])
+        self.assertEqual(self.files(), [os.path.basename(broken) + ".broken"])
+
+    def test_full(self):
+        spool = Spool(self.path, max_bytes=100)
+        spool.append(["box a=1.0 1"])
+
+        with self.assertRaises(SpoolFull):
+            spool.append([f"box a={i}.0 {i}" for i in range(1000)])
+        self.assertEqual(len(spool.segments()), 1)
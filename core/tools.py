@@ -11,17 +11,23 @@ import pandas as pd
 import plotly
 import plotly.graph_objects as go
 import requests
-from asgiref.sync import sync_to_async, async_to_sync
+from asgiref.sync import sync_to_async
 from celery import shared_task
 from django.conf import settings
 from django.core.cache import cache
-from django.core.exceptions import MultipleObjectsReturned
-from influxdb_client.client.write_api import SYNCHRONOUS
+from django.db import transaction
+from influxdb_client.client.write_api import SYNCHRONOUS, WritePrecision
 from requests.adapters import HTTPAdapter
 from tenacity import retry, stop_after_attempt, wait_fixed, retry_if_exception_type
 from urllib3.util import Retry
 
-from home.models import SenseBoxTable, SenseBoxLocation, GroupTag, SensorsInfoTable
+from core import archive as ingest_archive
+from core.clients import get_client, run_with_clients
+from core.influx import encode_line_protocol
+from core.parse import minute_means, parse_sensor_response
+from core.scheduler import IngestScheduler
+from core.sensor_names import normalize_sensor
+from home.models import SenseBoxTable, SenseBoxLocation, GroupTag, SensorsInfoTable, SensorWatermark, Phenomenon
 
 # from multiprocessing.pool import ThreadPool
 
@@ -43,31 +49,34 @@ mapbox_token = settings.MAPBOX_TOKEN
 
 @shared_task()
 def get_url_task(url: str, headers=None):
-    return async_to_sync(get_url_async)(url, headers)
+    # a loop of its own per call: its clients are closed before the loop ends (the body is read already)
+    return run_with_clients(get_url_async(url, headers))
 
 
 async def get_url_async(url: str, headers=None) -> httpx.Response | None:
     if headers is None:
         headers = {"Accept": "application/json"}
 
-    async with httpx.AsyncClient() as client:
-        try:
-            # print(f"try to get {url}")
-            response = await client.get(url, headers=headers, timeout=10)
-            # response.raise_for_status()  # Raises an HTTPStatusError if the response status code is 4xx, 5xx
-            return response
-        except httpx.HTTPStatusError as exc:
-            print(f">>>>>>>> HTTP error for {url}: {exc.response.status_code}")
-            raise
-        except httpx.RequestError as exc:
-            print(f">>>>>>>> Request error for {url}: {exc}")
-            raise
-        except httpx.ReadTimeout as exc:
-            print(f">>>>>>>> Request error for {url}: {exc}")
-            return httpx.Response(status_code=500, content=b"")
-        except httpx.ConnectTimeout as exc:
-            print(f">>>>>>>> Request error for {url}: {exc}")
-            return None # httpx.Response(status_code=500, content=b"")
+    # shared client with keep-alive pool for this host, see core/clients.py
+    client = get_client(url)
+
+    try:
+        # print(f"try to get {url}")
+        response = await client.get(url, headers=headers)
+        # response.raise_for_status()  # Raises an HTTPStatusError if the response status code is 4xx, 5xx
+        return response
+    except httpx.HTTPStatusError as exc:
+        print(f">>>>>>>> HTTP error for {url}: {exc.response.status_code}")
+        raise
+    except httpx.RequestError as exc:
+        print(f">>>>>>>> Request error for {url}: {exc}")
+        raise
+    except httpx.ReadTimeout as exc:
+        print(f">>>>>>>> Request error for {url}: {exc}")
+        return httpx.Response(status_code=500, content=b"")
+    except httpx.ConnectTimeout as exc:
+        print(f">>>>>>>> Request error for {url}: {exc}")
+        return None # httpx.Response(status_code=500, content=b"")
 
 
 retry = Retry(
@@ -132,7 +141,7 @@ def get_boxes_with_tag(tagname: str) -> pd.DataFrame:
 
 
 def get_box_with_sensor_id(box_id: str, sensor_id: str) -> dict:
-    url = f"https://api.opensensemap.org/boxes/{box_id}/sensors/{sensor_id}"
+    url = f"{settings.OPENSENSEMAP_API_URL}/boxes/{box_id}/sensors/{sensor_id}"
     r = get_url(url)
 
     r_json = r.json()
@@ -153,7 +162,7 @@ async def get_sensor_data(df: pd.DataFrame, sensor_id: str) -> dict | None:
 
     # get box with all sensors
 
-    url = f"https://api.opensensemap.org/boxes/{box_id}"
+    url = f"{settings.OPENSENSEMAP_API_URL}/boxes/{box_id}"
     box = await get_url_async(url)
     box = box.json()
 
@@ -172,7 +181,7 @@ async def get_boxes_with_distance(params: dict) -> dict:
     # example: box_json = get_boxes_with_distance({'near': '13.3992,52.516221', 'maxDistance': '10000', 'exposure': 'outdoor', })
     encoded_params = urllib.parse.urlencode(params)
 
-    url = "https://api.opensensemap.org/boxes" + "?" + encoded_params
+    url = f"{settings.OPENSENSEMAP_API_URL}/boxes" + "?" + encoded_params
 
     r = await get_url_async(url)
 
@@ -184,6 +193,37 @@ async def get_boxes_with_distance(params: dict) -> dict:
     return r_json
 
 
+def get_locations(region: str = "all"):
+    if region == "all":
+        return SenseBoxLocation.objects.all()
+    return SenseBoxLocation.objects.filter(name=region)
+
+
+async def get_location_catalog(location: SenseBoxLocation, minimal: bool = False) -> pd.DataFrame:
+    """all boxes around a SenseBoxLocation. minimal=True: only a few fields per box, much smaller response"""
+    print(f"get location: {location.name}")
+    # near order: lon, lat
+
+    lon = location.location_longitude
+    lat = location.location_latitude
+    distance = location.maxDistance
+    exposure = location.exposure
+
+    params = {
+        "near": f"{lon}, {lat}",
+        "maxDistance": f"{distance}",
+        "exposure": exposure,
+    }
+    if minimal:
+        params["minimal"] = "true"
+    # print(params)
+
+    box_json = await get_boxes_with_distance(params)
+    df = pd.DataFrame(box_json)
+    df["location"] = location.name
+    return df
+
+
 async def get_latest_boxes_with_distance_as_df(region: str = "all", cache_time=60) -> pd.DataFrame:
 
     cache_key = f"latest_boxes_{region}"
@@ -196,36 +236,10 @@ async def get_latest_boxes_with_distance_as_df(region: str = "all", cache_time=6
     else:
         print(f"cache miss for {cache_key}")
 
-        async def create_df(_frames, _location):
-            print(f"get location: {location.name}")
-            # near order: lon, lat
-
-            lon = _location.location_longitude
-            lat = _location.location_latitude
-            distance = _location.maxDistance
-            exposure = _location.exposure
-
-            params = {
-                "near": f"{lon}, {lat}",
-                "maxDistance": f"{distance}",
-                "exposure": exposure,
-            }
-            # print(params)
-
-            box_json = await get_boxes_with_distance(params)
-            temp_df = pd.DataFrame(box_json)
-
-            _frames.append(temp_df)
-            return _frames
-
         frames = []
 
-        if region == "all":
-            async for location in SenseBoxLocation.objects.all():
-                frames = await create_df(frames, location)
-        else:
-            async for location in SenseBoxLocation.objects.filter(name=region):
-                frames = await create_df(frames, location)
+        async for location in get_locations(region):
+            frames.append(await get_location_catalog(location))
 
         if len(frames) == 0:
             print("No locations found! - Frame len is 0")
@@ -258,12 +272,147 @@ async def get_latest_boxes_with_distance_as_df(region: str = "all", cache_time=6
     return df
 
 
+##########################################################
+# Box snapshot: the metadata of all boxes changes maybe once a week.
+# sync_metadata (management command) reads the full catalog, writes it to postgres and keeps a compact copy
+# in the cache. collect_data reads only this snapshot and does not touch postgres.
+##########################################################
+
+
+box_snapshot_columns = ["_id", "name", "currentLocation", "grouptag", "sensors", "location"]
+
+
+def box_snapshot_key(location_name: str) -> str:
+    return f"box_snapshot_{location_name}"
+
+
+def build_box_snapshot(df: pd.DataFrame) -> pd.DataFrame:
+    """only the fields needed for the ingest, sensors with id, title and unit"""
+    snapshot = df.reset_index(drop=True)
+    snapshot = snapshot[[c for c in box_snapshot_columns if c in snapshot]]
+    snapshot = snapshot.drop_duplicates(subset="_id").copy()
+
+    snapshot["currentLocation"] = snapshot["currentLocation"].map(lambda loc: {"coordinates": loc["coordinates"]})
+    snapshot["sensors"] = snapshot["sensors"].map(
+        lambda sensors: [{"_id": p["_id"], "title": p["title"], "unit": p["unit"]} for p in sensors]
+    )
+    return snapshot
+
+
+async def sync_location_metadata(location: SenseBoxLocation) -> pd.DataFrame:
+    """full catalog of a location -> postgres and box snapshot"""
+    catalog = await get_location_catalog(location)
+
+    if "_id" not in catalog.columns or catalog.empty:
+        print(f"No boxes found for {location.name}, snapshot not changed")
+        return pd.DataFrame()
+
+    await sync_to_async(sync_box_metadata)(catalog)
+
+    snapshot = build_box_snapshot(catalog)
+    await cache.aset(box_snapshot_key(location.name), snapshot, timeout=None)
+    print(f"Snapshot for {location.name}: {len(snapshot)} boxes")
+    return snapshot
+
+
+async def sync_metadata(region: str = "all") -> None:
+    async for location in get_locations(region):
+        await sync_location_metadata(location)
+
+
+async def get_box_snapshots(region: str = "all") -> pd.DataFrame:
+    """
+    all boxes of the box snapshots, without a request to the api and without the lastMeasurementAt filter
+    (backfill: boxes silent today still have their history)
+    """
+    frames = []
+    async for location in get_locations(region):
+        snapshot = await cache.aget(box_snapshot_key(location.name))
+        if snapshot is None or snapshot.empty:
+            print(f"No box snapshot for {location.name}, run sync_metadata first")
+            continue
+        frames.append(snapshot)
+
+    if len(frames) == 0:
+        return pd.DataFrame()
+    return pd.concat(frames, ignore_index=True).drop_duplicates(subset="_id")
+
+
+async def get_boxes_for_ingest(region: str = "all") -> pd.DataFrame:
+    """
+    boxes to collect, same layout as get_latest_boxes_with_distance_as_df(), but from the box snapshot.
+    lastMeasurementAt is taken from a minimal catalog request, it's needed to skip unchanged boxes.
+    collect_data --archive: the snapshot is archived with the run, --replay: the boxes come from the archive
+    """
+    frames = []
+    archive = ingest_archive.current
+
+    async for location in get_locations(region):
+        if archive is not None and archive.replay:
+            # the boxes of the recorded runs, not the live ones: no catalog request, no sync to postgres
+            snapshot = pd.DataFrame(await asyncio.to_thread(archive.load_snapshot, location.name))
+            if snapshot.empty:
+                print(f"No box snapshot for {location.name} in the archive")
+                continue
+            frames.append(snapshot.assign(lastMeasurementAt=None))
+            continue
+
+        snapshot = await cache.aget(box_snapshot_key(location.name))
+        if snapshot is None:
+            print(f"No box snapshot for {location.name}, sync metadata now")
+            snapshot = await sync_location_metadata(location)
+
+        if snapshot.empty:
+            continue
+
+        if archive is not None:
+            await asyncio.to_thread(archive.store_snapshot, location.name, snapshot.to_dict(orient="records"))
+
+        minimal = await get_location_catalog(location, minimal=True)
+        if "lastMeasurementAt" in minimal.columns:
+            last_measurements = minimal[["_id", "lastMeasurementAt"]].drop_duplicates(subset="_id")
+            snapshot = snapshot.merge(last_measurements, on="_id", how="left")
+        else:
+            print(f"No lastMeasurementAt in minimal catalog for {location.name}, all boxes are collected")
+            snapshot = snapshot.assign(lastMeasurementAt=None)
+
+        frames.append(snapshot)
+
+    if len(frames) == 0:
+        print("No locations found! - Frame len is 0")
+        return pd.DataFrame()
+
+    df = pd.concat(frames, ignore_index=True)
+
+    # remove seconds -> data becomes comparable
+    df["lastMeasurementAt"] = pd.to_datetime(
+        df["lastMeasurementAt"], format="%Y-%m-%dT%H:%M:%S.%fZ", errors="coerce"
+    ).dt.floor("Min")
+
+    # keep only boxes with values from the most recent date (boxes without lastMeasurementAt are kept)
+    most_recent_date = df["lastMeasurementAt"].max()
+    if pd.notna(most_recent_date):
+        df = df[df["lastMeasurementAt"].isna() | (df["lastMeasurementAt"].dt.date >= most_recent_date.date())]
+
+    return df.set_index("lastMeasurementAt")
+
+
+influx_write_api = None
+
+
 def write_to_influx(sensebox_id: str, df: pd.DataFrame) -> bool:
-    df.dropna(how="any", inplace=True)
+    # single synchronous write, the ingest uses the batched InfluxWriter (core/influx.py)
+    global influx_write_api
+
+    if influx_write_api is None:  # one client per process
+        write_client = influxdb_client.InfluxDBClient(
+            url=influx_url, token=influx_token, org=influx_org, enable_gzip=settings.INFLUX_GZIP
+        )
+        influx_write_api = write_client.write_api(write_options=SYNCHRONOUS)
 
-    write_client = influxdb_client.InfluxDBClient(url=influx_url, token=influx_token, org=influx_org)
-    write_api = write_client.write_api(write_options=SYNCHRONOUS)
-    write_api.write(influx_bucket, record=df, data_frame_measurement_name=sensebox_id)
+    lines = encode_line_protocol(sensebox_id, df)
+    if lines:
+        influx_write_api.write(influx_bucket, record="\n".join(lines), write_precision=WritePrecision.NS)
     return True
 
 
@@ -296,6 +445,203 @@ async def get_timeframe(time_delta: float = 0.0) -> str:
     return delta
 
 
+def sync_box_metadata(df: pd.DataFrame) -> None:
+    """
+    write SenseBoxTable, GroupTag and SensorsInfoTable for all boxes of the catalog (df from
+    get_latest_boxes_with_distance_as_df) with a few bulk queries, instead of several queries per box and sensor
+    """
+    if df.empty:
+        return
+
+    # everything in the catalog is marked as seen, clear_table removes rows not seen for some days
+    now = datetime.now(timezone.utc)
+
+    boxes = {}
+    box_tags = {}
+    sensor_infos = set()
+
+    for index, box in df.iterrows():
+        coordinates = box["currentLocation"]["coordinates"]
+        boxes[box["_id"]] = SenseBoxTable(
+            sensebox_id=box["_id"],
+            name=box["name"],
+            location_latitude=coordinates[1],
+            location_longitude=coordinates[0],
+            last_seen=now,
+        )
+
+        grouptags = box["grouptag"]
+        if isinstance(grouptags, list):
+            box_tags[box["_id"]] = {item for item in grouptags if item.strip() != ""}
+
+        for p in box["sensors"]:
+            sensor_infos.add(normalize_sensor(p["title"], p["unit"]))
+
+    all_tags = set().union(*box_tags.values()) if box_tags else set()
+
+    with transaction.atomic():
+        SenseBoxTable.objects.bulk_create(
+            boxes.values(),
+            update_conflicts=True,
+            unique_fields=["sensebox_id"],
+            update_fields=["name", "location_latitude", "location_longitude", "last_seen"],
+        )
+        # featured is not touched, it's set in the admin
+        GroupTag.objects.bulk_create(
+            [GroupTag(tag=tag, last_seen=now) for tag in all_tags],
+            update_conflicts=True,
+            unique_fields=["tag"],
+            update_fields=["last_seen"],
+        )
+        SensorsInfoTable.objects.bulk_create(
+            [SensorsInfoTable(name=name, unit=unit, last_seen=now) for name, unit in sensor_infos],
+            update_conflicts=True,
+            unique_fields=["name", "unit"],
+            update_fields=["last_seen"],
+        )
+
+        # bulk_create with conflicts does not return the primary keys -> read them
+        box_pks = dict(SenseBoxTable.objects.filter(sensebox_id__in=boxes.keys()).values_list("sensebox_id", "pk"))
+        tag_pks = dict(GroupTag.objects.filter(tag__in=all_tags).values_list("tag", "pk"))
+
+        # replace the grouptags of these boxes
+        Through = SenseBoxTable.grouptags.through
+        Through.objects.filter(senseboxtable_id__in=box_pks.values()).delete()
+        Through.objects.bulk_create(
+            [
+                Through(senseboxtable_id=box_pks[box_id], grouptag_id=tag_pks[tag])
+                for box_id, tags in box_tags.items()
+                for tag in tags
+            ],
+            ignore_conflicts=True,
+        )
+
+    print(f"Metadata synced: {len(boxes)} boxes, {len(all_tags)} grouptags, {len(sensor_infos)} sensor types")
+
+
+async def load_watermarks(box_ids: list[str] | None = None) -> dict[str, dict[str, datetime]]:
+    """{box_id: {sensor_id: last_measurement_at}} for all sensors that were written to influx before"""
+    entries = SensorWatermark.objects.all()
+    if box_ids is not None:
+        entries = entries.filter(sensebox_id__in=box_ids)
+
+    watermarks = {}
+    async for entry in entries:
+        watermarks.setdefault(entry.sensebox_id, {})[entry.sensor_id] = entry.last_measurement_at
+    return watermarks
+
+
+def save_watermarks(sensebox_id: str, watermarks: dict[str, datetime]) -> None:
+    """advance the watermarks of a box, call this only after the data was written successfully"""
+    if not watermarks:
+        return
+
+    SensorWatermark.objects.bulk_create(
+        [
+            SensorWatermark(sensebox_id=sensebox_id, sensor_id=sensor_id, last_measurement_at=last_measurement_at)
+            for sensor_id, last_measurement_at in watermarks.items()
+        ],
+        update_conflicts=True,
+        unique_fields=["sensebox_id", "sensor_id"],
+        update_fields=["last_measurement_at"],
+    )
+
+
+def filter_unchanged_boxes(df: pd.DataFrame, watermarks: dict[str, dict[str, datetime]]) -> tuple[pd.DataFrame, int]:
+    """
+    remove all boxes, that did not measure anything since the last ingest
+    df comes from get_latest_boxes_with_distance_as_df() -> index is "lastMeasurementAt" (UTC, floored to minutes)
+    returns the remaining boxes and the number of skipped boxes
+    """
+    if df.empty or not watermarks:
+        return df, 0
+
+    # newest written value of each box, any sensor
+    last_ingested = pd.to_datetime(
+        df["_id"].map(lambda box_id: max(watermarks[box_id].values()) if watermarks.get(box_id) else None),
+        utc=True,
+    )
+    last_ingested = last_ingested.dt.tz_localize(None).dt.floor("Min")
+
+    # compare as arrays: many boxes share the same minute, the index is not unique
+    unchanged = last_ingested.notna().to_numpy() & (df.index.to_numpy() <= last_ingested.to_numpy())
+
+    return df[~unchanged], int(unchanged.sum())
+
+
+async def load_phenomenon_allowlists() -> dict[str, set[str] | None]:
+    """
+    {location name: allowed phenomena} -> the phenomena of the location, or all enabled phenomena.
+    None: no allowlist at all, every sensor is collected
+    """
+    enabled = {name async for name in Phenomenon.objects.filter(enabled=True).values_list("name", flat=True)}
+
+    allowlists = {}
+    async for location in SenseBoxLocation.objects.prefetch_related("phenomena"):
+        own = {phenomenon.name for phenomenon in location.phenomena.all()}
+        allowlists[location.name] = own or enabled or None
+    return allowlists
+
+
+def filter_sensors(df: pd.DataFrame, allowlists: dict[str, set[str] | None]) -> tuple[pd.DataFrame, int]:
+    """
+    remove the sensors, that are not shown on the site, before any request is made. Returns the number removed.
+    Boxes without sensors left are removed as well: nothing to ask for, an empty answer is no sign of a silent box
+    """
+    if df.empty:
+        return df, 0
+
+    skipped = 0
+
+    def allowed_sensors(box):
+        nonlocal skipped
+        allowed = allowlists.get(box.get("location"))
+        if allowed is None:
+            return box["sensors"]
+        sensors = [p for p in box["sensors"] if normalize_sensor(p["title"], p["unit"])[0] in allowed]
+        skipped += len(box["sensors"]) - len(sensors)
+        return sensors
+
+    df = df.copy()
+    df["sensors"] = [allowed_sensors(box) for index, box in df.iterrows()]
+    return df[df["sensors"].map(len) > 0], skipped
+
+
+def watermark_to_timeframe(watermark: datetime) -> str:
+    # start at the beginning of the minute of the last value: this minute is aggregated again with all its values
+    return watermark.astimezone(timezone.utc).replace(second=0, microsecond=0).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+def regenerate_cache() -> None:
+    """request the expensive pages once after an ingest run, so the next visitor gets them from the cache"""
+    if settings.DEBUG:
+        print("Debug mode on: no regeneration of cache")
+        return
+
+    domain = settings.WAGTAILADMIN_BASE_URL + "/"
+
+    print("regenerate cache ...")
+    cache_list = [
+        "hexmap?ressource_path=Temperatur",
+        "hexmap?ressource_path=PM10&colorscale=GnBu",
+    ]
+
+    # erfrischungskarte
+    for i in range(9, 22):
+        cache_list.append(f"erfrischungskarte/{i}Uhr/")
+
+    # add single page urls to cache_list
+    single_page_list = ["s/" + i for i in cache_list]
+    cache_list.extend(single_page_list)
+
+    for url in cache_list:
+        r = get_url(domain + url)
+        if r:
+            print(f"+++ success: {domain + url}")
+        else:
+            print(f"--- failed to get response from: {domain + url}")
+
+
 def seconds_until_next_hour() -> int:
     """return seconds until next hour"""
     now = datetime.now()
@@ -303,148 +649,116 @@ def seconds_until_next_hour() -> int:
     return int((next_hour - now).total_seconds())
 
 
-async def get_sensebox_data(box: pd.Series, timeframe: str) -> pd.DataFrame:
+async def get_sensebox_data(
+    box: pd.Series,
+    timeframe: str,
+    scheduler: IngestScheduler | None = None,
+    watermarks: dict[str, datetime] | None = None,
+) -> pd.DataFrame:
     ##########################################################
     # box comes as series -> new df with data from all sensors is created
     # 22 sec for emtpy table
+    # watermarks: {sensor_id: last written value}, sensors with a watermark are fetched from there on,
+    # all others from timeframe. The new watermarks are returned in box_df.attrs["watermarks"]
     ##########################################################
 
-    box_df = pd.DataFrame()  # create it empty and fill it with coordinates (location) and sensor data
+    if watermarks is None:
+        watermarks = {}
 
     box_name = box["name"]
     box_id = box["_id"]
-    coordinates = box["currentLocation"]["coordinates"]
-    grouptags = box["grouptag"]
 
-    # Attention! dataframe attr is experimental: https://pandas.pydata.org/docs/reference/api/pandas.DataFrame.attrs.html#pandas.DataFrame.attrs
-    # "pandas.concat copies attrs only if all input datasets have the same attrs."
-    box_df.attrs["box_id"] = box_id
-    box_df.attrs["box_name"] = box_name
+    # the metadata (SenseBoxTable, GroupTag, SensorsInfoTable) is written for all boxes at once: sync_box_metadata()
 
-    try:
-        # if any error happen here, a solution is in the part with GroupTag
-        sensebox_entry, created = await SenseBoxTable.objects.aupdate_or_create(sensebox_id=box_id)
-    except SenseBoxTable.MultipleObjectsReturned:
-        print(f"Multiple entries found for {box_name}")
-        await SenseBoxTable.objects.filter(sensebox_id=box_id).adelete()
-        sensebox_entry, created = await SenseBoxTable.objects.aupdate_or_create(sensebox_id=box_id)
-
-    if created:
-        try:
-            if sensebox_entry.location_latitude:
-                # print('Coordinates existing')
-                pass
-            else:
-                print(f"Writing coordinates: [{coordinates[1]} , {coordinates[0]}]")
-                sensebox_entry.location_latitude = coordinates[1]
-                sensebox_entry.location_longitude = coordinates[0]
-                # sensebox_entry.save()
-            if sensebox_entry.name:
-                pass
-            else:
-                print(f"Writing name: {box_name}")
-                sensebox_entry.name = box_name
-                # sensebox_entry.save()
-        except Exception as e:
-            print(f"SenseBox was not found in DB. Check >get_new_data.py< error: {e}")
-            pass
-
-        # some work to create grouptags in a parallel environment
-        # see also in the modell for GroupTag
-        if isinstance(grouptags, list):
-            for item in grouptags:
-                if item != "" or item == " ":
-                    # comments are the sync call - this funct is now async
-                    # try:
-                    #    with transaction.atomic():
-                    #        tag, tag_created = await GroupTag.objects.aupdate_or_create(tag=item)
-                    # except IntegrityError:
-                    #    tag = await GroupTag.objects.aget(tag=item)
-                    tag, tag_created = await GroupTag.objects.aupdate_or_create(tag=item)
-                    # sensebox_entry.grouptags.add(tag)
-                    await sync_to_async(sensebox_entry.grouptags.add)(tag)
-                    print(f"added tag {tag} to box {box_name}")
-
-        await sensebox_entry.asave()  # have some mercy to postgres and save only once
-
-    uniform_spelling_list = [
-        ["Temperatur", "Temperature", "Lufttemperatur", "Temperature (DHT11)", "temperature", "°C"],
-        [
-            "Luftfeuchtigkeit",
-            "Luftfeuchte",
-            "rel. Luftfeuchte",
-            "Humidity (DHT11)",
-            "Humidity",
-            "humidity",
-            "Moisture",
-            "%",
-        ],
-        ["Luftdruck", "atm. Luftdruck", "pressure", "hPa"],
-        ["PM10", "Staub 10µm", "pm10", "particle PM10", "µg/m³"],
-        ["PM2.5", "Staub 2.5µm", "pm2.5", "particle PM2.5", "µg/m³"],
-        ["Beleuchtungsstärke", "Beleuchtungsastärke", "lx"],
-        ["UV-Intensität", "μW/cm²"],
-        ["CO₂", "CO2", "ppm"],
-        ["Lautstärke", "dB"],
-    ]
+    sensors = []  # (title, sensor_id)
 
     for p in box["sensors"]:
         # print(f"All sensor {p}")
 
-        for this_list in uniform_spelling_list:
-            if p["title"] in this_list:  # and p["title"] != this_list[0]:
-                # print(f'Changed {p["title"]} to {this_list[0]}, unit {this_list[-1]}')
-                p["title"] = this_list[0]
-                p["unit"] = this_list[-1]
+        # changed in place: show_by_tag reads the units from the same sensor dicts
+        p["title"], p["unit"] = normalize_sensor(p["title"], p["unit"])
 
         title = p["title"]
         sensor_id = p["_id"]
-        unit = p["unit"]
 
-        # await SensorsInfoTable.objects.aget_or_create(name=title, unit=unit)
+        sensors.append((title, sensor_id))
 
-        try:
-            await SensorsInfoTable.objects.aget_or_create(name=title, unit=unit)
-        except MultipleObjectsReturned:
-            # delete all
-            await SensorsInfoTable.objects.filter(name=title, unit=unit).adelete()
-            # create new ...
-            await SensorsInfoTable.objects.acreate(name=title, unit=unit)
+    ##########################################################
+    # get all sensors of this box at the same time
+    ##########################################################
 
-        # get sensor and create df
-        url = f"https://api.opensensemap.org/boxes/{box_id}/data/{sensor_id}?format=json&from-date={timeframe}"
-        r_sensor = await get_url_async(url)
-        r_sensor_json = r_sensor.json()
-        sensor_df = pd.DataFrame.from_dict(r_sensor_json)
+    # budget per box, the global limit is set by the scheduler
+    sensor_semaphore = asyncio.Semaphore(getattr(settings, "INGEST_SENSORS_PER_BOX", 4))
+    sensor_timeout = getattr(settings, "INGEST_SENSOR_TIMEOUT", 60.0)
 
-        # print(f"sensor columns: {sensor_df.columns}")
+    async def fetch_sensor(sensor_id: str) -> tuple[np.ndarray, np.ndarray]:
+        if sensor_id in watermarks:
+            from_date = watermark_to_timeframe(watermarks[sensor_id])
+        else:
+            from_date = timeframe
+        url = f"{settings.OPENSENSEMAP_API_URL}/boxes/{box_id}/data/{sensor_id}?format=json&from-date={from_date}"
+        async with sensor_semaphore:
+            if scheduler:
+                # the timeout starts when the request is sent, not while it waits for a slot of the scheduler
+                r_sensor = await scheduler.get(url, timeout=sensor_timeout)
+            else:
+                r_sensor = await asyncio.wait_for(get_url_async(url), timeout=sensor_timeout)
+        # 404, 5xx after the retries: an error for the health ledger, not an empty answer ("no data")
+        r_sensor.raise_for_status()
+        # timestamps (int64 ns UTC) and values (float64) straight from the body, no DataFrame per sensor
+        return parse_sensor_response(r_sensor.content)
+
+    # failed sensors come back as exceptions, the other sensors are kept
+    sensor_results = await asyncio.gather(
+        *[fetch_sensor(sensor_id) for title, sensor_id in sensors], return_exceptions=True
+    )
+
+    new_watermarks = {}
+    sensor_series = {}  # title -> list of time indexed values (more than one sensor can have the same title)
+    errors = []
+
+    for (title, sensor_id), sensor_result in zip(sensors, sensor_results):
+        if isinstance(sensor_result, BaseException):
+            print(f">>>>>>>> Sensor {title} ({sensor_id}) of {box_name} failed: {sensor_result!r}")
+            errors.append(f"{title}: {sensor_result!r}")
+            continue
+
+        timestamps, values = sensor_result
+        if len(timestamps):
+            # every sensor gets its own time index: sensors don't report at the same time, or the same number of values
+            # calc mean of the aggregated values (per minute)
+            sensor_series.setdefault(title, []).append(minute_means(timestamps, values))
 
-        if "value" in sensor_df.columns:
-            box_df[title] = sensor_df["value"].astype(float)  # pydantic?
-            box_df["createdAt"] = sensor_df["createdAt"]
+            new_watermarks[sensor_id] = pd.Timestamp(int(timestamps.max()), tz="UTC").to_pydatetime()
 
     ##########################################################
     # Transform data
     ##########################################################
 
-    try:
-        box_df["createdAt"] = pd.to_datetime(box_df["createdAt"], format="%Y-%m-%dT%H:%M:%S.%fZ")
-    except KeyError as e:
-        print(f"KeyError: {e}")
+    if not sensor_series:
         print(f"Box {box_name} has no values in the selected timeframe. Returning empty df.")
         df = pd.DataFrame()
         df.attrs["box_id"] = box_id
         df.attrs["box_name"] = box_name
+        df.attrs["watermarks"] = {}
+        df.attrs["failed_sensors"] = len(errors)
+        # every sensor failed (time out, garbage): the health ledger counts this as error, not as "no data"
+        if errors and len(errors) == len(sensors):
+            df.attrs["error"] = errors[0]
         return df
-    box_df["createdAt"] = box_df["createdAt"].dt.floor("Min")
 
-    # calc mean of the aggregated values
-    box_df = box_df.groupby("createdAt", as_index=False).mean()
+    columns = {
+        title: series_list[0] if len(series_list) == 1 else pd.concat(series_list, axis=1, sort=True).mean(axis=1)
+        for title, series_list in sensor_series.items()
+    }
+
+    # one outer join on the (minute) timestamps -> one wide frame, a value is NaN where a sensor has no value
+    box_df = pd.concat(columns, axis=1, join="outer", sort=True)
 
     # box_df['createdAt'] = box_df['createdAt'].dt.tz_convert(tz='Europe/Berlin')
 
-    # set the time to index, InfluxDB need it this way
-    box_df = box_df.set_index("createdAt")
+    # the time is the index, InfluxDB need it this way
+    box_df.index.name = "createdAt"
 
     if box_df.empty:
         print(f"************************** SB got nothing back: {box_name}")
@@ -457,13 +771,38 @@ async def get_sensebox_data(box: pd.Series, timeframe: str) -> pd.DataFrame:
     # print(box_df.columns)
     # print(box_df.head())
 
+    # Attention! dataframe attr is experimental: https://pandas.pydata.org/docs/reference/api/pandas.DataFrame.attrs.html#pandas.DataFrame.attrs
+    # "pandas.concat copies attrs only if all input datasets have the same attrs." -> set them after all transformations
+    box_df.attrs["box_id"] = box_id
+    box_df.attrs["box_name"] = box_name
+    box_df.attrs["watermarks"] = new_watermarks
+    box_df.attrs["failed_sensors"] = len(errors)
+
     return box_df
 
 
-async def run_multithreaded(df: pd.DataFrame, timeframe: str) -> list[pd.DataFrame]:
-    args = [(box, timeframe) for index, box in df.iterrows()]
+async def run_multithreaded(
+    df: pd.DataFrame,
+    timeframe: str,
+    scheduler: IngestScheduler | None = None,
+    watermarks: dict[str, dict[str, datetime]] | None = None,
+) -> list[pd.DataFrame]:
+    # all requests go through the scheduler: global concurrency cap and rate limit per host
+    if scheduler is None:
+        scheduler = IngestScheduler()
+
+    if watermarks is None:
+        watermarks = {}
+
+    args = [(box, timeframe, scheduler, watermarks.get(box["_id"])) for index, box in df.iterrows()]
     tasks = [get_sensebox_data(*arg) for arg in args]
-    return await asyncio.gather(*tasks)
+
+    monitor = asyncio.create_task(scheduler.monitor())
+    try:
+        return await asyncio.gather(*tasks)
+    finally:
+        monitor.cancel()
+        print(scheduler.report())
 
 
 async def fetch_tile(url, cache_timeout=60 * 60 * 24):  # set cache 24 h
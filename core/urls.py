@@ -0,0 +1,8 @@
+from django.urls import path
+
+from .views import push
+
+urlpatterns = [
+    path("", push, name="push"),
+    path("<str:sensebox_id>", push, name="push_box"),
+]
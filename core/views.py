@@ -1,3 +1,44 @@
-from django.shortcuts import render
+import hmac
 
-# Create your views here.
+from django.conf import settings
+from django.http import HttpResponse, JsonResponse
+from django.views.decorators.csrf import csrf_exempt
+
+from core.push import PushError, get_push_buffer, parse_push
+
+
+def is_authorized(request) -> bool:
+    scheme, _, token = request.headers.get("Authorization", "").partition(" ")
+    if scheme.lower() != "bearer" or not token:
+        return False
+    # bytes: compare_digest refuses str with non-ASCII characters, a garbage token is a 401, not a 500
+    token = token.encode("utf-8")
+    return any(hmac.compare_digest(token, allowed.encode("utf-8")) for allowed in settings.PUSH_TOKENS)
+
+
+@csrf_exempt
+async def push(request, sensebox_id: str | None = None) -> HttpResponse:
+    # measurement batches of our own boxes and partners, see core/push.py
+    if request.method != "POST":
+        return JsonResponse({"error": "POST only"}, status=405, headers={"Allow": "POST"})
+    if not is_authorized(request):
+        return JsonResponse({"error": "invalid token"}, status=401, headers={"WWW-Authenticate": "Bearer"})
+
+    try:
+        frames, rejected = await parse_push(
+            request.body,
+            request.content_type or "",
+            sensebox_id,
+            precision=request.GET.get("precision", "ns"),
+        )
+    except PushError as e:
+        return JsonResponse({"error": str(e)}, status=400)
+
+    buffer = await get_push_buffer()
+    if not buffer.offer(frames):
+        # backpressure: the writer is behind (influx slow or down and spool full), try again later
+        retry_after = getattr(settings, "PUSH_RETRY_AFTER", 30)
+        return JsonResponse({"error": "buffer full"}, status=503, headers={"Retry-After": str(retry_after)})
+
+    accepted = sum(int(frame.count().sum()) for frame in frames)
+    return JsonResponse({"accepted": accepted, "rejected": rejected}, status=202)
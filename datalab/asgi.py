@@ -13,4 +13,11 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "datalab.settings.dev")
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# import after django is set up: the shared http clients need the settings
+from core.clients import install_daphne_shutdown_hook, lifespan_wrapper  # noqa: E402
+
+install_daphne_shutdown_hook()
+
+application = lifespan_wrapper(django_application)
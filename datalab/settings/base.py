@@ -173,6 +173,113 @@ CACHES = {
     }
 }
 
+# Celery (datalab/celery.py, tasks in core/tasks.py), same redis as the cache
+from celery.schedules import crontab  # noqa: E402
+
+CELERY_BROKER_URL = os.environ.get("CELERY_BROKER_URL", "redis://redis:6379/1")
+CELERY_RESULT_BACKEND = os.environ.get("CELERY_RESULT_BACKEND", "redis://redis:6379/2")  # needed for the chord
+CELERY_RESULT_EXPIRES = 60 * 60 * 24
+CELERY_TIMEZONE = "Europe/Berlin"
+CELERY_WORKER_MAX_TASKS_PER_CHILD = int(os.environ.get("CELERY_WORKER_MAX_TASKS_PER_CHILD", 100))  # memory of pandas
+CELERY_BEAT_SCHEDULE = {
+    "collect-data": {
+        "task": "core.tasks.collect_all",
+        "schedule": crontab(minute="*/10"),
+    },
+    "collect-fast-lane": {
+        "task": "core.tasks.collect_fast_lane_task",
+        "schedule": crontab(minute="*"),
+        "options": {"expires": 60},  # a late fast lane run is useless, the next one is already scheduled
+    },
+    "sync-metadata": {
+        "task": "core.tasks.sync_metadata_task",
+        "schedule": crontab(hour=2, minute=0),
+    },
+    "clear-table": {
+        "task": "core.tasks.clear_table_task",
+        "schedule": crontab(hour=2, minute=30),
+    },
+    "drain-spool": {
+        "task": "core.tasks.drain_spool_task",
+        "schedule": crontab(minute="*/5"),
+    },
+}
+# lock per location (core/ingest.py), renewed while a run is going, released at the end, expires if a worker dies
+INGEST_LOCK_TIMEOUT = int(os.environ.get("INGEST_LOCK_TIMEOUT", 60 * 60))
+INGEST_LOCK_REDIS_URL = os.environ.get("INGEST_LOCK_REDIS_URL", CACHES["default"]["LOCATION"])
+
+# Shared HTTP clients (core/clients.py)
+# one keep-alive pool per host, HTTP/2 is used when the package "h2" is installed
+HTTPX_HTTP2 = os.environ.get("HTTPX_HTTP2", "True") == "True"
+HTTPX_MAX_CONNECTIONS = int(os.environ.get("HTTPX_MAX_CONNECTIONS", 100))
+HTTPX_MAX_KEEPALIVE_CONNECTIONS = int(os.environ.get("HTTPX_MAX_KEEPALIVE_CONNECTIONS", 20))
+HTTPX_KEEPALIVE_EXPIRY = float(os.environ.get("HTTPX_KEEPALIVE_EXPIRY", 30.0))
+HTTPX_TIMEOUT = float(os.environ.get("HTTPX_TIMEOUT", 10.0))
+HTTPX_CONNECT_TIMEOUT = float(os.environ.get("HTTPX_CONNECT_TIMEOUT", 5.0))
+HTTPX_POOL_TIMEOUT = float(os.environ.get("HTTPX_POOL_TIMEOUT", 30.0))
+
+# Batched InfluxDB writer (core/influx.py)
+INFLUX_BATCH_SIZE = int(os.environ.get("INFLUX_BATCH_SIZE", 5000))  # points per write
+INFLUX_FLUSH_INTERVAL = float(os.environ.get("INFLUX_FLUSH_INTERVAL", 5.0))  # seconds
+INFLUX_MAX_RETRIES = int(os.environ.get("INFLUX_MAX_RETRIES", 5))
+INFLUX_GZIP = os.environ.get("INFLUX_GZIP", "True") == "True"
+# write-ahead spool (core/spool.py): batches go to disk first, drained to influx in the background
+INFLUX_SPOOL = os.environ.get("INFLUX_SPOOL", "True") == "True"
+INFLUX_SPOOL_DIR = os.environ.get("INFLUX_SPOOL_DIR", os.path.join(BASE_DIR, "spool"))
+INFLUX_SPOOL_MAX_MB = float(os.environ.get("INFLUX_SPOOL_MAX_MB", 1024))  # full: direct write, no spool
+
+# clear_table deletes boxes, sensor types and grouptags not seen in the catalog for this many days
+METADATA_RETENTION_DAYS = float(os.environ.get("METADATA_RETENTION_DAYS", 7))
+
+# opensensemap, can point to a local stand-in server (benchmark_ingest)
+OPENSENSEMAP_API_URL = os.environ.get("OPENSENSEMAP_API_URL", "https://api.opensensemap.org")
+
+# Ingest scheduler (core/scheduler.py)
+INGEST_MAX_CONCURRENCY = int(os.environ.get("INGEST_MAX_CONCURRENCY", 16))  # requests in flight, all hosts
+INGEST_RATE_LIMIT = float(os.environ.get("INGEST_RATE_LIMIT", 10.0))  # requests per second and host
+INGEST_RATE_BURST = int(os.environ.get("INGEST_RATE_BURST", 20))
+INGEST_MAX_RETRIES = int(os.environ.get("INGEST_MAX_RETRIES", 3))
+INGEST_ERROR_RATE_THRESHOLD = float(os.environ.get("INGEST_ERROR_RATE_THRESHOLD", 0.2))  # back off above this
+INGEST_REPORT_INTERVAL = float(os.environ.get("INGEST_REPORT_INTERVAL", 10.0))  # seconds
+INGEST_SENSORS_PER_BOX = int(os.environ.get("INGEST_SENSORS_PER_BOX", 4))  # sensors of one box fetched at once
+# seconds per request attempt, the wait for a slot of the scheduler is not counted
+INGEST_SENSOR_TIMEOUT = float(os.environ.get("INGEST_SENSOR_TIMEOUT", 60.0))
+INGEST_WRITERS = int(os.environ.get("INGEST_WRITERS", 2))  # workers writing finished boxes to influx
+INGEST_QUEUE_SIZE = int(os.environ.get("INGEST_QUEUE_SIZE", 20))  # finished boxes waiting for a writer
+# days to look back for sensors without watermark (new boxes), same as "collect_data -t"
+INGEST_BOOTSTRAP_LOOKBACK = float(os.environ.get("INGEST_BOOTSTRAP_LOOKBACK", 0.2))
+# "sensor": one request per sensor, "bulk": one csv per location and phenomenon (core/bulk.py), same as "collect_data --mode"
+INGEST_MODE = os.environ.get("INGEST_MODE", "sensor")
+INGEST_BULK_CHUNK_LINES = int(os.environ.get("INGEST_BULK_CHUNK_LINES", 50000))  # csv lines parsed at once
+# seconds per csv download, the wait for a slot of the scheduler is not counted
+INGEST_BULK_TIMEOUT = float(os.environ.get("INGEST_BULK_TIMEOUT", 900.0))
+# raw api responses for collect_data --archive/--replay (core/archive.py)
+INGEST_ARCHIVE_DIR = os.environ.get("INGEST_ARCHIVE_DIR", os.path.join(BASE_DIR, "archive"))
+# polling cadence per box (core/cadence.py), in seconds. collect_data runs every 10 minutes
+INGEST_CADENCE_MIN = float(os.environ.get("INGEST_CADENCE_MIN", 600.0))  # fast boxes: every tick
+INGEST_CADENCE_DEFAULT = float(os.environ.get("INGEST_CADENCE_DEFAULT", 3600.0))  # boxes without known interval
+INGEST_CADENCE_MAX = float(os.environ.get("INGEST_CADENCE_MAX", 6 * 3600.0))  # stalled boxes
+# circuit breaker per box (core/health.py)
+INGEST_BREAKER_THRESHOLD = int(os.environ.get("INGEST_BREAKER_THRESHOLD", 5))  # failures in a row, then open
+INGEST_BREAKER_BASE = float(os.environ.get("INGEST_BREAKER_BASE", 1800.0))  # seconds open, doubled per failed probe
+INGEST_BREAKER_MAX = float(os.environ.get("INGEST_BREAKER_MAX", 2 * 86400.0))
+INGEST_BREAKER_NO_DATA_AFTER = float(os.environ.get("INGEST_BREAKER_NO_DATA_AFTER", 86400.0))  # silent box = failing
+# fast lane for the live dashboards (core/fast_lane.py, collect_fast_lane every minute)
+INGEST_FAST_LANE_VIEW_TTL = int(os.environ.get("INGEST_FAST_LANE_VIEW_TTL", 600))  # seconds a viewed tag stays in
+INGEST_FAST_LANE_MAX_AGE = int(os.environ.get("INGEST_FAST_LANE_MAX_AGE", 180))  # seconds, older: ask the api
+INGEST_FAST_LANE_CONCURRENCY = int(os.environ.get("INGEST_FAST_LANE_CONCURRENCY", 4))
+INGEST_FAST_LANE_RATE = float(os.environ.get("INGEST_FAST_LANE_RATE", 2.0))  # requests per second
+INGEST_FAST_LANE_LOOKBACK = float(os.environ.get("INGEST_FAST_LANE_LOOKBACK", 1.0 + 1 / 24))  # days, see show_by_tag
+
+# canonical sensor names (core/sensor_names.py): seconds until a process looks for changed aliases
+SENSOR_ALIAS_CHECK_INTERVAL = int(os.environ.get("SENSOR_ALIAS_CHECK_INTERVAL", 60))
+
+# push ingest (core/push.py): POST /push/<box id>, header "Authorization: Bearer <token>"
+PUSH_TOKENS = [token for token in os.environ.get("PUSH_TOKENS", "").split(",") if token]  # comma separated
+PUSH_MAX_VALUES = int(os.environ.get("PUSH_MAX_VALUES", 10000))  # values per request
+PUSH_QUEUE_SIZE = int(os.environ.get("PUSH_QUEUE_SIZE", 1000))  # box frames waiting for the influx writer
+PUSH_RETRY_AFTER = int(os.environ.get("PUSH_RETRY_AFTER", 30))  # seconds, answer when the queue is full
+
 WAGTAIL_SITE_NAME = "datalab"
 
 CSRF_TRUSTED_ORIGINS = ["https://lab.taschenfussel.de"]
@@ -32,8 +32,87 @@ class SensorsInfoTable(admin.ModelAdmin):
     )
 
 
+@admin.register(GroupTag)
+class GroupTagAdmin(admin.ModelAdmin):
+    list_display = ("tag", "featured")
+
+    list_filter = ("featured",)
+
+    search_fields = ("tag",)
+
+
 @admin.register(SenseBoxLocation)
 class SenseBoxLocationAdmin(admin.ModelAdmin):
-    list_display = ("name", "location_latitude", "location_longitude", "maxDistance", "exposure")
+    list_display = (
+        "name",
+        "location_latitude",
+        "location_longitude",
+        "maxDistance",
+        "exposure",
+        "ingest_max_concurrency",
+        "ingest_rate_limit",
+    )
 
     list_filter = ("name",)
+
+    filter_horizontal = ("phenomena",)
+
+
+class SensorAliasInline(admin.TabularInline):
+    model = SensorAlias
+    extra = 1
+
+
+@admin.register(Phenomenon)
+class PhenomenonAdmin(admin.ModelAdmin):
+    list_display = ("name", "unit", "enabled")
+
+    list_filter = ("enabled",)
+
+    inlines = [SensorAliasInline]
+
+
+@admin.register(SensorAlias)
+class SensorAliasAdmin(admin.ModelAdmin):
+    list_display = ("title", "unit", "phenomenon")
+
+    list_filter = ("phenomenon",)
+
+    search_fields = ("title",)
+
+
+@admin.register(SensorWatermark)
+class SensorWatermarkAdmin(admin.ModelAdmin):
+    list_display = ("sensebox_id", "sensor_id", "last_measurement_at")
+
+    search_fields = ("sensebox_id", "sensor_id")
+
+
+@admin.register(BoxIngestState)
+class BoxIngestStateAdmin(admin.ModelAdmin):
+    list_display = (
+        "sensebox_id",
+        "median_interval",
+        "last_seen",
+        "next_due_at",
+        "consecutive_failures",
+        "last_success_at",
+        "avg_latency",
+        "open_until",
+        "last_error",
+    )
+
+    list_filter = ("open_until",)
+
+    search_fields = ("sensebox_id", "last_error")
+
+    ordering = ("-consecutive_failures",)
+
+
+@admin.register(BackfillWindow)
+class BackfillWindowAdmin(admin.ModelAdmin):
+    list_display = ("sensebox_id", "sensor_id", "window_start", "window_end", "points", "completed_at")
+
+    search_fields = ("sensebox_id", "sensor_id")
+
+    ordering = ("-window_start",)
@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class CoreConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'home'
+
+    def ready(self):
+        # signals: saving a SensorAlias or Phenomenon invalidates the sensor name index
+        import core.sensor_names  # noqa: F401
@@ -0,0 +1,27 @@
+# Generated by Django 5.1.6 on 2026-10-18 09:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('home', '0058_rename_sensor_name_sensorsinfotable_name_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SensorWatermark',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('sensebox_id', models.CharField(help_text='ID der SenseBox', max_length=255)),
+                ('sensor_id', models.CharField(help_text='ID des Sensors', max_length=255)),
+                ('last_measurement_at', models.DateTimeField(help_text='Zeitpunkt des letzten Messwerts, der in die InfluxDB geschrieben wurde. Nächster Abruf startet hier.')),
+            ],
+            options={
+                'verbose_name': 'Sensor Watermark',
+                'verbose_name_plural': 'Sensor Watermarks',
+                'constraints': [models.UniqueConstraint(fields=('sensebox_id', 'sensor_id'), name='unique_sensor_watermark_constraint')],
+            },
+        ),
+    ]
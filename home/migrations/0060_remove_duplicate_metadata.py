@@ -0,0 +1,34 @@
+# Generated by Django 5.1.6 on 2026-10-18 10:02
+
+from django.db import migrations
+
+
+def remove_duplicates(apps, schema_editor):
+    # the old ingest could create duplicates in parallel runs, keep the oldest entry
+    SenseBoxTable = apps.get_model("home", "SenseBoxTable")
+    SensorsInfoTable = apps.get_model("home", "SensorsInfoTable")
+
+    seen = set()
+    for entry in SenseBoxTable.objects.order_by("pk"):
+        if entry.sensebox_id in seen:
+            entry.delete()
+        else:
+            seen.add(entry.sensebox_id)
+
+    seen = set()
+    for entry in SensorsInfoTable.objects.order_by("pk"):
+        if (entry.name, entry.unit) in seen:
+            entry.delete()
+        else:
+            seen.add((entry.name, entry.unit))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('home', '0059_sensorwatermark'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicates, migrations.RunPython.noop),
+    ]
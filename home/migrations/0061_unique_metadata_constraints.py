@@ -0,0 +1,30 @@
+# Generated by Django 5.1.6 on 2026-10-18 10:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    # separate migration: the deletes in 0060 leave pending (deferred) foreign key checks, postgres refuses ALTER TABLE then
+    dependencies = [
+        ('home', '0060_remove_duplicate_metadata'),
+    ]
+
+    operations = [
+        migrations.RemoveConstraint(
+            model_name='grouptag',
+            name='unique_tag_constraint',
+        ),
+        migrations.AddConstraint(
+            model_name='grouptag',
+            constraint=models.UniqueConstraint(fields=('tag',), name='unique_tag_constraint'),
+        ),
+        migrations.AddConstraint(
+            model_name='senseboxtable',
+            constraint=models.UniqueConstraint(fields=('sensebox_id',), name='unique_sensebox_id_constraint'),
+        ),
+        migrations.AddConstraint(
+            model_name='sensorsinfotable',
+            constraint=models.UniqueConstraint(fields=('name', 'unit'), name='unique_sensor_name_unit_constraint'),
+        ),
+    ]
@@ -0,0 +1,50 @@
+# Generated by Django 5.1.6 on 2026-10-18 10:31
+
+from django.db import migrations, models
+
+# the sensors shown in hexmap, draw_graph and the dashboards (first names of uniform_spelling_list in core/tools.py)
+DEFAULT_PHENOMENA = [
+    "Temperatur",
+    "Luftfeuchtigkeit",
+    "Luftdruck",
+    "PM10",
+    "PM2.5",
+    "Beleuchtungsstärke",
+    "UV-Intensität",
+    "CO₂",
+    "Lautstärke",
+]
+
+
+def create_phenomena(apps, schema_editor):
+    Phenomenon = apps.get_model("home", "Phenomenon")
+    for name in DEFAULT_PHENOMENA:
+        Phenomenon.objects.get_or_create(name=name)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('home', '0061_unique_metadata_constraints'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Phenomenon',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(help_text='Einheitlicher Name des Sensors (wie in der Sensors Info Table), z.B. Temperatur, PM10', max_length=255, unique=True)),
+                ('enabled', models.BooleanField(default=True, help_text='Nur Sensoren mit aktivierten Phänomenen werden abgerufen (wenn der Ort nichts anderes festlegt)')),
+            ],
+            options={
+                'verbose_name': 'Phenomenon',
+                'verbose_name_plural': 'Phenomena',
+            },
+        ),
+        migrations.AddField(
+            model_name='senseboxlocation',
+            name='phenomena',
+            field=models.ManyToManyField(blank=True, help_text='(optional) Nur diese Phänomene für diesen Ort abrufen. Leer: alle aktivierten Phänomene', to='home.phenomenon'),
+        ),
+        migrations.RunPython(create_phenomena, migrations.RunPython.noop),
+    ]
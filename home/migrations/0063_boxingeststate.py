@@ -0,0 +1,28 @@
+# Generated by Django 5.1.6 on 2026-10-18 15:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('home', '0062_phenomenon_senseboxlocation_phenomena'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BoxIngestState',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('sensebox_id', models.CharField(help_text='ID der SenseBox', max_length=255)),
+                ('median_interval', models.FloatField(blank=True, help_text='Median der Abstände zwischen zwei Messungen der Box in Sekunden', null=True)),
+                ('last_seen', models.DateTimeField(blank=True, help_text='Zeitpunkt der letzten Messung der Box', null=True)),
+                ('next_due_at', models.DateTimeField(blank=True, help_text='Ab diesem Zeitpunkt wird die Box beim nächsten collect_data abgerufen.', null=True)),
+            ],
+            options={
+                'verbose_name': 'Box Ingest State',
+                'verbose_name_plural': 'Box Ingest States',
+                'constraints': [models.UniqueConstraint(fields=('sensebox_id',), name='unique_box_ingest_state_constraint')],
+            },
+        ),
+    ]
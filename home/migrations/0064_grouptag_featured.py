@@ -0,0 +1,18 @@
+# Generated by Django 5.1.6 on 2026-10-18 16:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('home', '0063_boxingeststate'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='grouptag',
+            name='featured',
+            field=models.BooleanField(default=False, help_text='Boxen mit diesem Group Tag werden jede Minute abgerufen (collect_fast_lane), nicht nur wenn das Dashboard gerade angesehen wird.'),
+        ),
+    ]
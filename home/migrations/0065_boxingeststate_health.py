@@ -0,0 +1,38 @@
+# Generated by Django 5.1.6 on 2026-10-18 16:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('home', '0064_grouptag_featured'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='boxingeststate',
+            name='avg_latency',
+            field=models.FloatField(blank=True, help_text='Durchschnittliche Dauer eines Abrufs in Sekunden', null=True),
+        ),
+        migrations.AddField(
+            model_name='boxingeststate',
+            name='consecutive_failures',
+            field=models.PositiveIntegerField(default=0, help_text='Fehlgeschlagene Abrufe in Folge'),
+        ),
+        migrations.AddField(
+            model_name='boxingeststate',
+            name='last_error',
+            field=models.CharField(blank=True, default='', help_text='Letzte Fehlermeldung', max_length=255),
+        ),
+        migrations.AddField(
+            model_name='boxingeststate',
+            name='last_success_at',
+            field=models.DateTimeField(blank=True, help_text='Zeitpunkt des letzten erfolgreichen Abrufs', null=True),
+        ),
+        migrations.AddField(
+            model_name='boxingeststate',
+            name='open_until',
+            field=models.DateTimeField(blank=True, help_text='Circuit Breaker: bis zu diesem Zeitpunkt wird die Box nicht abgerufen, danach ein Versuch.', null=True),
+        ),
+    ]
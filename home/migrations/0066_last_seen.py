@@ -0,0 +1,37 @@
+# Generated by Django 5.1.6 on 2026-10-18 17:20
+
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def mark_existing_rows_seen(apps, schema_editor):
+    # rows from before this migration: the sweep of clear_table starts counting now
+    now = timezone.now()
+    for model_name in ["SenseBoxTable", "SensorsInfoTable", "GroupTag"]:
+        apps.get_model("home", model_name).objects.filter(last_seen=None).update(last_seen=now)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('home', '0065_boxingeststate_health'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='grouptag',
+            name='last_seen',
+            field=models.DateTimeField(blank=True, db_index=True, help_text='Zuletzt im Katalog gesehen. Wird von clear_table aufgeräumt.', null=True),
+        ),
+        migrations.AddField(
+            model_name='senseboxtable',
+            name='last_seen',
+            field=models.DateTimeField(blank=True, db_index=True, help_text='Zuletzt im Katalog oder mit neuen Messwerten gesehen. Wird von clear_table aufgeräumt.', null=True),
+        ),
+        migrations.AddField(
+            model_name='sensorsinfotable',
+            name='last_seen',
+            field=models.DateTimeField(blank=True, db_index=True, help_text='Zuletzt im Katalog gesehen. Wird von clear_table aufgeräumt.', null=True),
+        ),
+        migrations.RunPython(mark_existing_rows_seen, migrations.RunPython.noop),
+    ]
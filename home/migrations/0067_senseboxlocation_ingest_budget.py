@@ -0,0 +1,23 @@
+# Generated by Django 5.1.6 on 2026-10-18 18:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('home', '0066_last_seen'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='senseboxlocation',
+            name='ingest_max_concurrency',
+            field=models.PositiveIntegerField(blank=True, help_text='(optional) Gleichzeitige Anfragen beim Abruf dieses Ortes. Leer: INGEST_MAX_CONCURRENCY', null=True),
+        ),
+        migrations.AddField(
+            model_name='senseboxlocation',
+            name='ingest_rate_limit',
+            field=models.FloatField(blank=True, help_text='(optional) Anfragen pro Sekunde beim Abruf dieses Ortes. Leer: INGEST_RATE_LIMIT', null=True),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.1.6 on 2026-10-18 19:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('home', '0067_senseboxlocation_ingest_budget'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BackfillWindow',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('sensebox_id', models.CharField(help_text='ID der SenseBox', max_length=255)),
+                ('sensor_id', models.CharField(help_text='ID des Sensors', max_length=255)),
+                ('window_start', models.DateTimeField(help_text='Beginn des Zeitfensters')),
+                ('window_end', models.DateTimeField(help_text='Ende des Zeitfensters')),
+                ('points', models.PositiveIntegerField(default=0, help_text='Anzahl der geschriebenen Werte (Minuten)')),
+                ('completed_at', models.DateTimeField(auto_now=True, help_text='Zeitpunkt, an dem das Zeitfenster geschrieben wurde')),
+            ],
+            options={
+                'verbose_name': 'Backfill Window',
+                'verbose_name_plural': 'Backfill Windows',
+                'constraints': [models.UniqueConstraint(fields=('sensebox_id', 'sensor_id', 'window_start', 'window_end'), name='unique_backfill_window_constraint')],
+            },
+        ),
+    ]
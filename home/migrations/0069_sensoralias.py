@@ -0,0 +1,59 @@
+# Generated by Django 5.1.6 on 2026-10-18 20:15
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+# the former uniform_spelling_list of core/tools.py: canonical name, aliases, canonical unit
+# (the units were matched as titles as well, they are no aliases: "µg/m³" belongs to PM10 and PM2.5)
+DEFAULT_ALIASES = [
+    ["Temperatur", "Temperature", "Lufttemperatur", "Temperature (DHT11)", "temperature", "°C"],
+    ["Luftfeuchtigkeit", "Luftfeuchte", "rel. Luftfeuchte", "Humidity (DHT11)", "Humidity", "humidity", "Moisture", "%"],
+    ["Luftdruck", "atm. Luftdruck", "pressure", "hPa"],
+    ["PM10", "Staub 10µm", "pm10", "particle PM10", "µg/m³"],
+    ["PM2.5", "Staub 2.5µm", "pm2.5", "particle PM2.5", "µg/m³"],
+    ["Beleuchtungsstärke", "Beleuchtungsastärke", "lx"],
+    ["UV-Intensität", "μW/cm²"],
+    ["CO₂", "CO2", "ppm"],
+    ["Lautstärke", "dB"],
+]
+
+
+def create_aliases(apps, schema_editor):
+    Phenomenon = apps.get_model("home", "Phenomenon")
+    SensorAlias = apps.get_model("home", "SensorAlias")
+    for name, *aliases, unit in DEFAULT_ALIASES:
+        phenomenon, created = Phenomenon.objects.get_or_create(name=name)
+        phenomenon.unit = unit
+        phenomenon.save(update_fields=["unit"])
+        for title in aliases:
+            SensorAlias.objects.get_or_create(title=title, unit="", defaults={"phenomenon": phenomenon})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('home', '0068_backfillwindow'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='phenomenon',
+            name='unit',
+            field=models.CharField(blank=True, default='', help_text='Einheitliche Einheit, z.B. °C. Leer: Einheit der Box', max_length=255),
+        ),
+        migrations.CreateModel(
+            name='SensorAlias',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('title', models.CharField(help_text='Name des Sensors, wie er von der Box kommt, z.B. Temperature', max_length=255)),
+                ('unit', models.CharField(blank=True, default='', help_text='(optional) Nur für Sensoren mit dieser Einheit. Leer: jede Einheit', max_length=255)),
+                ('phenomenon', models.ForeignKey(help_text='Einheitlicher Name des Sensors', on_delete=django.db.models.deletion.CASCADE, related_name='aliases', to='home.phenomenon')),
+            ],
+            options={
+                'verbose_name': 'Sensor Alias',
+                'verbose_name_plural': 'Sensor Aliases',
+                'constraints': [models.UniqueConstraint(fields=('title', 'unit'), name='unique_sensor_alias_constraint')],
+            },
+        ),
+        migrations.RunPython(create_aliases, migrations.RunPython.noop),
+    ]
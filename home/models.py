@@ -7,6 +7,50 @@ from wagtail.models import Page
 from home import blocks as block
 
 
+class Phenomenon(models.Model):
+    class Meta:
+        verbose_name_plural = "Phenomena"
+        verbose_name = "Phenomenon"
+
+    name = models.CharField(
+        max_length=255,
+        unique=True,
+        help_text="Einheitlicher Name des Sensors (wie in der Sensors Info Table), z.B. Temperatur, PM10",
+    )
+    enabled = models.BooleanField(
+        default=True,
+        help_text="Nur Sensoren mit aktivierten Phänomenen werden abgerufen (wenn der Ort nichts anderes festlegt)",
+    )
+    unit = models.CharField(
+        max_length=255, blank=True, default="", help_text="Einheitliche Einheit, z.B. °C. Leer: Einheit der Box"
+    )
+
+    def __str__(self):
+        return f"{self.name}"
+
+
+class SensorAlias(models.Model):
+    class Meta:
+        verbose_name_plural = "Sensor Aliases"
+        verbose_name = "Sensor Alias"
+        constraints = [models.UniqueConstraint(fields=["title", "unit"], name="unique_sensor_alias_constraint")]
+
+    # see core/sensor_names.py: raw title (and unit) of opensensemap -> phenomenon
+    title = models.CharField(max_length=255, help_text="Name des Sensors, wie er von der Box kommt, z.B. Temperature")
+    unit = models.CharField(
+        max_length=255,
+        blank=True,
+        default="",
+        help_text="(optional) Nur für Sensoren mit dieser Einheit. Leer: jede Einheit",
+    )
+    phenomenon = models.ForeignKey(
+        Phenomenon, on_delete=models.CASCADE, related_name="aliases", help_text="Einheitlicher Name des Sensors"
+    )
+
+    def __str__(self):
+        return f"{self.title} ({self.unit or '*'}) -> {self.phenomenon}"
+
+
 class SenseBoxLocation(models.Model):
     class Meta:
         verbose_name_plural = "SenseBox Locations"
@@ -32,14 +76,37 @@ class SenseBoxLocation(models.Model):
         default="outdoor",
         help_text='Welche Art von Sensor soll dargestellt werden? Erlaubte Werte: "indoor", "outdoor", "mobile", "unknown"',
     )
+    phenomena = models.ManyToManyField(
+        Phenomenon,
+        blank=True,
+        help_text="(optional) Nur diese Phänomene für diesen Ort abrufen. Leer: alle aktivierten Phänomene",
+    )
+    ingest_max_concurrency = models.PositiveIntegerField(
+        null=True,
+        blank=True,
+        help_text="(optional) Gleichzeitige Anfragen beim Abruf dieses Ortes. Leer: INGEST_MAX_CONCURRENCY",
+    )
+    ingest_rate_limit = models.FloatField(
+        null=True,
+        blank=True,
+        help_text="(optional) Anfragen pro Sekunde beim Abruf dieses Ortes. Leer: INGEST_RATE_LIMIT",
+    )
 
 
 class GroupTag(models.Model):
     tag = models.CharField(max_length=255)
+    featured = models.BooleanField(
+        default=False,
+        help_text="Boxen mit diesem Group Tag werden jede Minute abgerufen (collect_fast_lane), nicht nur wenn das Dashboard gerade angesehen wird.",
+    )
+    last_seen = models.DateTimeField(
+        null=True, blank=True, db_index=True, help_text="Zuletzt im Katalog gesehen. Wird von clear_table aufgeräumt."
+    )
 
     class Meta:
         constraints = [
-            models.UniqueConstraint(fields=["tag"], name="unique_tag_constraint", deferrable=models.Deferrable.DEFERRED)
+            # not deferrable: bulk_create(ignore_conflicts=True) needs the conflict right away (ON CONFLICT)
+            models.UniqueConstraint(fields=["tag"], name="unique_tag_constraint")
         ]
 
     def __str__(self):
@@ -50,6 +117,7 @@ class SenseBoxTable(models.Model):
     class Meta:
         verbose_name_plural = "SenseBox Table"
         verbose_name = "SenseBox"
+        constraints = [models.UniqueConstraint(fields=["sensebox_id"], name="unique_sensebox_id_constraint")]
 
     sensebox_id = models.CharField(max_length=255, help_text="ID der SenseBox")
     name = models.CharField(
@@ -68,6 +136,12 @@ class SenseBoxTable(models.Model):
         null=True,
         help_text="Fehlermeldung der Box. Möglicherweise offline, fehlerhafte Werte etc. Box dann entfernen.",
     )
+    last_seen = models.DateTimeField(
+        null=True,
+        blank=True,
+        db_index=True,
+        help_text="Zuletzt im Katalog oder mit neuen Messwerten gesehen. Wird von clear_table aufgeräumt.",
+    )
     textfield = models.TextField(help_text="(optional) Textfeld für Notizen", blank=True)
 
     def __str__(self):
@@ -78,10 +152,14 @@ class SensorsInfoTable(models.Model):
     class Meta:
         verbose_name_plural = "Sensors Info Table"
         verbose_name = "Sensors Info"
+        constraints = [models.UniqueConstraint(fields=["name", "unit"], name="unique_sensor_name_unit_constraint")]
 
     # sensor_id = models.CharField(max_length=255, help_text='Sensor ID')
     name = models.CharField(max_length=255, help_text="Sensor Name")
     unit = models.CharField(max_length=255, help_text="Sensor Unit")
+    last_seen = models.DateTimeField(
+        null=True, blank=True, db_index=True, help_text="Zuletzt im Katalog gesehen. Wird von clear_table aufgeräumt."
+    )
     # sensor_type = models.CharField(max_length=255, help_text='Sensor Type')
     # box_name = models.CharField(max_length=255, blank=True, help_text='Name des Sensors')
     # box_grouptag = models.CharField(max_length=255, blank=True, help_text='Box Grouptag')
@@ -92,6 +170,79 @@ class SensorsInfoTable(models.Model):
         return f"{self.name} - {self.unit}"
 
 
+class SensorWatermark(models.Model):
+    class Meta:
+        verbose_name_plural = "Sensor Watermarks"
+        verbose_name = "Sensor Watermark"
+        constraints = [
+            models.UniqueConstraint(fields=["sensebox_id", "sensor_id"], name="unique_sensor_watermark_constraint")
+        ]
+
+    # no foreign keys: SenseBoxTable is cleared every night, the watermarks have to survive this
+    sensebox_id = models.CharField(max_length=255, help_text="ID der SenseBox")
+    sensor_id = models.CharField(max_length=255, help_text="ID des Sensors")
+    last_measurement_at = models.DateTimeField(
+        help_text="Zeitpunkt des letzten Messwerts, der in die InfluxDB geschrieben wurde. Nächster Abruf startet hier."
+    )
+
+    def __str__(self):
+        return f"{self.sensebox_id} / {self.sensor_id}: {self.last_measurement_at}"
+
+
+class BoxIngestState(models.Model):
+    class Meta:
+        verbose_name_plural = "Box Ingest States"
+        verbose_name = "Box Ingest State"
+        constraints = [models.UniqueConstraint(fields=["sensebox_id"], name="unique_box_ingest_state_constraint")]
+
+    # no foreign key, same as SensorWatermark
+    sensebox_id = models.CharField(max_length=255, help_text="ID der SenseBox")
+    median_interval = models.FloatField(
+        null=True, blank=True, help_text="Median der Abstände zwischen zwei Messungen der Box in Sekunden"
+    )
+    last_seen = models.DateTimeField(null=True, blank=True, help_text="Zeitpunkt der letzten Messung der Box")
+    next_due_at = models.DateTimeField(
+        null=True, blank=True, help_text="Ab diesem Zeitpunkt wird die Box beim nächsten collect_data abgerufen."
+    )
+
+    # health ledger, see core/health.py
+    consecutive_failures = models.PositiveIntegerField(default=0, help_text="Fehlgeschlagene Abrufe in Folge")
+    last_success_at = models.DateTimeField(null=True, blank=True, help_text="Zeitpunkt des letzten erfolgreichen Abrufs")
+    last_error = models.CharField(max_length=255, blank=True, default="", help_text="Letzte Fehlermeldung")
+    avg_latency = models.FloatField(null=True, blank=True, help_text="Durchschnittliche Dauer eines Abrufs in Sekunden")
+    open_until = models.DateTimeField(
+        null=True,
+        blank=True,
+        help_text="Circuit Breaker: bis zu diesem Zeitpunkt wird die Box nicht abgerufen, danach ein Versuch.",
+    )
+
+    def __str__(self):
+        return f"{self.sensebox_id}: next {self.next_due_at}"
+
+
+class BackfillWindow(models.Model):
+    class Meta:
+        verbose_name_plural = "Backfill Windows"
+        verbose_name = "Backfill Window"
+        constraints = [
+            models.UniqueConstraint(
+                fields=["sensebox_id", "sensor_id", "window_start", "window_end"],
+                name="unique_backfill_window_constraint",
+            )
+        ]
+
+    # checkpoint of the backfill command: a completed window is not fetched again, when the backfill is restarted
+    sensebox_id = models.CharField(max_length=255, help_text="ID der SenseBox")
+    sensor_id = models.CharField(max_length=255, help_text="ID des Sensors")
+    window_start = models.DateTimeField(help_text="Beginn des Zeitfensters")
+    window_end = models.DateTimeField(help_text="Ende des Zeitfensters")
+    points = models.PositiveIntegerField(default=0, help_text="Anzahl der geschriebenen Werte (Minuten)")
+    completed_at = models.DateTimeField(auto_now=True, help_text="Zeitpunkt, an dem das Zeitfenster geschrieben wurde")
+
+    def __str__(self):
+        return f"{self.sensebox_id} / {self.sensor_id}: {self.window_start} - {self.window_end}"
+
+
 class HomePage(Page):
     parent_page_types = ["wagtailcore.Page"]
 
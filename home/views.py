@@ -22,6 +22,8 @@ from influxdb_client import InfluxDBClient
 from plotly.subplots import make_subplots
 from pyproj import Transformer
 
+from core.fast_lane import is_tag_fresh, read_boxes_from_influx, record_tag_view
+from core.sensor_names import canonical_unit, normalize_sensor
 from core.tools import (
     SenseBoxTable,
     calculate_centroid,
@@ -75,9 +77,12 @@ async def draw_graph(request, sensebox_id: str):
     # add units to column name -> make them available in the graph later
     columns_with_units = []
     for column in column_list:
-        entry = await SensorsInfoTable.objects.filter(name=column).afirst()
-        if entry:
-            unit = entry.unit
+        # the fields are canonical names (normalize_sensor), their unit comes from the phenomenon
+        unit = canonical_unit(column)
+        if unit is None:
+            entry = await SensorsInfoTable.objects.filter(name=column).afirst()
+            unit = entry.unit if entry else None
+        if unit is not None:
             new_column_name = f"{column} ({unit})"
             columns_with_units.append(new_column_name)
             df.rename(columns={column: new_column_name}, inplace=True)
@@ -1190,6 +1195,9 @@ async def show_by_tag(request, region: str = "Berlin", box: str = "all", cache_t
     old_unique_name = request.GET.get("unique_name", "empty") # legacy
     tag = request.GET.get("tag", "Humboldt Explorers")
 
+    # viewed tags are collected every minute by collect_fast_lane
+    await record_tag_view(tag)
+
     df = await get_latest_boxes_with_distance_as_df(region, cache_time=cache_time)
 
     # remove all boxes with empty grouptags
@@ -1230,13 +1238,23 @@ async def show_by_tag(request, region: str = "Berlin", box: str = "all", cache_t
     # Use caching here to store data for a short time
     cache_key = f"{tag}-{timeframe}"
     results = cache.get(cache_key)
-    if results is None:
-        print("No multiprocessing results in cache")
-        # this function calls all boxes with the selected tag!
-        results = await run_multithreaded(df, timeframe)
-        cache.set(cache_key, results, timeout=cache_time)
-    else:
+    if results is not None:
         print("Got multiprocessing results from cache")
+    else:
+        if await is_tag_fresh(tag):
+            # the fast lane collected this tag a moment ago, influx is up to date
+            try:
+                results = await sync_to_async(read_boxes_from_influx)(df) or None
+                print("Got results for tag from influx (fast lane)")
+            except Exception as e:
+                print(f">>>>>>>> Influx read for tag {tag} failed, ask the api: {e!r}")
+
+        if results is None:
+            print("No multiprocessing results in cache")
+            # this function calls all boxes with the selected tag!
+            results = await run_multithreaded(df, timeframe)
+
+        cache.set(cache_key, results, timeout=cache_time)
 
     df.drop(
         columns=[
@@ -1257,7 +1275,9 @@ async def show_by_tag(request, region: str = "Berlin", box: str = "all", cache_t
         # create a dict to use it later to match sensor title with unit to display
         unit_dict = {}
         for s in s_box["sensors"]:
-            unit_dict[s["title"]] = {"unit": s["unit"], "sensorId": s["_id"]}
+            # uniform spelling, the same titles as the columns of the results
+            title, unit = normalize_sensor(s["title"], s["unit"])
+            unit_dict[title] = {"unit": unit, "sensorId": s["_id"]}
 
         # a combined dict that will act as a row later in the df
         for r in results:  # get one sensor after another as df